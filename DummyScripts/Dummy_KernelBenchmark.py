@@ -0,0 +1,52 @@
+from timeit import default_timer as timer
+
+import numpy
+
+from ECAgent.Environments import *
+from ECAgent.Kernels import NUMBA_AVAILABLE, getKernels
+
+
+def benchmark(name, func, repeats=5):
+    func()  # Warm up (compiles the Numba kernels)
+    start = timer()
+    for _ in range(repeats):
+        func()
+    print('{:<32}{:.6f}s'.format(name, (timer() - start) / repeats))
+
+
+def runBenchmarks(backend):
+    print('Backend: ' + backend)
+    kernels = getKernels(backend)
+    rng = numpy.random.default_rng(0)
+
+    layer = rng.random((1000, 1000))
+    benchmark('diffuse (1000x1000)', lambda: kernels.diffuse(layer, 0.2, toroidal=True, moore=True))
+
+    cellIDs = rng.integers(0, layer.size, 10000)
+    benchmark('neighbourIDs (x10000)', lambda: [kernels.neighbourIDs(c, layer.shape, 2) for c in cellIDs])
+
+    counts = numpy.zeros(layer.shape, dtype=numpy.int32)
+    oldIDs, newIDs = rng.integers(0, layer.size, 1000000), rng.integers(0, layer.size, 1000000)
+    benchmark('updateOccupancy (10^6)', lambda: kernels.updateOccupancy(counts, oldIDs, newIDs))
+
+    positions = rng.integers(0, 1000, (1000000, 2))
+    deltas = rng.integers(-1, 2, (1000000, 2))
+    benchmark('movePositions (10^6)', lambda: kernels.movePositions(positions, deltas, (1000, 1000), True))
+
+    model = Model()
+    model.environment = GridWorld(200, 200, model, backend=backend)
+    for i in range(10000):
+        model.environment.addAgent(Agent(str(i), model), int(positions[i, 0]) % 200, int(positions[i, 1]) % 200)
+    model.environment.trackDensity()
+    agentIDs = list(model.environment.agents.keys())
+    benchmark('GridWorld.moveAgents (10^4)', lambda: model.environment.moveAgents(agentIDs, deltas[:10000], True))
+    print()
+
+
+if __name__ == '__main__':
+    runBenchmarks('numpy')
+
+    if NUMBA_AVAILABLE:
+        runBenchmarks('numba')
+    else:
+        print('Numba is not installed. Skipping the Numba benchmarks.')
@@ -0,0 +1,823 @@
+import itertools
+import sys
+import weakref
+
+import numpy
+import pandas
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Shared memory is only available in Python 3.8+
+    shared_memory = None
+
+
+def toCellDType(dtype):
+    """Returns the dtype used to store cell values of dtype. Strings are stored as objects because fixed-width string
+    arrays would silently truncate longer strings written to the layer later."""
+    dtype = numpy.dtype(dtype)
+    return numpy.dtype(object) if dtype.kind in 'US' else dtype
+
+
+def toLayerArray(values, shape: tuple):
+    """Converts values into a NumPy array with the supplied shape. Scalars are broadcast to every cell. Lists of
+    non-scalar values (tuples, lists, dicts, etc.) are stored in an object array so that every cell holds exactly one
+    value. Strings are also stored in object arrays (see toCellDType())."""
+    array = _toLayerArray(values, shape)
+    return array.astype(toCellDType(array.dtype), copy=False)
+
+
+def _toLayerArray(values, shape: tuple):
+
+    size = int(numpy.prod(shape))
+
+    if isinstance(values, (list, tuple)):
+        if len(values) != size:
+            raise Exception("Cannot create a cell layer of size " + str(size) + " from " + str(len(values)) + " "
+                            "values.")
+        try:
+            array = numpy.array(values)
+        except ValueError:  # Ragged sequences cannot be turned into a regular array
+            array = None
+
+        if array is None or array.ndim != 1:
+            array = numpy.empty(size, dtype=object)
+            for i in range(size):
+                array[i] = values[i]
+
+        return array.reshape(shape)
+
+    array = numpy.asarray(values)
+
+    if array.ndim == 0:
+        return numpy.full(shape, array)
+    elif array.size != size:
+        # Arrays built from sparse coordinates only need to broadcast to the shape of the layer
+        try:
+            return numpy.broadcast_to(array, shape).copy()
+        except ValueError:
+            raise Exception("Cannot create a cell layer with shape " + str(shape) + " from an array "
+                            "with shape " + str(array.shape) + ".")
+
+    return array.reshape(shape)
+
+
+class CellPositions:
+    """A read-only sequence of cell coordinates. Coordinates are computed from the cell's ID on demand so no
+    per-cell tuples are ever stored. 1D worlds yield ints while 2D and 3D worlds yield (x, y) and (x, y, z) tuples."""
+
+    __slots__ = ['dimensions', 'size']
+
+    def __init__(self, dimensions: tuple):
+        self.dimensions = dimensions
+        self.size = int(numpy.prod(dimensions))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, cellID: int):
+        if cellID < 0 or cellID >= self.size:
+            raise IndexError("Cell " + str(cellID) + " is not in the world.")
+
+        if len(self.dimensions) == 1:
+            return int(cellID)
+
+        pos = []
+        for dim in self.dimensions:
+            cellID, coord = divmod(int(cellID), dim)
+            pos.append(coord)
+
+        return tuple(pos)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+
+def _toSharedArray(block, shape: tuple, dtype):
+    """Returns an array backed by a shared memory block. The array and its views share a memoryview of the block's
+    buffer that keeps the memory mapped for as long as any of them are alive. The block is closed by a finalizer once
+    that memoryview is garbage collected."""
+    array = numpy.frombuffer(block.buf, dtype=dtype, count=int(numpy.prod(shape, dtype=numpy.int64)))
+    finalizer = weakref.finalize(array.base, block.close)
+    finalizer.atexit = False  # Arrays that are still alive at exit are unmapped by the OS
+    return array.reshape(shape)
+
+
+def _releaseBlocks(blocks: dict):
+    """Unlinks and closes shared memory blocks. Blocks that are still used by an array are closed once the array is
+    garbage collected (see _toSharedArray())."""
+    for block in blocks.values():
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            block.close()
+        except BufferError:  # The arrays that use the block close it when they are garbage collected
+            pass
+    blocks.clear()
+
+
+def attachSharedLayer(descriptor: tuple):
+    """Attaches to a shared cell layer from another process using a descriptor returned by SharedLayers.getDescriptor().
+    Returns the layer as a NumPy array and the SharedMemory block it lives in. Reading and writing the array does not
+    copy any data. The block is closed (not unlinked) once the array and its views are garbage collected.
+
+    The process should be started with multiprocessing by the process that owns the layer."""
+    if shared_memory is None:
+        raise Exception("Shared cell layers require Python 3.8 or later.")
+
+    blockName, shape, dtype = descriptor
+    if sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name=blockName, track=False)
+    else:
+        # Processes started by multiprocessing share their parent's resource tracker so the block is not unlinked
+        # when they exit
+        block = shared_memory.SharedMemory(name=blockName)
+
+    return _toSharedArray(block, shape, numpy.dtype(dtype)), block
+
+
+class SharedLayers:
+    """ SharedLayers is a registry of arrays that live in multiprocessing.shared_memory blocks. Worker processes can
+    attach to an array by passing its descriptor (see getDescriptor()) to attachSharedLayer() and then read and write
+    it without pickling or copying it.
+
+    Every Model owns a SharedLayers registry (see Model.getSharedLayers()) and releases its blocks when Model.close()
+    is called. The blocks are also released when the registry is garbage collected."""
+
+    __slots__ = ['blocks', 'descriptors', 'finalizer', '__weakref__']
+
+    def __init__(self):
+        if shared_memory is None:
+            raise Exception("Shared cell layers require Python 3.8 or later.")
+
+        self.blocks = {}
+        self.descriptors = {}
+        self.finalizer = weakref.finalize(self, _releaseBlocks, self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, key: str):
+        return key in self.blocks
+
+    def create(self, key: str, values):
+        """Copies values into a new shared memory block registered as key and returns the array backed by it"""
+        if key in self.blocks:
+            raise Exception("A shared layer is already registered as " + str(key))
+
+        values = numpy.asarray(values)
+        if values.dtype == object:
+            raise Exception("Cannot share a cell layer of Python objects.")
+
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        array = _toSharedArray(block, values.shape, values.dtype)
+        array[...] = values
+
+        self.blocks[key] = block
+        self.descriptors[key] = (block.name, values.shape, values.dtype.str)
+        return array
+
+    def getDescriptor(self, key: str) -> tuple:
+        """Returns the (block name, shape, dtype) descriptor of the shared layer registered as key. Descriptors are
+        small and picklable so they can be sent to worker processes."""
+        return self.descriptors[key]
+
+    def release(self, key: str):
+        """Releases the shared memory block registered as key"""
+        _releaseBlocks({key: self.blocks.pop(key)})
+        del self.descriptors[key]
+
+    def close(self):
+        """Releases all of the shared memory blocks"""
+        _releaseBlocks(self.blocks)
+        self.descriptors.clear()
+
+
+class CellLayers:
+    """ CellLayers stores the cell data of a discrete world as a dict of named NumPy arrays called layers.
+    The dimensions of the world are supplied as (width[, height[, depth]]) and every layer is shaped in row-major
+    order, i.e. (width,), (height, width) or (depth, height, width). A layer can therefore be indexed as
+    layer[y, x] and its flattened index is the cell ID returned by discreteGridPosToID.
+
+    Cell coordinates are not stored. Accessing cells['pos'] returns a CellPositions sequence that computes them on
+    demand. Use getValue() and setValue() for O(1) access to a single cell and to_dataframe() to export the layers
+    as a pandas DataFrame.
+
+    Layers can also be added lazily using addLayer(). A lazy layer's initialiser is only called the first time the
+    layer is accessed. Layers that are too large for memory can be backed by a file using mapLayer() and layers that
+    worker processes need to access can be moved into shared memory using shareLayer()."""
+
+    __slots__ = ['dimensions', 'shape', 'size', 'layers', 'lazy', 'shared', 'versions', 'frozen']
+
+    def __init__(self, dimensions: tuple):
+        self.dimensions = tuple(int(dim) for dim in dimensions)
+        self.shape = tuple(reversed(self.dimensions))
+        self.size = int(numpy.prod(self.shape))
+        self.layers = {}
+        self.lazy = {}
+        self.shared = {}  # Maps the name of a shared layer to its array and descriptor
+        self.versions = {}  # Maps the name of a layer to the number of times it has been modified
+        self.frozen = {}  # Maps the name of a layer to the array that was made read-only by freeze()
+
+    def __len__(self):
+        """Returns the number of cells in the world"""
+        return self.size
+
+    def __contains__(self, name: str):
+        return name == 'pos' or name in self.layers or name in self.lazy
+
+    def __getitem__(self, name: str):
+        """ Returns the layer called name. cells['pos'] returns the coordinates of every cell.
+        Lazy layers are materialised the first time they are accessed."""
+        if name == 'pos':
+            return CellPositions(self.dimensions)
+        elif name in self.lazy:
+            self.layers[name] = toLayerArray(self.lazy.pop(name)(), self.shape)
+        elif name not in self.layers:
+            raise KeyError("No cell layer named " + str(name))
+
+        return self.layers[name]
+
+    def __setitem__(self, name: str, values):
+        """Adds or replaces the layer called name. See toLayerArray() for the values that are accepted."""
+        if name == 'pos':
+            raise Exception("The 'pos' layer is computed by the world and cannot be assigned.")
+
+        self.lazy.pop(name, None)
+        self.layers[name] = toLayerArray(values, self.shape)
+        self.markModified(name)
+
+    def __delitem__(self, name: str):
+        if name in self.lazy:
+            del self.lazy[name]
+        else:
+            self.markModified(name)
+            del self.layers[name]
+
+    def markModified(self, name: str):
+        """Records that layer 'name' has been modified. Caches built from the layer (see SummedAreaTables) are rebuilt
+        the next time they are used. Writes made through CellLayers (assignment, setValue(), etc.) and CellLayerSystems
+        are recorded automatically but this must be called before writing to a layer's array directly. Layers that a
+        cache has been built from are read-only until it is called, so writes that skip it raise a ValueError instead
+        of leaving the cache stale."""
+        layer = self.frozen.pop(name, None)
+        if layer is not None:
+            layer.flags.writeable = True
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    def freeze(self, name: str):
+        """Makes the array of layer 'name' read-only until markModified(name) is called. Layers that are already
+        read-only (like mapped layers opened in 'r' mode) are left as they are."""
+        layer = self[name]
+        if name not in self.frozen and layer.flags.writeable:
+            layer.flags.writeable = False
+            self.frozen[name] = layer
+
+    def getVersion(self, name: str) -> int:
+        """Returns the number of times layer 'name' has been modified"""
+        return self.versions.get(name, 0)
+
+    def keys(self):
+        """Returns the names of all of the layers, including lazy layers that have not been materialised yet"""
+        return list(self.layers.keys()) + list(self.lazy.keys())
+
+    def isLazy(self, name: str) -> bool:
+        """Returns True if layer 'name' is lazy and has not been materialised yet"""
+        return name in self.lazy
+
+    def addLayer(self, name: str, generator, mode: str = 'cell', lazy: bool = False, rng=None):
+        """Adds a layer called name that is initialised by the generator functor. The mode determines how the
+        generator is called:
+            'cell': generator(pos, cells) is called once per cell and returns that cell's value.
+            'coords': generator(x[, y[, z]]) is called once with the coordinate arrays of the cells (see
+            coordinates(sparse=True)) and returns an array that broadcasts to the shape of the layer.
+            'shape': generator(shape, rng) is called once with the shape of the layer and a numpy Generator and
+            returns an array with that shape.
+
+        If lazy is True, the generator is only called when the layer is first accessed."""
+
+        if mode == 'cell':
+            def initialiser():
+                return [generator(pos, self) for pos in self['pos']]
+        elif mode == 'coords':
+            def initialiser():
+                return generator(*self.coordinates(sparse=True))
+        elif mode == 'shape':
+            if rng is None:
+                rng = numpy.random.default_rng()
+
+            def initialiser():
+                return generator(self.shape, rng)
+        else:
+            raise Exception("Unknown cell initialiser mode: " + str(mode))
+
+        self.layers.pop(name, None)
+        self.lazy[name] = initialiser
+
+        if not lazy:
+            self[name]
+
+    def mapLayer(self, name: str, path: str, mode: str = 'r', dtype=None, offset: int = 0):
+        """Adds a layer called name that is backed by a memory-mapped file instead of memory. Only the pages of the
+        file that are accessed are loaded, so layers can be larger than the memory available.
+
+        Files ending in '.npy' are opened with numpy.load() and their dtype and size are read from the file. All other
+        files are treated as raw binary arrays of dtype starting at offset bytes. The file must contain exactly one
+        value per cell in row-major order. The mode determines how the file is opened:
+            'r': read-only, writing to the layer raises an error.
+            'c': copy-on-write, writes change the layer in memory but are never saved to the file.
+            'r+': read-write, writes are saved to the file (see flush())."""
+
+        if mode not in ('r', 'c', 'r+'):
+            raise Exception("Cannot map a cell layer with mode " + str(mode) + ". Use 'r', 'c' or 'r+'.")
+
+        if path.endswith('.npy'):
+            array = numpy.load(path, mmap_mode=mode)
+        elif dtype is None:
+            raise Exception("A dtype must be supplied to map a raw cell layer file.")
+        else:
+            array = numpy.memmap(path, dtype=dtype, mode=mode, offset=offset)
+
+        if array.size != self.size:
+            raise Exception("Cannot map a cell layer with " + str(self.size) + " cells to " + path + " because it "
+                            "contains " + str(array.size) + " values.")
+
+        self.lazy.pop(name, None)
+        self.layers[name] = array.reshape(self.shape)
+        self.markModified(name)
+
+    def isMapped(self, name: str) -> bool:
+        """Returns True if layer 'name' is backed by a memory-mapped file"""
+        return name in self.layers and isinstance(self.layers[name], numpy.memmap)
+
+    def flush(self):
+        """Writes any changes made to layers mapped in 'r+' mode to their files"""
+        for name in self.layers:
+            if self.isMapped(name):
+                self.layers[name].flush()
+
+    def shareLayer(self, name: str, registry: SharedLayers, key: str = None) -> tuple:
+        """Moves layer 'name' into a shared memory block of the registry (registered as key, or name if key is None)
+        and returns its descriptor. Worker processes can attach to the layer with attachSharedLayer(descriptor)."""
+        key = name if key is None else key
+        array = registry.create(key, self[name])
+
+        self.layers[name] = array
+        self.shared[name] = (array, registry.getDescriptor(key))
+        self.markModified(name)
+        return self.shared[name][1]
+
+    def isShared(self, name: str) -> bool:
+        """Returns True if layer 'name' lives in shared memory"""
+        return name in self.shared and self.layers.get(name) is self.shared[name][0]
+
+    def getSharedDescriptors(self) -> dict:
+        """Returns the descriptors of all of the shared layers"""
+        return {name: shared[1] for name, shared in self.shared.items() if self.isShared(name)}
+
+    def saveLayer(self, name: str, path: str):
+        """Saves layer 'name' as a '.npy' file that can be mapped with mapLayer()"""
+        numpy.save(path, self[name])
+
+    def getValue(self, name: str, cellID: int):
+        """Returns the value of layer 'name' at cell cellID"""
+        return self[name].flat[cellID]
+
+    def setValue(self, name: str, cellID: int, value):
+        """Sets the value of layer 'name' at cell cellID"""
+        self.markModified(name)
+        self[name].flat[cellID] = value
+
+    def getValues(self, name: str, cellIDs):
+        """Returns the values of layer 'name' at each of the cells in cellIDs"""
+        return self[name].reshape(-1)[numpy.asarray(cellIDs, dtype=numpy.int64)]
+
+    def getPosition(self, cellID: int):
+        """Returns the coordinates of the cell with ID = cellID"""
+        return CellPositions(self.dimensions)[cellID]
+
+    def getCell(self, cellID: int) -> dict:
+        """Returns a dict containing the position of cell cellID and its value in each layer"""
+        cell = {'pos': self.getPosition(cellID)}
+        for name in self.keys():
+            cell[name] = self.getValue(name, cellID)
+        return cell
+
+    def coordinates(self, sparse: bool = False):
+        """Returns the (x[, y[, z]]) coordinate arrays of every cell. Each array has the same shape as a layer. If
+        sparse is True, the arrays are returned with singleton dimensions so that they broadcast against each other
+        without allocating a full array per axis."""
+        return tuple(reversed(numpy.indices(self.shape, sparse=sparse)))
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Exports the cell layers as a pandas DataFrame with one row per cell. The 'pos' column contains the
+        coordinates of each cell."""
+        data = {'pos': list(self['pos'])}
+        for name in self.keys():
+            data[name] = list(self[name].reshape(-1)) if self[name].dtype == object else self[name].reshape(-1)
+
+        return pandas.DataFrame(data)
+
+
+class SummedAreaTables:
+    """ SummedAreaTables answers queries about the total, mean and number of cells in rectangular windows of the numeric
+    layers of a CellLayers object in O(1) time per window, regardless of the size of the window. It does this by
+    caching a summed-area table (integral image) of each layer that is queried. A table is rebuilt the next time it
+    is used after its layer has been modified (see CellLayers.markModified()). Layers are frozen (made read-only) while
+    their table is cached, so writing to one without calling markModified() first raises a ValueError.
+
+    Windows are supplied as arrays of lower (inclusive) and upper (exclusive) (x[, y[, z]]) corners, one row per window,
+    so many agents can be answered at once. Windows are clipped to the edges of the world."""
+
+    __slots__ = ['cells', 'tables']
+
+    def __init__(self, cells: CellLayers):
+        self.cells = cells
+        self.tables = {}  # Maps the name of a layer to the (layer, version, table) the table was built from
+
+    def getTable(self, name: str):
+        """Returns the summed-area table of layer 'name'. The table has one more element than the layer along each axis
+        and table[i, j] is the sum of layer[:i, :j]."""
+        layer = self.cells[name]
+        version = self.cells.getVersion(name)
+
+        cached = self.tables.get(name)
+        if cached is not None and cached[0] is layer and cached[1] == version:
+            return cached[2]
+
+        if layer.dtype == object:
+            raise Exception("Cannot build a summed-area table of the non-numeric cell layer " + str(name))
+
+        dtype = numpy.float64 if numpy.issubdtype(layer.dtype, numpy.inexact) else numpy.int64
+        table = numpy.zeros(tuple(n + 1 for n in layer.shape), dtype=dtype)
+        cumulative = layer.astype(dtype)
+        for axis in range(layer.ndim):
+            cumulative = numpy.cumsum(cumulative, axis=axis)
+        table[(slice(1, None),) * layer.ndim] = cumulative
+
+        self.tables[name] = (layer, version, table)
+        self.cells.freeze(name)
+        return table
+
+    def clear(self):
+        """Discards all of the cached tables"""
+        self.tables.clear()
+
+    def _toBounds(self, lower, upper):
+        """Converts the (x[, y[, z]]) corners of windows into clipped array indices, ordered like the layer's axes"""
+        ndim = len(self.cells.shape)
+        lower = numpy.asarray(lower, dtype=numpy.int64).reshape(-1, ndim)[:, ::-1]
+        upper = numpy.asarray(upper, dtype=numpy.int64).reshape(-1, ndim)[:, ::-1]
+
+        limits = numpy.array(self.cells.shape, dtype=numpy.int64)
+        lower = numpy.clip(lower, 0, limits)
+        upper = numpy.maximum(numpy.clip(upper, 0, limits), lower)
+        return lower, upper
+
+    def getSums(self, name: str, lower, upper):
+        """Returns the sum of layer 'name' in each window"""
+        table = self.getTable(name)
+        lower, upper = self._toBounds(lower, upper)
+        ndim = table.ndim
+
+        sums = numpy.zeros(len(lower), dtype=table.dtype)
+        for corner in itertools.product((0, 1), repeat=ndim):
+            index = tuple(numpy.where(corner[axis], upper[:, axis], lower[:, axis]) for axis in range(ndim))
+            sign = 1 if (ndim - sum(corner)) % 2 == 0 else -1
+            sums += sign * table[index]
+
+        return sums
+
+    def getCounts(self, lower, upper):
+        """Returns the number of cells in each window"""
+        lower, upper = self._toBounds(lower, upper)
+        return numpy.prod(upper - lower, axis=1)
+
+    def getMeans(self, name: str, lower, upper):
+        """Returns the mean of layer 'name' in each window. Empty windows have a mean of NaN."""
+        counts = self.getCounts(lower, upper)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return self.getSums(name, lower, upper) / counts
+
+    def _toWindows(self, positions, radius: int):
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, len(self.cells.shape))
+        return positions - radius, positions + radius + 1
+
+    def getSumsInRadius(self, name: str, positions, radius: int):
+        """Returns the sum of layer 'name' in the (2 * radius + 1) wide square (or cube) around each (x[, y[, z]])
+        position. This covers the same cells as getNeighbours() with moore = True."""
+        return self.getSums(name, *self._toWindows(positions, radius))
+
+    def getCountsInRadius(self, positions, radius: int):
+        """Returns the number of cells in the (2 * radius + 1) wide square (or cube) around each position"""
+        return self.getCounts(*self._toWindows(positions, radius))
+
+    def getMeansInRadius(self, name: str, positions, radius: int):
+        """Returns the mean of layer 'name' in the (2 * radius + 1) wide square (or cube) around each position"""
+        return self.getMeans(name, *self._toWindows(positions, radius))
+
+
+class ChunkedLayer:
+    """ A cell layer that is split into chunks (tiles) of shape chunkShape. Chunks are only allocated when they are
+    first written to. Reading from an unallocated chunk returns the layer's default value. If the layer has an
+    initialiser, a chunk is generated by calling initialiser(lower, upper) the first time it is accessed instead,
+    where lower and upper are the (inclusive, exclusive) array indices of the chunk.
+
+    A ChunkedLayer is indexed like a NumPy array in row-major order (layer[y, x] for 2D worlds) using ints and
+    slices with a step of 1. Slicing returns a dense copy of the region, so avoid slicing the whole layer of a very
+    large world."""
+
+    __slots__ = ['shape', 'chunkShape', 'default', 'dtype', 'initialiser', 'chunks']
+
+    def __init__(self, shape: tuple, chunkShape: tuple, default=0.0, dtype=None, initialiser=None):
+        self.shape = tuple(shape)
+        self.chunkShape = tuple(chunkShape)
+        self.default = default
+        self.dtype = toCellDType(dtype) if dtype is not None else (
+            toCellDType(numpy.asarray(default).dtype) if initialiser is None else None)
+        self.initialiser = initialiser
+        self.chunks = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(numpy.prod(self.shape))
+
+    def getChunkBounds(self, chunkIndex: tuple):
+        """Returns the (inclusive) lower and (exclusive) upper array indices covered by a chunk"""
+        lower = tuple(c * s for c, s in zip(chunkIndex, self.chunkShape))
+        upper = tuple(min(lo + s, n) for lo, s, n in zip(lower, self.chunkShape, self.shape))
+        return lower, upper
+
+    def getChunk(self, chunkIndex: tuple, allocate: bool = False):
+        """Returns the array of the chunk with the supplied chunk index. Unallocated chunks return None unless the
+        layer has an initialiser or allocate is True, in which case the chunk is created."""
+        chunk = self.chunks.get(chunkIndex)
+        if chunk is not None or not (allocate or self.initialiser is not None):
+            return chunk
+
+        lower, upper = self.getChunkBounds(chunkIndex)
+        chunkShape = tuple(hi - lo for lo, hi in zip(lower, upper))
+
+        if self.initialiser is not None:
+            chunk = toLayerArray(self.initialiser(lower, upper), chunkShape)
+            if self.dtype is None:
+                self.dtype = chunk.dtype
+            chunk = chunk.astype(self.dtype, copy=False)
+        else:
+            chunk = numpy.full(chunkShape, self.default, dtype=self.dtype)
+
+        self.chunks[chunkIndex] = chunk
+        return chunk
+
+    def allocatedChunks(self) -> int:
+        """Returns the number of chunks that have been allocated"""
+        return len(self.chunks)
+
+    def _toRegion(self, key):
+        """Converts an index into the lower and upper bounds of a region and the axes that should be squeezed"""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices for a layer with " + str(self.ndim) + " dimensions.")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        lower, upper, squeeze = [], [], []
+        for axis in range(self.ndim):
+            n = self.shape[axis]
+            if isinstance(key[axis], slice):
+                start, stop, step = key[axis].indices(n)
+                if step != 1:
+                    raise IndexError("ChunkedLayers only support slices with a step of 1.")
+                lower.append(start)
+                upper.append(max(start, stop))
+            else:
+                i = int(key[axis])
+                i = i + n if i < 0 else i
+                if i < 0 or i >= n:
+                    raise IndexError("Index " + str(key[axis]) + " is out of bounds for axis " + str(axis) + ".")
+                lower.append(i)
+                upper.append(i + 1)
+                squeeze.append(axis)
+
+        return lower, upper, tuple(squeeze)
+
+    def _chunksInRegion(self, lower, upper):
+        """Yields the index of every chunk that overlaps the region and the overlapping slices of the region and of
+        the chunk"""
+        ranges = [range(lo // s, (hi - 1) // s + 1) if hi > lo else range(0)
+                  for lo, hi, s in zip(lower, upper, self.chunkShape)]
+
+        for chunkIndex in itertools.product(*ranges):
+            chunkLower, chunkUpper = self.getChunkBounds(chunkIndex)
+            overlapLower = [max(a, b) for a, b in zip(lower, chunkLower)]
+            overlapUpper = [min(a, b) for a, b in zip(upper, chunkUpper)]
+
+            regionSlice = tuple(slice(lo - r, hi - r) for lo, hi, r in zip(overlapLower, overlapUpper, lower))
+            chunkSlice = tuple(slice(lo - c, hi - c) for lo, hi, c in zip(overlapLower, overlapUpper, chunkLower))
+            yield chunkIndex, regionSlice, chunkSlice
+
+    def __getitem__(self, key):
+        lower, upper, squeeze = self._toRegion(key)
+
+        if len(squeeze) == self.ndim:  # Fast path for a single cell
+            chunkIndex = tuple(i // s for i, s in zip(lower, self.chunkShape))
+            chunk = self.getChunk(chunkIndex)
+            if chunk is None:
+                return self.default
+            return chunk[tuple(i - c * s for i, c, s in zip(lower, chunkIndex, self.chunkShape))]
+
+        # Chunks are generated before the region is allocated because the first generated chunk sets the layer's dtype
+        overlaps = [(self.getChunk(chunkIndex), regionSlice, chunkSlice)
+                    for chunkIndex, regionSlice, chunkSlice in self._chunksInRegion(lower, upper)]
+
+        region = numpy.full([hi - lo for lo, hi in zip(lower, upper)], self.default, dtype=self.dtype)
+        for chunk, regionSlice, chunkSlice in overlaps:
+            if chunk is not None:
+                region[regionSlice] = chunk[chunkSlice]
+
+        return region.squeeze(axis=squeeze) if len(squeeze) > 0 else region
+
+    def __setitem__(self, key, value):
+        lower, upper, squeeze = self._toRegion(key)
+        regionShape = [hi - lo for lo, hi in zip(lower, upper)]
+        value = numpy.asarray(value)
+        if value.ndim > 0 and len(squeeze) > 0:
+            value = numpy.expand_dims(value, squeeze)
+        value = numpy.broadcast_to(value, regionShape)
+
+        for chunkIndex, regionSlice, chunkSlice in self._chunksInRegion(lower, upper):
+            self.getChunk(chunkIndex, allocate=True)[chunkSlice] = value[regionSlice]
+
+    def getValues(self, cellIDs):
+        """Returns the values of the cells with the supplied (flat) IDs as an array. Cells are gathered one chunk at
+        a time."""
+        cellIDs = numpy.asarray(cellIDs, dtype=numpy.int64)
+        coords = numpy.unravel_index(cellIDs, self.shape)
+        chunkCoords = [c // s for c, s in zip(coords, self.chunkShape)]
+
+        chunkCounts = [(n - 1) // s + 1 for n, s in zip(self.shape, self.chunkShape)]
+        chunkIDs = numpy.ravel_multi_index(chunkCoords, chunkCounts)
+        overlaps = []
+        for chunkID in numpy.unique(chunkIDs):
+            mask = chunkIDs == chunkID
+            chunkIndex = tuple(int(c[mask][0]) for c in chunkCoords)
+            overlaps.append((chunkIndex, mask, self.getChunk(chunkIndex)))
+
+        # The chunks are generated first because the first generated chunk sets the layer's dtype
+        values = numpy.full(cellIDs.shape, self.default, dtype=self.dtype)
+        for chunkIndex, mask, chunk in overlaps:
+            if chunk is not None:
+                if values.dtype != chunk.dtype:
+                    values = values.astype(numpy.result_type(values, chunk))
+                values[mask] = chunk[tuple(c[mask] - i * s for c, i, s in zip(coords, chunkIndex, self.chunkShape))]
+
+        return values
+
+    def toArray(self):
+        """Returns the whole layer as a dense NumPy array"""
+        return self[tuple(slice(None) for _ in self.shape)]
+
+
+class ChunkedCellLayers:
+    """ ChunkedCellLayers stores the cell data of a discrete world as ChunkedLayers. It has the same interface as
+    CellLayers but layers are split into chunks of chunkSize cells along each axis and chunks are only allocated when
+    they are written to (or, for generated layers, when they are first accessed). This allows worlds that are much
+    larger than the memory available as long as only a small part of the world is used.
+
+    Assigning a scalar to a layer (cells['food'] = 0.0) creates a layer with that default value without allocating
+    any chunks. Layers added through addLayer() are generated one chunk at a time:
+        'cell': generator(pos, cells) is called for every cell in the chunk.
+        'coords': generator(x[, y[, z]]) is called with the sparse coordinate arrays of the chunk.
+        'shape': generator(shape, rng) is called with the shape of the chunk and a numpy Generator that is seeded
+        per chunk, so the layer does not depend on the order in which chunks are accessed."""
+
+    __slots__ = ['dimensions', 'shape', 'size', 'chunkShape', 'layers', 'versions']
+
+    def __init__(self, dimensions: tuple, chunkSize: int = 256):
+
+        if chunkSize < 1:
+            raise Exception("Cannot create ChunkedCellLayers with a chunkSize < 1.")
+
+        self.dimensions = tuple(int(dim) for dim in dimensions)
+        self.shape = tuple(reversed(self.dimensions))
+        self.size = int(numpy.prod(self.shape))
+        self.chunkShape = tuple(min(chunkSize, n) for n in self.shape)
+        self.layers = {}
+        self.versions = {}
+
+    def __len__(self):
+        """Returns the number of cells in the world"""
+        return self.size
+
+    def __contains__(self, name: str):
+        return name == 'pos' or name in self.layers
+
+    def __getitem__(self, name: str):
+        """ Returns the ChunkedLayer called name. cells['pos'] returns the coordinates of every cell."""
+        if name == 'pos':
+            return CellPositions(self.dimensions)
+        elif name not in self.layers:
+            raise KeyError("No cell layer named " + str(name))
+
+        return self.layers[name]
+
+    def __setitem__(self, name: str, values):
+        """Adds or replaces the layer called name. Scalars create a layer with that default value, arrays are split
+        into chunks."""
+        if name == 'pos':
+            raise Exception("The 'pos' layer is computed by the world and cannot be assigned.")
+
+        if isinstance(values, ChunkedLayer):
+            self.layers[name] = values
+        elif numpy.ndim(values) == 0:
+            self.layers[name] = ChunkedLayer(self.shape, self.chunkShape, default=values)
+        else:
+            array = toLayerArray(values, self.shape)
+            layer = ChunkedLayer(self.shape, self.chunkShape, default=numpy.zeros(1, dtype=array.dtype)[0],
+                                 dtype=array.dtype)
+            layer[tuple(slice(None) for _ in self.shape)] = array
+            self.layers[name] = layer
+
+        self.markModified(name)
+
+    def __delitem__(self, name: str):
+        del self.layers[name]
+
+    def markModified(self, name: str):
+        """Records that layer 'name' has been modified. See CellLayers.markModified()."""
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    def getVersion(self, name: str) -> int:
+        """Returns the number of times layer 'name' has been modified"""
+        return self.versions.get(name, 0)
+
+    def keys(self):
+        """Returns the names of all of the layers"""
+        return list(self.layers.keys())
+
+    def isLazy(self, name: str) -> bool:
+        """Returns True if layer 'name' is generated on demand"""
+        return self[name].initialiser is not None
+
+    def addLayer(self, name: str, generator, mode: str = 'cell', lazy: bool = True, rng=None, default=0.0):
+        """Adds a layer called name whose chunks are generated by the generator functor when they are first accessed.
+        See the class description for the supported modes. Chunked layers are always generated lazily so lazy is
+        ignored. Cells outside of the chunks that have been generated are never read so default is only used as
+        the fill value of regions before they are generated."""
+
+        if mode == 'cell':
+            def initialiser(lower, upper):
+                indices = itertools.product(*[range(lo, hi) for lo, hi in zip(lower, upper)])
+                return [generator(self.getPosition(numpy.ravel_multi_index(index, self.shape)), self)
+                        for index in indices]
+        elif mode == 'coords':
+            def initialiser(lower, upper):
+                grids = numpy.ogrid[tuple(slice(lo, hi) for lo, hi in zip(lower, upper))]
+                return generator(*reversed(grids))
+        elif mode == 'shape':
+            seed = int((rng if rng is not None else numpy.random.default_rng()).integers(2 ** 63))
+
+            def initialiser(lower, upper):
+                chunkRNG = numpy.random.default_rng([seed] + list(lower))
+                return generator(tuple(hi - lo for lo, hi in zip(lower, upper)), chunkRNG)
+        else:
+            raise Exception("Unknown cell initialiser mode: " + str(mode))
+
+        self.layers[name] = ChunkedLayer(self.shape, self.chunkShape, default=default, initialiser=initialiser)
+
+    def getValue(self, name: str, cellID: int):
+        """Returns the value of layer 'name' at cell cellID"""
+        return self[name][numpy.unravel_index(cellID, self.shape)]
+
+    def setValue(self, name: str, cellID: int, value):
+        """Sets the value of layer 'name' at cell cellID. This allocates the chunk containing the cell."""
+        self[name][numpy.unravel_index(cellID, self.shape)] = value
+        self.markModified(name)
+
+    def getValues(self, name: str, cellIDs):
+        """Returns the values of layer 'name' at each of the cells in cellIDs"""
+        return self[name].getValues(cellIDs)
+
+    def getPosition(self, cellID: int):
+        """Returns the coordinates of the cell with ID = cellID"""
+        return CellPositions(self.dimensions)[cellID]
+
+    def getCell(self, cellID: int) -> dict:
+        """Returns a dict containing the position of cell cellID and its value in each layer"""
+        cell = {'pos': self.getPosition(cellID)}
+        for name in self.keys():
+            cell[name] = self.getValue(name, cellID)
+        return cell
+
+    def allocatedChunks(self) -> int:
+        """Returns the total number of chunks allocated across all layers"""
+        return sum(layer.allocatedChunks() for layer in self.layers.values())
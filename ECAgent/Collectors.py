@@ -1,5 +1,13 @@
+import math
+import os
+from operator import attrgetter
 from sys import maxsize
+
+import numpy
+import pandas
+
 from ECAgent.Core import System, Model
+from ECAgent.Statistics import RunningStatistics, Histogram, QuantileSketch, gini
 
 
 class Collector(System):
@@ -9,16 +17,47 @@ class Collector(System):
      When writing your own collector, override the collect() method not the execute() method. The Collector base
      class automatically calls the collect() method whenever the execute() method is called. If you do need to override
      the execute method, make sure you also call the collect() method to follow the intended behaviour of a Collector
-     object."""
-    def __init__(self, id: str, model: Model, priority=-1, frequency=1, start=0, end=maxsize):
+     object.
+     If a sink is supplied (see ECAgent.Sinks), the records are written to the sink and cleared whenever there are at
+     least chunkSize of them. Call flush() at the end of a run to write the remaining records. Collectors with a sink
+     are also flushed (and their sink closed) when they are removed from the model with cleanUp()."""
+    def __init__(self, id: str, model: Model, priority=-1, frequency=1, start=0, end=maxsize, sink=None,
+                 chunkSize: int = 1024):
         super().__init__(id, model, priority, frequency, start, end)
 
         self.records = []
+        self.sink = sink
+        self.chunkSize = chunkSize
 
     def execute(self):
-        """ This overrides the Systems base execution method. It simply calls the collect method"""
+        """ This overrides the Systems base execution method. It simply calls the collect method and writes the records
+        to the sink if there are enough of them"""
         self.collect()
 
+        if self.sink is not None and len(self.records) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """Writes the records to the sink as a chunk and clears them"""
+        if self.sink is None:
+            raise Exception("Collector " + self.id + " cannot be flushed because it does not have a sink.")
+
+        if len(self.records) > 0:
+            self.sink.write(self.getChunk())
+            self.records.clear()
+
+    def getChunk(self) -> dict:
+        """Returns the records as a dict of columns. This is what is written to the sink. By default, each record is
+        treated as a row and each key as a column."""
+        df = pandas.DataFrame(self.records)
+        return {str(column): df[column].values for column in df.columns}
+
+    def cleanUp(self):
+        if self.sink is not None:
+            self.flush()
+            self.sink.close()
+        super().cleanUp()
+
     def collect(self):
         """The collect method. This method is overridden to define the data collection behaviour of your Custom
         Collector."""
@@ -49,8 +88,8 @@ class AgentCollector(Collector):
     To see the agent collector in action, see the Environment and Data Collection tutorial."""
 
     def __init__(self, model: Model, agentFunc, compositeFunc=None, includeTimstep=False, id="AgentCollector",
-                 priority=-1, frequency=1, start=0, end=maxsize):
-        super().__init__(id, model, priority, frequency, start, end)
+                 priority=-1, frequency=1, start=0, end=maxsize, sink=None, chunkSize: int = 1024):
+        super().__init__(id, model, priority, frequency, start, end, sink, chunkSize)
 
         self.agentFunc = agentFunc
         self.compositeFunc = compositeFunc
@@ -91,3 +130,655 @@ class AgentCollector(Collector):
         # Add record if tmpDict is not empty
         if len(tmpDict) > 0:
             self.records.append(tmpDict)
+
+
+class ColumnBuffer:
+    """ ColumnBuffer stores records as named columns of preallocated NumPy arrays instead of a list of dicts. Rows are
+    appended in bulk with append() and the arrays grow geometrically when they run out of space, so appending is
+    amortised O(1) per row. to_numpy() returns views of the filled part of each column without copying them. The
+    version is incremented whenever the rows change."""
+
+    __slots__ = ['dtypes', 'columns', 'length', 'version']
+
+    def __init__(self, dtypes: dict, capacity: int = 1024):
+        self.dtypes = {name: numpy.dtype(dtype) for name, dtype in dtypes.items()}
+        self.columns = {name: numpy.empty(max(capacity, 1), dtype=dtype) for name, dtype in self.dtypes.items()}
+        self.length = 0
+        self.version = 0
+
+    def __len__(self):
+        """Returns the number of rows in the buffer"""
+        return self.length
+
+    def getCapacity(self) -> int:
+        """Returns the number of rows the buffer can hold before it has to grow"""
+        return len(next(iter(self.columns.values())))
+
+    def _reserve(self, rows: int):
+        capacity = self.getCapacity()
+        if self.length + rows <= capacity:
+            return
+
+        while capacity < self.length + rows:
+            capacity *= 2
+
+        for name, column in self.columns.items():
+            grown = numpy.empty(capacity, dtype=column.dtype)
+            grown[:self.length] = column[:self.length]
+            self.columns[name] = grown
+
+    def append(self, values: dict):
+        """Appends rows to the buffer. values must contain an array (or a scalar, which is repeated) for every column.
+        The number of rows appended is the length of the longest array."""
+        rows = max(numpy.size(value) for value in values.values())
+        if set(values.keys()) != set(self.columns.keys()):
+            raise Exception("Cannot append the columns " + str(sorted(values.keys())) + " to a ColumnBuffer with the "
+                            "columns " + str(sorted(self.columns.keys())))
+
+        self._reserve(rows)
+        for name, value in values.items():
+            self.columns[name][self.length:self.length + rows] = value
+        self.length += rows
+        self.version += 1
+
+    def clear(self):
+        """Removes all of the rows. The buffer keeps its capacity."""
+        self.length = 0
+        self.version += 1
+
+    def to_numpy(self) -> dict:
+        """Returns a dict of views of the filled part of each column. The views share memory with the buffer and are
+        only valid until the next append() that makes the buffer grow."""
+        return {name: column[:self.length] for name, column in self.columns.items()}
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Returns the buffer as a pandas DataFrame with one column per buffer column"""
+        return pandas.DataFrame({name: column.copy() for name, column in self.to_numpy().items()})
+
+
+class RecordIndex:
+    """ RecordIndex indexes the rows of a ColumnBuffer with a 'timestep' and an 'agent' column (of agent indices) so
+    that the rows of a range of ticks or of a single agent can be found without scanning the buffer.
+
+    Rows are appended in the order they are collected, so the timestep column is already sorted and the rows of a range
+    of ticks are found with a binary search. The rows of each agent are found through a stable sort of the agent column
+    and the offsets of each agent's rows in it. The agent index is rebuilt lazily whenever the buffer's version has
+    changed since the last query."""
+
+    __slots__ = ['buffer', 'version', 'agentOrder', 'agentOffsets']
+
+    def __init__(self, buffer: ColumnBuffer):
+        self.buffer = buffer
+        self.version = None
+        self.agentOrder = numpy.zeros(0, dtype=numpy.int64)
+        self.agentOffsets = numpy.zeros(1, dtype=numpy.int64)
+
+    def getTickRows(self, start: int, end: int) -> slice:
+        """Returns the slice of rows with start <= timestep < end"""
+        timesteps = self.buffer.to_numpy()['timestep']
+        first, last = numpy.searchsorted(timesteps, [start, end], side='left')
+        return slice(int(first), int(last))
+
+    def _update(self):
+        if self.version == self.buffer.version:
+            return
+
+        agents = self.buffer.to_numpy()['agent']
+        self.agentOrder = numpy.argsort(agents, kind='stable')
+        counts = numpy.bincount(agents) if len(agents) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        self.agentOffsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        self.version = self.buffer.version
+
+    def getAgentRows(self, agentIndex: int) -> numpy.ndarray:
+        """Returns the (ascending) indices of the rows of the agent with index agentIndex"""
+        self._update()
+        if agentIndex < 0 or agentIndex >= len(self.agentOffsets) - 1:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return self.agentOrder[self.agentOffsets[agentIndex]:self.agentOffsets[agentIndex + 1]]
+
+
+class ColumnarAgentCollector(Collector):
+    """This is a collector that stores agent data in columns instead of in one dict per tick. Its records property is a
+    ColumnBuffer with a 'timestep' column, an 'agent' column and a column for each of the values collected.
+
+    Like the AgentCollector, the agentFunc is called for every agent in the environment whenever the collector is
+    executed. It must return a value for each of the columns (a single value if there is only one column) or None to
+    skip that agent. All values are stored as dtype.
+
+    Agent ids are only stored once. The 'agent' column contains the index of each agent's id in the agentIDs list. Use
+    to_numpy() to get the columns without copying them and to_dataframe() to export them as a pandas DataFrame.
+
+    The records are indexed (see RecordIndex) so getTicks(), getField() and getTrajectory() return the rows of a range
+    of ticks, a single column or the rows of a single agent without scanning the records.
+
+    If a sink is supplied, chunkSize is measured in rows and the chunks written to the sink contain the agents' ids
+    instead of their indices."""
+
+    def __init__(self, model: Model, agentFunc, columns: tuple = ('value',), dtype=float,
+                 id="ColumnarAgentCollector", capacity: int = 1024, priority=-1, frequency=1, start=0, end=maxsize,
+                 sink=None, chunkSize: int = 65536):
+        super().__init__(id, model, priority, frequency, start, end, sink, chunkSize)
+
+        self.agentFunc = agentFunc
+        self.valueColumns = tuple(columns)
+
+        dtypes = {'timestep': numpy.int64, 'agent': numpy.int64}
+        dtypes.update({column: dtype for column in self.valueColumns})
+        self.records = ColumnBuffer(dtypes, capacity)
+        self.index = RecordIndex(self.records)
+
+        self.agentIDs = []
+        self.agentIndices = {}  # Maps an agent's id to its index in agentIDs
+        self.lastKeys = []
+        self.lastIndices = numpy.zeros(0, dtype=numpy.int64)
+
+    def getAgentIndex(self, agentID) -> int:
+        """Returns the index of agentID in the agentIDs list, adding it if it has not been seen before"""
+        index = self.agentIndices.get(agentID)
+        if index is None:
+            index = len(self.agentIDs)
+            self.agentIndices[agentID] = index
+            self.agentIDs.append(agentID)
+        return index
+
+    def _getAgentIndices(self, agentKeys: list):
+        # The agents rarely change between ticks so the indices of the last set of agents are reused if possible
+        if agentKeys != self.lastKeys:
+            self.lastKeys = agentKeys
+            self.lastIndices = numpy.array([self.getAgentIndex(key) for key in agentKeys], dtype=numpy.int64)
+        return self.lastIndices
+
+    def collect(self):
+        agents = self.model.environment.agents
+        self.collectAgents(list(agents.keys()), agents.values())
+
+    def evaluateAgents(self, agentKeys: list, agents):
+        """Calls the agentFunc for each agent in agents (agentKeys is the list of the agents' ids). Returns an array of
+        the agent indices of the agents that weren't skipped and an (n, columns) array of their values."""
+        indices = self._getAgentIndices(agentKeys)
+        results = [self.agentFunc(agent) for agent in agents]
+
+        keep = [i for i, result in enumerate(results) if result is not None]
+        if len(keep) < len(results):
+            indices = indices[keep]
+            results = [results[i] for i in keep]
+
+        values = numpy.asarray(results, dtype=self.records.dtypes[self.valueColumns[0]])
+        return indices, values.reshape(len(indices), len(self.valueColumns))
+
+    def appendRows(self, indices, values):
+        """Appends a row for each agent index in indices with the corresponding row of values to the records"""
+        row = {'timestep': self.model.systemManager.timestep, 'agent': indices}
+        row.update({column: values[:, i] for i, column in enumerate(self.valueColumns)})
+        self.records.append(row)
+
+    def collectAgents(self, agentKeys: list, agents):
+        """Calls the agentFunc for each agent in agents and appends the results to the records. agentKeys is the list
+        of the agents' ids."""
+        indices, values = self.evaluateAgents(agentKeys, agents)
+        if len(indices) > 0:
+            self.appendRows(indices, values)
+
+    def getChunk(self) -> dict:
+        chunk = self.to_numpy()
+        chunk['agent'] = numpy.asarray(self.agentIDs)[chunk['agent']]
+        return chunk
+
+    def to_numpy(self) -> dict:
+        """Returns a dict of the collected columns. The arrays share memory with the records. See ColumnBuffer."""
+        return self.records.to_numpy()
+
+    def getTicks(self, start: int, end: int = None) -> dict:
+        """Returns a dict of views of the collected columns of the rows with start <= timestep < end. If end is None,
+        only the rows of timestep start are returned."""
+        rows = self.index.getTickRows(start, start + 1 if end is None else end)
+        return {name: column[rows] for name, column in self.to_numpy().items()}
+
+    def getField(self, field: str, start: int = None, end: int = None):
+        """Returns a view of the field column. If start is not None, only the rows with start <= timestep < end (or
+        timestep == start if end is None) are returned."""
+        if field not in self.records.columns:
+            raise Exception("Collector " + self.id + " does not have a field called " + str(field) + ".")
+
+        if start is None:
+            return self.to_numpy()[field]
+        return self.getTicks(start, end)[field]
+
+    def getTrajectory(self, agentID) -> dict:
+        """Returns a dict of the collected columns of the agent with id agentID (without the 'agent' column)"""
+        rows = self.index.getAgentRows(self.agentIndices.get(agentID, -1))
+        columns = self.to_numpy()
+        del columns['agent']
+        return {name: column[rows] for name, column in columns.items()}
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Returns the collected records as a pandas DataFrame. The 'agent' column contains the agents' ids (as a
+        pandas Categorical)."""
+        df = self.records.to_dataframe()
+        df['agent'] = pandas.Categorical.from_codes(df['agent'], categories=self.agentIDs)
+        return df
+
+
+class FieldCollector(ColumnarAgentCollector):
+    """This is a ColumnarAgentCollector that collects fields of a component type instead of calling a function for every
+    agent. Whenever the collector is executed it reads the fields of every component in the componentType's component
+    pool (see SystemManager.getComponents()) in bulk. Agents without the component are skipped.
+
+    fields is a tuple of the names of the component attributes to collect. Each field is stored in a column with the
+    same name. dtype can either be a single dtype used for every field or a dict that maps fields to dtypes."""
+
+    def __init__(self, model: Model, componentType: type, fields: tuple, dtype=float, id="FieldCollector",
+                 capacity: int = 1024, priority=-1, frequency=1, start=0, end=maxsize, sink=None,
+                 chunkSize: int = 65536):
+        fields = (fields,) if isinstance(fields, str) else tuple(fields)
+        super().__init__(model, None, fields, float, id, capacity, priority, frequency, start, end, sink, chunkSize)
+
+        self.componentType = componentType
+
+        dtypes = {'timestep': numpy.int64, 'agent': numpy.int64}
+        dtypes.update({field: dtype[field] if isinstance(dtype, dict) else dtype for field in fields})
+        self.records = ColumnBuffer(dtypes, capacity)
+        self.index = RecordIndex(self.records)
+
+        self.agentIDGetter = attrgetter('agent.id')
+        self.fieldGetters = {field: attrgetter(field) for field in fields}
+
+    def collect(self):
+        pool = self.model.systemManager.getComponents(self.componentType)
+        if pool is None or len(pool) == 0:
+            return
+
+        row = {
+            'timestep': self.model.systemManager.timestep,
+            'agent': self._getAgentIndices(list(map(self.agentIDGetter, pool)))
+        }
+
+        for field, getter in self.fieldGetters.items():
+            row[field] = numpy.fromiter(map(getter, pool), dtype=self.records.dtypes[field], count=len(pool))
+
+        self.records.append(row)
+
+
+class AggregateCollector(Collector):
+    """This is a collector that records aggregate statistics of a value instead of the value of every agent. The values
+    are either the field of a component type (read from its component pool like the FieldCollector) or the results of
+    calling agentFunc(agent) for every agent in the environment (None results are skipped).
+
+    Whenever the collector is executed it appends a record with the timestep, count, mean, variance, min and max of the
+    values to the records list. The exact quantiles listed in quantiles are added as 'q<quantile>' entries and, if
+    includeGini is True, the Gini coefficient is added as a 'gini' entry. Records therefore grow with the number of
+    ticks and not with the number of agents.
+
+    The collector also summarises the values of every tick of the run in mergeable sketches (see ECAgent.Statistics):
+    statistics (a RunningStatistics object), quantileSketch (a QuantileSketch) and histogram (a Histogram over the
+    (lower, upper, bins) tuple supplied as bins, or None). Use merge() to combine the sketches of collectors from
+    different runs, for example the workers of an ensemble."""
+
+    def __init__(self, model: Model, componentType: type = None, field: str = None, agentFunc=None,
+                 quantiles: tuple = (), includeGini: bool = False, bins: tuple = None,
+                 relativeAccuracy: float = 0.01, id="AggregateCollector", priority=-1, frequency=1, start=0,
+                 end=maxsize, sink=None, chunkSize: int = 1024):
+        super().__init__(id, model, priority, frequency, start, end, sink, chunkSize)
+
+        if agentFunc is None and (componentType is None or field is None):
+            raise Exception("An AggregateCollector needs either a componentType and field or an agentFunc.")
+
+        self.componentType = componentType
+        self.fieldGetter = None if field is None else attrgetter(field)
+        self.agentFunc = agentFunc
+        self.quantiles = tuple(quantiles)
+        self.includeGini = includeGini
+
+        self.statistics = RunningStatistics()
+        self.quantileSketch = QuantileSketch(relativeAccuracy)
+        self.histogram = None if bins is None else Histogram(*bins)
+
+    def getValues(self) -> numpy.ndarray:
+        """Returns the array of values the statistics are computed from"""
+        if self.componentType is not None:
+            pool = self.model.systemManager.getComponents(self.componentType)
+            if pool is None:
+                return numpy.zeros(0)
+            return numpy.fromiter(map(self.fieldGetter, pool), dtype=float, count=len(pool))
+
+        results = [self.agentFunc(agent) for agent in self.model.environment.agents.values()]
+        return numpy.array([result for result in results if result is not None], dtype=float)
+
+    def collect(self):
+        values = self.getValues()
+        values = values[~numpy.isnan(values)]
+
+        tick = RunningStatistics()
+        tick.update(values)
+        record = {
+            'timestep': self.model.systemManager.timestep,
+            'count': tick.count,
+            'mean': tick.getMean(),
+            'var': tick.getVariance(),
+            'min': tick.min if tick.count > 0 else math.nan,
+            'max': tick.max if tick.count > 0 else math.nan
+        }
+
+        if len(self.quantiles) > 0:
+            estimates = numpy.quantile(values, self.quantiles) if len(values) > 0 else [math.nan] * len(self.quantiles)
+            record.update({'q' + str(q): float(v) for q, v in zip(self.quantiles, estimates)})
+
+        if self.includeGini:
+            record['gini'] = gini(values)
+
+        self.records.append(record)
+
+        self.statistics.merge(tick)
+        self.quantileSketch.update(values)
+        if self.histogram is not None:
+            self.histogram.update(values)
+
+    def merge(self, other):
+        """Merges the sketches of another AggregateCollector into this collector's sketches. The records (which are
+        exact, per tick statistics) are not merged."""
+        self.statistics.merge(other.statistics)
+        self.quantileSketch.merge(other.quantileSketch)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+
+
+class TrajectoryCollector(ColumnarAgentCollector):
+    """This is a ColumnarAgentCollector that only collects the data of a random sample of at most sampleSize agents so
+    that the memory used per tick is bounded by the size of the sample instead of the size of the population.
+
+    The sampled agents are kept in the tracked list. Whenever the collector is executed, tracked agents that are no
+    longer in the environment are dropped and replaced by agents drawn at random (using the model's random number
+    generator so that runs are reproducible) from the agents that are not being tracked. The agentFunc is then called
+    for every tracked agent. Use getTrajectory() to get the collected data of an agent."""
+
+    def __init__(self, model: Model, agentFunc, sampleSize: int, columns: tuple = ('value',), dtype=float,
+                 id="TrajectoryCollector", capacity: int = 1024, priority=-1, frequency=1, start=0, end=maxsize,
+                 sink=None, chunkSize: int = 65536):
+        super().__init__(model, agentFunc, columns, dtype, id, capacity, priority, frequency, start, end, sink,
+                         chunkSize)
+
+        self.sampleSize = sampleSize
+        self.tracked = []
+
+    def updateSample(self):
+        """Replaces the tracked agents that have been removed from the environment"""
+        agents = self.model.environment.agents
+        self.tracked = [agentID for agentID in self.tracked if agentID in agents]
+
+        vacancies = min(self.sampleSize, len(agents)) - len(self.tracked)
+        if vacancies <= 0:
+            return
+
+        # Drawing len(tracked) extra agents guarantees that enough of them are not already tracked
+        tracked = set(self.tracked)
+        candidates = self.model.random.sample(list(agents.keys()), min(vacancies + len(tracked), len(agents)))
+        self.tracked += [agentID for agentID in candidates if agentID not in tracked][:vacancies]
+
+    def collect(self):
+        self.updateSample()
+
+        agents = self.model.environment.agents
+        self.collectAgents(self.tracked, [agents[agentID] for agentID in self.tracked])
+
+
+class DeltaCollector(ColumnarAgentCollector):
+    """This is a ColumnarAgentCollector for values that rarely change. Every keyframeInterval ticks the collector stores
+    the values of every agent (a keyframe). In between, it only stores the values of the agents whose values changed
+    (or that were added to the environment) since the previous tick. Agents that were removed (or whose agentFunc
+    returned None) are recorded in the removals ColumnBuffer.
+
+    The records therefore contain the rows of every keyframe and change. The frames ColumnBuffer has a row for every
+    tick that was collected with its timestep, the index of its first row in the records and whether it is a keyframe.
+    Use getState() to reconstruct the values of every agent at any collected tick. Reconstruction only reads the rows
+    from the most recent keyframe onwards.
+
+    If the collector has a sink, flushing the records also clears the frames and removals and the next tick is stored
+    as a keyframe, so every chunk starts with a keyframe. Chunks contain a 'keyframe' column that flags the rows of
+    keyframes and the removals are written as rows whose 'removed' column is True (see getChunk()), so the state can
+    still be reconstructed from the chunks. getState() reads the chunks for ticks that are no longer in memory and
+    getStateFromSink() reconstructs the state from the chunks of a sink without a collector."""
+
+    def __init__(self, model: Model, agentFunc, keyframeInterval: int = 100, columns: tuple = ('value',), dtype=float,
+                 id="DeltaCollector", capacity: int = 1024, priority=-1, frequency=1, start=0, end=maxsize,
+                 sink=None, chunkSize: int = 65536):
+        super().__init__(model, agentFunc, columns, dtype, id, capacity, priority, frequency, start, end, sink,
+                         chunkSize)
+
+        self.keyframeInterval = keyframeInterval
+        self.frames = ColumnBuffer({'timestep': numpy.int64, 'start': numpy.int64, 'keyframe': bool})
+        self.removals = ColumnBuffer({'timestep': numpy.int64, 'agent': numpy.int64})
+        self.ticksSinceKeyframe = None  # None forces the next tick to be a keyframe
+
+        # The values of every agent at the last collected tick (indexed by agent index)
+        self.state = numpy.zeros((0, len(self.valueColumns)), dtype=self.records.dtypes[self.valueColumns[0]])
+        self.present = numpy.zeros(0, dtype=bool)
+
+    def _resizeState(self):
+        size = len(self.agentIDs)
+        if size > len(self.present):
+            size = max(size, 2 * len(self.present))
+            state = numpy.zeros((size, self.state.shape[1]), dtype=self.state.dtype)
+            state[:len(self.state)] = self.state
+            self.state = state
+            self.present = numpy.concatenate([self.present, numpy.zeros(size - len(self.present), dtype=bool)])
+
+    def collect(self):
+        agents = self.model.environment.agents
+        indices, values = self.evaluateAgents(list(agents.keys()), agents.values())
+        self._resizeState()
+
+        timestep = self.model.systemManager.timestep
+        keyframe = self.ticksSinceKeyframe is None or self.ticksSinceKeyframe + 1 >= self.keyframeInterval
+        self.ticksSinceKeyframe = 0 if keyframe else self.ticksSinceKeyframe + 1
+        self.frames.append({'timestep': timestep, 'start': len(self.records), 'keyframe': keyframe})
+
+        current = numpy.zeros(len(self.present), dtype=bool)
+        current[indices] = True
+        removed = numpy.flatnonzero(self.present & ~current)
+        if len(removed) > 0:
+            self.removals.append({'timestep': timestep, 'agent': removed})
+
+        if keyframe:
+            changed = numpy.ones(len(indices), dtype=bool)
+        else:
+            previous = self.state[indices]
+            different = previous != values
+            if values.dtype.kind == 'f':
+                different &= ~(numpy.isnan(previous) & numpy.isnan(values))
+            changed = ~self.present[indices] | different.any(axis=1)
+
+        if changed.any():
+            self.appendRows(indices[changed], values[changed])
+
+        self.state[indices] = values
+        self.present = current
+
+    def execute(self):
+        self.collect()
+
+        # Removals are written as rows of the chunk, so they count towards its size
+        if self.sink is not None and len(self.records) + len(self.removals) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """Writes the records and removals to the sink as a chunk and clears them. A chunk is written even if no
+        records are pending so that ticks which only removed agents are not lost."""
+        if self.sink is None:
+            super().flush()
+
+        if len(self.records) > 0 or len(self.removals) > 0:
+            self.sink.write(self.getChunk())
+            self.records.clear()
+        self.frames.clear()
+        self.removals.clear()
+        self.ticksSinceKeyframe = None
+
+    def getChunk(self) -> dict:
+        """Returns the records and removals as a dict of columns sorted by timestep. Every row has a 'keyframe' column
+        that is True if the row belongs to a keyframe and a 'removed' column that is True (and has zero values) if the
+        row records the removal of an agent."""
+        columns = self.to_numpy()
+        frames = self.frames.to_numpy()
+        removals = self.removals.to_numpy()
+        rowCount, removalCount = len(self.records), len(self.removals)
+
+        # Each row belongs to the last frame that starts at or before it
+        frameOfRow = numpy.searchsorted(frames['start'], numpy.arange(rowCount), side='right') - 1
+
+        order = numpy.argsort(numpy.concatenate([columns['timestep'], removals['timestep']]), kind='stable')
+        agents = numpy.concatenate([columns['agent'], removals['agent']])
+
+        chunk = {
+            'timestep': numpy.concatenate([columns['timestep'], removals['timestep']])[order],
+            'agent': numpy.asarray(self.agentIDs)[agents[order]]
+        }
+        for column in self.valueColumns:
+            removed = numpy.zeros(removalCount, dtype=columns[column].dtype)
+            chunk[column] = numpy.concatenate([columns[column], removed])[order]
+        chunk['keyframe'] = numpy.concatenate([frames['keyframe'][frameOfRow], numpy.zeros(removalCount, bool)])[order]
+        chunk['removed'] = numpy.concatenate([numpy.zeros(rowCount, bool), numpy.ones(removalCount, bool)])[order]
+        return chunk
+
+    @staticmethod
+    def getStateFromSink(sink, timestep: int, columns: tuple = ('value',)) -> dict:
+        """Reconstructs the values of every agent at the last tick at or before timestep from the chunks a
+        DeltaCollector wrote to sink. columns are the collector's value columns. Returns a dict with an 'agent' column
+        (of agent ids) and a column for each value, sorted by agent id."""
+        chunk = None
+        for candidate in sink:
+            if len(candidate['timestep']) == 0:
+                continue
+            if candidate['timestep'][0] > timestep:
+                break
+            chunk = candidate
+
+        if chunk is None:
+            raise Exception("No ticks were written at or before timestep " + str(timestep) + ".")
+
+        # Every chunk starts with a keyframe, so the state only depends on the rows from the last keyframe onwards
+        end = numpy.searchsorted(chunk['timestep'], timestep, side='right')
+        keyframes = numpy.flatnonzero(chunk['keyframe'][:end].astype(bool))
+        start = 0 if len(keyframes) == 0 else numpy.searchsorted(chunk['timestep'], chunk['timestep'][keyframes[-1]])
+
+        # The last row of each agent holds its value (or its removal)
+        agents = chunk['agent'][start:end]
+        ids, lastRows = numpy.unique(agents[::-1], return_index=True)
+        rows = start + len(agents) - 1 - lastRows
+        rows = rows[~chunk['removed'][rows].astype(bool)]
+
+        state = {'agent': chunk['agent'][rows]}
+        state.update({column: chunk[column][rows] for column in columns})
+        return state
+
+    def getState(self, timestep: int) -> dict:
+        """Returns the values of every agent at the last collected tick at or before timestep as a dict with an
+        'agent' column (of agent ids) and a column for each value, sorted by the order the agents were first seen.
+        If the tick has already been written to the sink, the state is reconstructed from the sink's chunks instead
+        (see getStateFromSink())."""
+        frames = self.frames.to_numpy()
+        if self.sink is not None and (len(self.frames) == 0 or timestep < frames['timestep'][0]):
+            return DeltaCollector.getStateFromSink(self.sink, timestep, self.valueColumns)
+
+        frame = numpy.searchsorted(frames['timestep'], timestep, side='right') - 1
+        if frame < 0:
+            raise Exception("No ticks were collected at or before timestep " + str(timestep) + ".")
+
+        keyframe = numpy.flatnonzero(frames['keyframe'][:frame + 1])[-1]
+        start = frames['start'][keyframe]
+        end = frames['start'][frame + 1] if frame + 1 < len(self.frames) else len(self.records)
+        first, last = frames['timestep'][keyframe], frames['timestep'][frame]
+
+        columns = self.to_numpy()
+        agents = columns['agent'][start:end]
+
+        # The last row of each agent holds its value at timestep
+        reverse = agents[::-1]
+        indices, lastRows = numpy.unique(reverse, return_index=True)
+        rows = start + len(agents) - 1 - lastRows
+        lastWrite = columns['timestep'][rows]
+
+        # Agents removed after their last row are not present
+        removals = self.removals.to_numpy()
+        window = (removals['timestep'] > first) & (removals['timestep'] <= last)
+        lastRemoval = numpy.full(len(self.agentIDs), numpy.iinfo(numpy.int64).min)
+        numpy.maximum.at(lastRemoval, removals['agent'][window], removals['timestep'][window])
+        alive = lastWrite > lastRemoval[indices]
+
+        state = {'agent': numpy.asarray(self.agentIDs)[indices[alive]]}
+        state.update({column: columns[column][rows[alive]] for column in self.valueColumns})
+        return state
+
+
+class CellLayerCollector(Collector):
+    """This is a collector that snapshots cell layers of a discrete world (see ECAgent.Environments.DiscreteWorld)
+    whenever it is executed. Each layer in layers is copied into a preallocated array of shape (length,) + the layer's
+    shape, i.e. (T, height, width) for a GridWorld, so the records property is a dict that maps each layer name to its
+    array and snapshot i of layer 'name' is records[name][i]. The timestep of each snapshot is stored in timesteps.
+
+    dtype can be a single dtype or a dict that maps layer names to dtypes. Use a smaller dtype (like float32 or uint8)
+    than the layer's to reduce the size of the snapshots. If dtype is None, each layer's own dtype is used.
+
+    If directory is not None, the arrays are memory-mapped .npy files called <id>.<layer name>.npy in that directory
+    so the snapshots don't have to fit in memory. They can be opened with numpy.load(path, mmap_mode='r') and flush()
+    writes them to disk.
+
+    An Exception is raised if the collector is executed more than length times. getSnapshots() returns the filled part
+    of a layer's array, which can be passed to ECAgent.Visualization.createAnimatedHeatMap() (2D worlds) or indexed
+    to pass a single snapshot to createHeatMap()."""
+
+    def __init__(self, model: Model, world, layers: tuple, length: int, dtype=None, directory: str = None,
+                 id="CellLayerCollector", priority=-1, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, priority, frequency, start, end)
+
+        self.world = world
+        self.layers = (layers,) if isinstance(layers, str) else tuple(layers)
+        self.length = length
+        self.directory = directory
+
+        self.records = {}
+        for name in self.layers:
+            layer = world.cells[name]
+            layerType = dtype.get(name) if isinstance(dtype, dict) else dtype
+            layerType = numpy.dtype(layer.dtype if layerType is None else layerType)
+            shape = (length,) + tuple(world.cells.shape)
+
+            if directory is None:
+                self.records[name] = numpy.zeros(shape, dtype=layerType)
+            else:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, id + '.' + name + '.npy')
+                self.records[name] = numpy.lib.format.open_memmap(path, mode='w+', dtype=layerType, shape=shape)
+
+        self.timesteps = numpy.full(length, -1, dtype=numpy.int64)
+        self.count = 0
+
+    def collect(self):
+        if self.count == self.length:
+            raise Exception("CellLayerCollector " + self.id + " is full. It can only store " + str(self.length) + " "
+                            "snapshots.")
+
+        region = tuple(slice(None) for _ in self.world.cells.shape)
+        for name in self.layers:
+            # Indexing with a full region also works for ChunkedLayers. Values are cast to the snapshot dtype.
+            self.records[name][self.count] = self.world.cells[name][region]
+
+        self.timesteps[self.count] = self.model.systemManager.timestep
+        self.count += 1
+
+    def getSnapshots(self, name: str):
+        """Returns a view of the snapshots of layer 'name' that have been collected, shaped (count,) + layer shape"""
+        return self.records[name][:self.count]
+
+    def getTimesteps(self):
+        """Returns the timesteps of the snapshots that have been collected"""
+        return self.timesteps[:self.count]
+
+    def flush(self):
+        """Writes memory-mapped snapshots to disk. Does nothing if the snapshots are not memory-mapped."""
+        for snapshots in self.records.values():
+            if isinstance(snapshots, numpy.memmap):
+                snapshots.flush()
+
+    def cleanUp(self):
+        self.flush()
+        super().cleanUp()
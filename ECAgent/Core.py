@@ -6,7 +6,7 @@ class Model:
     """ This is the base class for the ABM model.
     You inherit this class to again access to all of the ECS functionality """
 
-    __slots__ = ['environment', 'systemManager', 'random']
+    __slots__ = ['environment', 'systemManager', 'random', 'sharedLayers']
 
     def __init__(self, seed: int = None):
 
@@ -18,6 +18,21 @@ class Model:
         # is added.
 
         self.random = random.Random(seed)
+        self.sharedLayers = None
+
+    def getSharedLayers(self):
+        """Returns the model's SharedLayers registry (see ECAgent.Cells), creating it the first time it is needed.
+        The shared memory blocks in the registry are released when close() is called."""
+        if self.sharedLayers is None:
+            from ECAgent.Cells import SharedLayers
+            self.sharedLayers = SharedLayers()
+        return self.sharedLayers
+
+    def close(self):
+        """Releases the resources owned by the model, like the shared memory blocks of its shared cell layers"""
+        if self.sharedLayers is not None:
+            self.sharedLayers.close()
+            self.sharedLayers = None
 
 
 class Component:
@@ -109,13 +124,14 @@ class SystemManager:
     """ This class is responsible for managing the adding,
     removing and executing Systems """
 
-    __slots__ = ['timestep', 'systems', 'executionQueue', 'componentPools', 'model']
+    __slots__ = ['timestep', 'systems', 'executionQueue', 'componentPools', 'registeredComponents', 'model']
 
     def __init__(self, model: Model):
         self.timestep = 0
         self.systems = {}
         self.executionQueue = []
         self.componentPools = {}
+        self.registeredComponents = {}  # Maps id(component) to component so registrations are checked in O(1) time
         self.model = model
 
     def addSystem(self, s: System):
@@ -153,20 +169,23 @@ class SystemManager:
         self.timestep += 1
 
     def registerComponent(self, component: Component):
-        if type(component) not in self.componentPools.keys():
-            self.componentPools[type(component)] = [component]
-        elif component in self.componentPools[type(component)]:
+        if id(component) in self.registeredComponents:
             raise Exception("Component already registered.")
+        elif type(component) not in self.componentPools.keys():
+            self.componentPools[type(component)] = [component]
         else:
             self.componentPools[type(component)].append(component)
 
+        self.registeredComponents[id(component)] = component
+
     def deregisterComponent(self, component: Component):
         if type(component) not in self.componentPools.keys():
             raise Exception("No components with type " + str(type(component)) + " registered")
-        elif component not in self.componentPools[type(component)]:
+        elif id(component) not in self.registeredComponents:
             raise Exception("Cannot deregister component because "
                             "it was never registered to begin with.")
         else:
+            del self.registeredComponents[id(component)]
             self.componentPools[type(component)].remove(component)
             if len(self.componentPools[type(component)]) == 0:
                 del self.componentPools[type(component)]
@@ -1,15 +1,92 @@
 import numpy
-import pandas
 
+from ECAgent.Cells import CellLayers, ChunkedCellLayers, ChunkedLayer, SummedAreaTables, toLayerArray
 from ECAgent.Core import Agent, Environment, Component, Model
+from ECAgent.Kernels import NumpyKernels, getKernels
+
+
+def getNumpyRandom(model: Model):
+    """Returns a numpy Generator seeded from the model's RNG. This keeps vectorized random operations reproducible
+    for a model with a fixed seed."""
+    return numpy.random.default_rng(model.random.getrandbits(64))
 
 
 def discreteGridPosToID(x: int, y: int = 0, width: int = 0, z: int = 0, height: int = 0):
     """Returns a unique number of based on the x, y and z coordinates entered.
-    Uniqueness is dimension dependent"""
+    Uniqueness is dimension dependent. The coordinates can also be lists or arrays, in which case an array of IDs is
+    returned."""
+    if isinstance(x, (list, tuple)) or isinstance(y, (list, tuple)) or isinstance(z, (list, tuple)):
+        x = numpy.asarray(x, dtype=numpy.int64)
+        y = numpy.asarray(y, dtype=numpy.int64)
+        z = numpy.asarray(z, dtype=numpy.int64)
     return (z * width * height) + (y * width) + x
 
 
+def discreteGridIDToPos(cellID: int, width: int = 0, height: int = 0):
+    """Returns the x, y and z coordinates of the cell with the supplied ID. This is the inverse of
+    discreteGridPosToID(). cellID can also be a list or array, in which case arrays of coordinates are returned."""
+    if isinstance(cellID, (list, tuple)):
+        cellID = numpy.asarray(cellID, dtype=numpy.int64)
+
+    if width == 0:
+        return cellID, 0 * cellID, 0 * cellID
+    elif height == 0:
+        return cellID % width, cellID // width, 0 * cellID
+
+    return cellID % width, (cellID // width) % height, cellID // (width * height)
+
+
+def resolveMoves(currentIDs, targetIDs, capacity, priorities=None, rng=None):
+    """Resolves simultaneous moves in a discrete world. Agent i wants to move from cell currentIDs[i] to cell
+    targetIDs[i]. capacity is the maximum number of agents allowed in each cell (a scalar or an array indexed by cell
+    ID).
+    Returns a boolean array that is True for every agent that ends up in its target cell.
+
+    Agents that stay where they are always keep their cell. If more agents want to move into a cell than it has space
+    for, the agents with the highest priorities win. Ties (or every conflict, if priorities is None) are broken randomly
+    using rng, a numpy Generator. Agents whose moves are rejected stay where they are, which can in turn take the space
+    that other agents wanted to move into, so conflicts are resolved in rounds until no more moves are rejected. Every
+    round is a single vectorized pass. Unlike moving agents one after another, agents that come first in the arrays are
+    not favoured."""
+    currentIDs = numpy.asarray(currentIDs, dtype=numpy.int64).reshape(-1)
+    targetIDs = numpy.asarray(targetIDs, dtype=numpy.int64).reshape(-1)
+    n = len(targetIDs)
+    if len(currentIDs) != n:
+        raise Exception("Cannot resolve moves for " + str(len(currentIDs)) + " agents with " + str(n) + " targets.")
+
+    size = int(max(currentIDs.max(initial=-1), targetIDs.max(initial=-1))) + 1
+    capacity = numpy.broadcast_to(numpy.asarray(capacity).reshape(-1), (max(size, 1),)) \
+        if numpy.ndim(capacity) == 0 else numpy.asarray(capacity).reshape(-1)
+
+    # Sort the agents by target and then by descending priority with random tie breaking
+    if rng is None:
+        rng = numpy.random.default_rng()
+    keys = (rng.random(n),)
+    if priorities is not None:
+        keys += (-numpy.asarray(priorities, dtype=float).reshape(-1),)
+    order = numpy.lexsort(keys + (targetIDs,))
+
+    sortedTargets = targetIDs[order]
+    queueStarts = numpy.searchsorted(sortedTargets, sortedTargets, side='left')
+
+    staysPut = currentIDs == targetIDs
+    accepted = ~staysPut
+    while True:
+        staying = numpy.bincount(currentIDs[~accepted], minlength=size)
+        free = numpy.maximum(capacity[:size] - staying, 0)
+
+        # The place of each agent in the queue for its target. Agents that have been rejected leave the queue.
+        competing = accepted[order].astype(numpy.int64)
+        ahead = numpy.cumsum(competing) - competing
+        place = numpy.empty(n, dtype=numpy.int64)
+        place[order] = ahead - ahead[queueStarts]
+
+        rejected = accepted & (place >= free[targetIDs])
+        if not rejected.any():
+            return accepted | staysPut
+        accepted &= ~rejected
+
+
 class PositionComponent(Component):
     """ A position component. It contains three float properties: x, y, z.
     This component can be used to store the position of an Agent in a 1-3D world.
@@ -28,260 +105,974 @@ class PositionComponent(Component):
         return self.x, self.y, self.z
 
 
-class LineWorld(Environment):
-    """ LineWorld is a discrete environment with only 1 axis (x-axis). It can be used in place of the base Environment
-    class. All agents added to a LineWorld class are given a PositionComponent to denote their place in the world.
-
-    A LineWorld's dimensions are defined by a width property.
-
-    LineWorld.addCellComponent(comp) adds component comp to each of the cells in the environment."""
-
-    __slots__ = ['width', 'cells']
-
-    def __init__(self, width, model, id: str = 'ENVIRONMENT'):
-
-        if width < 1:
-            raise Exception("Cannot create a LineWorld with a negative width.")
+class AgentDensity:
+    """ AgentDensity keeps count of the number of agents in each cell of a discrete world. The counts are stored as a
+    NumPy array with the same shape as the world's cell layers and are updated incrementally whenever an agent is
+    added, removed or moved, so they never need to be recomputed from the agents' PositionComponents.
+
+    Separate counts can also be kept for each of the supplied componentTypes. An agent is counted for a component type
+    if it had a component of that type when it was added to the world."""
+
+    __slots__ = ['counts', 'componentCounts', 'agentCells', 'agentTypes']
+
+    def __init__(self, shape: tuple, componentTypes: tuple = ()):
+        self.counts = numpy.zeros(shape, dtype=numpy.int32)
+        self.componentCounts = {componentType: numpy.zeros(shape, dtype=numpy.int32)
+                                for componentType in componentTypes}
+        self.agentCells = {}  # Maps an agent's id to the ID of the cell it is counted in
+        self.agentTypes = {}  # Maps an agent's id to the component types it is counted for
+
+    def _update(self, cellID: int, componentTypes: tuple, delta: int):
+        self.counts.flat[cellID] += delta
+        for componentType in componentTypes:
+            self.componentCounts[componentType].flat[cellID] += delta
+
+    def add(self, agent: Agent, cellID: int):
+        """Counts agent in cell cellID"""
+        cellID = int(cellID)
+        componentTypes = tuple(t for t in self.componentCounts if agent.hasComponent(t))
+        self.agentCells[agent.id] = cellID
+        self.agentTypes[agent.id] = componentTypes
+        self._update(cellID, componentTypes, 1)
+
+    def remove(self, agentID: str):
+        """Removes an agent from the counts"""
+        self._update(self.agentCells.pop(agentID), self.agentTypes.pop(agentID), -1)
+
+    def move(self, agentID: str, cellID: int):
+        """Moves an agent's count to cell cellID"""
+        cellID = int(cellID)
+        if self.agentCells[agentID] != cellID:
+            self._update(self.agentCells[agentID], self.agentTypes[agentID], -1)
+            self._update(cellID, self.agentTypes[agentID], 1)
+            self.agentCells[agentID] = cellID
+
+    def moveMany(self, agentIDs: list, cellIDs, kernels=NumpyKernels):
+        """Moves the count of each agent in agentIDs to the corresponding cell in cellIDs using the supplied kernels"""
+        oldIDs = numpy.array([self.agentCells[agentID] for agentID in agentIDs], dtype=numpy.int64)
+        cellIDs = numpy.asarray(cellIDs, dtype=numpy.int64)
+
+        kernels.updateOccupancy(self.counts, oldIDs, cellIDs)
+        for componentType, counts in self.componentCounts.items():
+            mask = numpy.array([componentType in self.agentTypes[agentID] for agentID in agentIDs], dtype=bool)
+            kernels.updateOccupancy(counts, oldIDs[mask], cellIDs[mask])
+
+        for agentID, cellID in zip(agentIDs, cellIDs.tolist()):
+            self.agentCells[agentID] = cellID
+
+    def rebuild(self, agents: list, cellIDs):
+        """Recomputes all of the counts in one pass. agents[i] must be in cell cellIDs[i]."""
+        cellIDs = numpy.asarray(cellIDs, dtype=numpy.int64).reshape(-1)
+        size = self.counts.size
+
+        self.counts[...] = numpy.bincount(cellIDs, minlength=size).reshape(self.counts.shape)
+        self.agentCells = {agent.id: int(cellID) for agent, cellID in zip(agents, cellIDs)}
+        self.agentTypes = {agent.id: tuple(t for t in self.componentCounts if agent.hasComponent(t))
+                           for agent in agents}
+
+        for componentType, counts in self.componentCounts.items():
+            mask = numpy.array([componentType in self.agentTypes[agent.id] for agent in agents], dtype=bool)
+            counts[...] = numpy.bincount(cellIDs[mask], minlength=size).reshape(counts.shape)
+
+    def get(self, componentType: type = None):
+        """Returns the counts of all agents, or of the agents with componentType if one is supplied"""
+        if componentType is None:
+            return self.counts
+        elif componentType not in self.componentCounts:
+            raise Exception("Agent density is not being tracked for " + str(componentType))
+
+        return self.componentCounts[componentType]
+
+
+class DiscreteWorld(Environment):
+    """ DiscreteWorld is a discrete environment with 1-3 axes (x[, y[, z]]-axes). It can be used in place of the base
+    Environment class. All agents added to a DiscreteWorld are given a PositionComponent to denote their place in the
+    world. LineWorld, GridWorld and CubeWorld are thin wrappers around it.
+
+    A DiscreteWorld's dimensions are defined by a (width[, height[, depth]]) tuple. Every cell has an ID equal to the
+    dot product of its coordinates and the world's strides, (1[, width[, width * height]]), as returned by
+    discreteGridPosToID(). toCellIDs() and toCoordinates() convert between the two for whole arrays of cells at once
+    and toCellID() converts a single position.
+
+    DiscreteWorld.addCellComponent(comp) adds component comp to each of the cells in the environment. Cell data is
+    stored in the cells property, a CellLayers object that holds each cell component as a NumPy array. The regions
+    property (a SummedAreaTables object) answers sum, mean and count queries over rectangular windows of the numeric
+    layers in O(1) time per window.
+
+    The backend ('numpy', 'numba' or 'auto') selects the kernels used for neighbour enumeration, agent density
+    updates, batch moves and diffusion. See ECAgent.Kernels."""
+
+    __slots__ = ['dimensions', 'strides', 'cells', 'regions', 'density', 'kernels']
+
+    def __init__(self, dimensions: tuple, model, id: str = 'ENVIRONMENT', backend: str = 'numpy'):
+
+        if len(dimensions) < 1 or len(dimensions) > 3:
+            raise Exception("Cannot create a " + type(self).__name__ + " with " + str(len(dimensions)) + " axes.")
+        if min(dimensions) < 1:
+            raise Exception("Cannot create a " + type(self).__name__ + " with a dimension less than 1.")
 
         super().__init__(model, id=id)
-        self.width = width
+        self.dimensions = tuple(int(dim) for dim in dimensions)
+        self.strides = numpy.concatenate([[1], numpy.cumprod(self.dimensions)[:-1]]).astype(numpy.int64)
 
         # Create cells
-        self.cells = pandas.DataFrame({'pos': [x for x in range(width)]})
-
-    def addAgent(self, agent: Agent, xPos: int = 0):
-        """Adds an agent to the environment. Overrides the base class function.
+        self.cells = CellLayers(self.dimensions)
+        self.regions = SummedAreaTables(self.cells)
+        self.density = None
+        self.kernels = getKernels(backend)
+
+    def _toPosition(self, pos: tuple, action: str) -> tuple:
+        """Pads pos with zeros to the number of axes of the world and raises an error if it is not on the map"""
+        pos = tuple(pos) + (0,) * (len(self.dimensions) - len(pos))
+        if not self.isOnMap(*pos):
+            raise Exception("Cannot " + action + " the Agent to position not on the map.")
+        return pos
+
+    def isOnMap(self, *pos) -> bool:
+        """Returns True if position (x[, y[, z]]) is a cell in the world"""
+        return len(pos) == len(self.dimensions) and all(0 <= p < dim for p, dim in zip(pos, self.dimensions))
+
+    def _getGridSize(self) -> tuple:
+        """Returns the width and height arguments of discreteGridPosToID() and discreteGridIDToPos() for the world.
+        Axes that the world does not have are 0."""
+        return (self.dimensions[:-1] + (0, 0))[:2]
+
+    def toCellIDs(self, positions):
+        """Converts an (n, ndim) array of (x[, y[, z]]) positions into an array of n cell IDs"""
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, len(self.dimensions))
+        x, y, z = numpy.pad(positions, ((0, 0), (0, 3 - positions.shape[1]))).T
+        width, height = self._getGridSize()
+        return discreteGridPosToID(x, y, width, z, height)
+
+    def toCellID(self, pos) -> int:
+        """Converts a single (x[, y[, z]]) position (or an x coordinate in 1D worlds) into a cell ID"""
+        return int(self.toCellIDs(pos)[0])
+
+    def toCoordinates(self, cellIDs):
+        """Converts an array of n cell IDs into an (n, ndim) array of (x[, y[, z]]) positions"""
+        cellIDs = numpy.asarray(cellIDs, dtype=numpy.int64).reshape(-1)
+        return numpy.stack(discreteGridIDToPos(cellIDs, *self._getGridSize())[:len(self.dimensions)], axis=1)
+
+    def addAgent(self, agent: Agent, *pos):
+        """Adds an agent to the environment at position (x[, y[, z]]). Overrides the base class function.
         This function will also add a PositionComponent to the agent object.
-        If the xPos is greater than the width of the world, an error will be thrown."""
+        If the position is not on the map, an error will be thrown."""
+        pos = self._toPosition(pos, 'add')
 
-        if xPos >= self.width or xPos < 0:
-            raise Exception("Cannot add the Agent to position not on the map.")
-
-        agent.addComponent(PositionComponent(agent, agent.model, x=xPos))
+        agent.addComponent(PositionComponent(agent, agent.model, *pos))
         super().addAgent(agent)
 
-    def addCellComponent(self, name: str, generator):
+        if self.density is not None:
+            self.density.add(agent, self.toCellID(pos))
+
+    def addCellComponent(self, name: str, generator, mode: str = 'cell', lazy: bool = False):
         """ Adds the component supplied by the generator functor to each of the cells.
-        The functor is supplied with the index of the cell and dataframe as input"""
+        By default (mode='cell') the functor is supplied with the position of the cell and the CellLayers object as
+        input. Use mode='coords' to supply the functor with the coordinate arrays of the cells or mode='shape' to
+        supply it with the shape of the layer and a numpy Generator. Both vectorized modes must return the whole layer.
+        If lazy is True, the layer is only generated when it is first accessed. See CellLayers.addLayer()."""
 
-        new_components = [generator(i, self.cells) for i in range(self.width)]
-        self.cells[name] = new_components
+        self.cells.addLayer(name, generator, mode, lazy, getNumpyRandom(self.model) if mode == 'shape' else None)
+
+    def shareCellComponent(self, name: str) -> tuple:
+        """Moves cell layer 'name' into shared memory owned by the model and returns its descriptor. Worker processes
+        can attach to the layer with ECAgent.Cells.attachSharedLayer(descriptor) without copying it. The memory is
+        released when the model is closed. See Model.close()."""
+        return self.cells.shareLayer(name, self.model.getSharedLayers(), self.id + '.' + name)
 
     def removeAgent(self, agentID: str):
         """ Removes the agent from the environment. Will also remove the PositionComponent from the agent"""
         if agentID in self.agents:
             self.agents[agentID].removeComponent(PositionComponent)
+            if self.density is not None:
+                self.density.remove(agentID)
 
         super().removeAgent(agentID)
 
+    def moveAgent(self, agentID: str, *pos):
+        """Moves an agent to position (x[, y[, z]]) and updates the agent density counts (if they are being
+        tracked). If the position is not on the map, an error will be thrown."""
+        pos = self._toPosition(pos, 'move')
+
+        component = self.agents[agentID][PositionComponent]
+        for axis, p in zip(('x', 'y', 'z'), pos):
+            setattr(component, axis, p)
+
+        if self.density is not None:
+            self.density.move(agentID, self.toCellID(pos))
+
+    def setBackend(self, backend: str):
+        """Changes the kernels used by the world. See ECAgent.Kernels.getKernels()."""
+        self.kernels = getKernels(backend)
+
+    def moveAgents(self, agentIDs: list, deltas, toroidal: bool = False):
+        """Moves many agents at once. deltas is an (n, ndim) array (or a single delta) of the amount to move each
+        agent along each axis. Agents that would leave the world are clamped to its edges, or wrapped around them if
+        toroidal is True. The agent density counts are updated in one pass."""
+        if len(agentIDs) == 0:
+            return
+
+        ndim = len(self.dimensions)
+        components = [self.agents[agentID][PositionComponent] for agentID in agentIDs]
+        positions = numpy.array([component.getPosition()[:ndim] for component in components], dtype=numpy.int64)
+        deltas = numpy.broadcast_to(numpy.asarray(deltas, dtype=numpy.int64).reshape(-1, ndim), positions.shape)
+
+        moved, cellIDs = self.kernels.movePositions(positions, deltas, self.dimensions, toroidal)
+
+        for component, position in zip(components, moved.tolist()):
+            for axis, p in zip(('x', 'y', 'z'), position):
+                setattr(component, axis, p)
+
+        if self.density is not None:
+            self.density.moveMany(agentIDs, cellIDs, self.kernels)
+
+    def trackDensity(self, *componentTypes):
+        """Starts tracking the number of agents in each cell. Separate counts are kept for each of the component
+        types supplied. See AgentDensity."""
+        self.density = AgentDensity(self.cells.shape, componentTypes)
+        self.updateDensity()
+
+    def updateDensity(self):
+        """Recomputes the agent density counts from the agents' PositionComponents. This only needs to be called if
+        PositionComponents were changed directly instead of through moveAgent()."""
+        if self.density is None:
+            raise Exception("Agent density is not being tracked. Call trackDensity() first.")
+
+        agents = self.getAgents()
+        positions = numpy.array([agent[PositionComponent].getPosition() for agent in agents],
+                                dtype=numpy.int64).reshape(-1, 3)
+        self.density.rebuild(agents, self.toCellIDs(positions[:, :len(self.dimensions)]))
+
+    def getDensity(self, componentType: type = None):
+        """Returns a NumPy array (shaped like the cell layers) containing the number of agents in each cell. If
+        componentType is supplied, only agents with that component are counted. The array (or each z slice of it)
+        can be passed directly to createHeatMap()."""
+        if self.density is None:
+            raise Exception("Agent density is not being tracked. Call trackDensity() first.")
+
+        return self.density.get(componentType)
+
+    def getLayerArray(self, name: str):
+        """Returns cell layer 'name' as a NumPy array. Layers of ChunkedCellLayers are read into a dense array."""
+        layer = self.cells[name]
+        return layer.toArray() if isinstance(layer, ChunkedLayer) else layer
+
+    def getAgentCounts(self):
+        """Returns an array (shaped like the cell layers) containing the number of agents in each cell. The agent
+        density counts are used if they are being tracked, otherwise the counts are computed from the agents'
+        positions."""
+        if self.density is not None:
+            return self.density.get()
+
+        positions = numpy.array([agent[PositionComponent].getPosition() for agent in self.agents.values()],
+                                dtype=numpy.int64).reshape(-1, 3)
+        counts = numpy.bincount(self.toCellIDs(positions[:, :len(self.dimensions)]), minlength=self.cells.size)
+        return counts.reshape(self.cells.shape)
+
+    def getOccupancy(self):
+        """Returns a boolean array (shaped like the cell layers) that is True for every cell that contains at least one
+        agent. The agent density counts are used if they are being tracked."""
+        return self.getAgentCounts() > 0
+
+    def sampleCells(self, k: int, empty: bool = False, where=None, replace: bool = False):
+        """Returns the IDs of k random cells sampled with the model's RNG. Cells are sampled without replacement unless
+        replace is True. If empty is True, only cells without agents are sampled. where further restricts the cells
+        that can be sampled and can be the name of a layer (cells with non-zero values), a boolean array shaped like the
+        cell layers or a functor that is supplied with the CellLayers object and returns such an array. Use
+        toCoordinates() to convert the IDs into positions."""
+        rng = getNumpyRandom(self.model)
+
+        if not empty and where is None:
+            if not replace and k > self.cells.size:
+                raise Exception("Cannot sample " + str(k) + " cells from a world with " + str(self.cells.size) + " "
+                                "cells.")
+            return rng.choice(self.cells.size, k, replace=replace)
+
+        mask = numpy.ones(self.cells.size, dtype=bool)
+        if where is not None:
+            if isinstance(where, str):
+                where = self.getLayerArray(where) != 0
+            elif callable(where):
+                where = where(self.cells)
+            mask &= numpy.asarray(where, dtype=bool).reshape(-1)
+        if empty:
+            mask &= ~self.getOccupancy().reshape(-1)
+
+        candidates = numpy.flatnonzero(mask)
+        if (not replace and k > len(candidates)) or (k > 0 and len(candidates) == 0):
+            raise Exception("Cannot sample " + str(k) + " cells because only " + str(len(candidates)) + " cells "
+                            "match.")
+        return rng.choice(candidates, k, replace=replace)
+
+    def moveAgentsTo(self, agentIDs: list, positions, capacity=1, priorities=None):
+        """Moves many agents simultaneously. positions is an (n, ndim) array of the (x[, y[, z]]) position each agent
+        wants to move to. capacity is the maximum number of agents allowed in a cell and can be a scalar, an array
+        shaped like the cell layers or the name of a layer. Agents that are not being moved count towards the capacity
+        of the cells they are in. Conflicts are resolved with resolveMoves() using the supplied priorities (higher
+        wins) and the model's RNG. The accepted moves are applied to the agents'
+        PositionComponents and the agent density counts. Returns a boolean array that is True for every agent that
+        ended up at its target position."""
+        if len(agentIDs) == 0:
+            return numpy.zeros(0, dtype=bool)
+
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, len(self.dimensions))
+        if ((positions < 0) | (positions >= numpy.array(self.dimensions))).any():
+            raise Exception("Cannot move the Agents to positions not on the map.")
+
+        ndim = len(self.dimensions)
+        components = [self.agents[agentID][PositionComponent] for agentID in agentIDs]
+        currentIDs = self.toCellIDs([component.getPosition()[:ndim] for component in components])
+        targetIDs = self.toCellIDs(positions)
+
+        if isinstance(capacity, str):
+            capacity = self.getLayerArray(capacity)
+        capacity = numpy.broadcast_to(capacity, self.cells.shape).reshape(-1)
+
+        # Only the capacity left over by the agents that aren't being moved is available to the batch
+        bystanders = self.getAgentCounts().reshape(-1) - numpy.bincount(currentIDs, minlength=self.cells.size)
+        capacity = numpy.maximum(capacity - bystanders, 0)
+
+        accepted = resolveMoves(currentIDs, targetIDs, capacity, priorities, getNumpyRandom(self.model))
+        moved = numpy.flatnonzero(accepted & (currentIDs != targetIDs))
+
+        for i, position in zip(moved.tolist(), positions[moved].tolist()):
+            for axis, p in zip(('x', 'y', 'z'), position):
+                setattr(components[i], axis, p)
+
+        if self.density is not None:
+            self.density.moveMany([agentIDs[i] for i in moved], targetIDs[moved], self.kernels)
+
+        return accepted
+
+    def addAgents(self, agents: list, positions):
+        """Adds many agents to the environment at once. positions is an (n, ndim) array of the (x[, y[, z]]) position
+        of each agent. If any position is not on the map, an error will be thrown and no agents are added."""
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, len(self.dimensions))
+        if len(positions) != len(agents):
+            raise Exception("Cannot add " + str(len(agents)) + " agents at " + str(len(positions)) + " positions.")
+        if ((positions < 0) | (positions >= numpy.array(self.dimensions))).any():
+            raise Exception("Cannot add the Agents to positions not on the map.")
+
+        for agent, pos in zip(agents, positions.tolist()):
+            agent.addComponent(PositionComponent(agent, agent.model, *pos))
+            Environment.addAgent(self, agent)
+
+        if self.density is not None:
+            for agent, cellID in zip(agents, self.toCellIDs(positions).tolist()):
+                self.density.add(agent, cellID)
+
+    def addAgentsRandomly(self, agents: list, empty: bool = True, where=None):
+        """Adds each agent to a different random cell. If empty is True (the default) only cells without agents are
+        used. See sampleCells() for the cells that where selects. Returns the IDs of the cells the agents were added
+        to."""
+        cellIDs = self.sampleCells(len(agents), empty=empty, where=where)
+        self.addAgents(agents, self.toCoordinates(cellIDs))
+        return cellIDs
+
     def setModel(self, model: Model):
         super().setModel(model)
 
-    def getAgentsAt(self, xPos: int):
-        """Returns a list of agents at position xPos. Will return [] empty if no agents are in that cell"""
-        return [self.agents[agentKey] for agentKey in self.agents if self.agents[agentKey][PositionComponent].x == xPos]
+    def getAgentsAt(self, *pos):
+        """Returns a list of agents at position (x[, y[, z]]). Will return [] empty if no agents are in that cell"""
+        pos = tuple(pos) + (0,) * (len(self.dimensions) - len(pos))
+        return [self.agents[agentKey] for agentKey in self.agents
+                if self.agents[agentKey][PositionComponent].getPosition()[:len(pos)] == pos]
 
     def getDimensions(self):
-        return self.width
+        return self.dimensions
 
-    def getCell(self, x: int):
-        if x < 0 or x >= len(self.cells):
+    def getCell(self, *pos):
+        """Returns a dict containing the position of the cell and its value for each cell component.
+        Returns None if the cell is not on the map."""
+        if not self.isOnMap(*pos):
             return None
         else:
-            return self.cells.iloc[x]
+            return self.cells.getCell(self.toCellID(pos))
+
+    def getNeighbours(self, cellPos, radius: int = 1, moore: bool = False) -> [int]:
+        """Returns a list of the IDs of all the neighbouring cells of cellPos, an (x[, y[, z]]) tuple (or an x
+        coordinate in 1D worlds), within the specified radius. If moore = true the supplied cell will also be included
+        in that list"""
+        cellID = self.toCellID(cellPos)
+        return self.kernels.neighbourIDs(cellID, self.cells.shape, radius, moore).tolist()
+
+
+class LineWorld(DiscreteWorld):
+    """ LineWorld is a discrete environment with only 1 axis (x-axis). It can be used in place of the base Environment
+    class. All agents added to a LineWorld class are given a PositionComponent to denote their place in the world.
+
+    A LineWorld's dimensions are defined by a width property. See DiscreteWorld."""
+
+    __slots__ = ['width']
+
+    def __init__(self, width, model, id: str = 'ENVIRONMENT', backend: str = 'numpy'):
+        super().__init__((width,), model, id=id, backend=backend)
+        self.width = width
+
+    def addAgent(self, agent: Agent, xPos: int = 0):
+        super().addAgent(agent, xPos)
 
-    def getNeighbours(self, cellID: int, radius: int = 1, moore: bool = False) -> [Agent]:
-        """Returns a list of all the neighbouring cells within the specified radius. If moore = true the supplied cell
-        will also be included in that list"""
-        neighbours = []
-        lower_bound = max(0, self.cells['pos'][cellID] - radius)
-        upper_bound = min(self.width, self.cells['pos'][cellID] + radius + 1)  # +1 to account for range() exclusion
+    def moveAgent(self, agentID: str, xPos: int):
+        super().moveAgent(agentID, xPos)
 
-        for x in range(lower_bound, upper_bound):
-            if moore:
-                neighbours.append(x)
-            elif self.cells['pos'][cellID] != x:
-                neighbours.append(x)
+    def getAgentsAt(self, xPos: int):
+        return super().getAgentsAt(xPos)
 
-        return neighbours
+    def getDimensions(self):
+        return self.width
+
+    def getCell(self, x: int):
+        return super().getCell(x)
 
 
-class GridWorld(Environment):
+class GridWorld(DiscreteWorld):
     """ GridWorld is a discrete environment with 2 axes (x,y-axes). It can be used in place of the base Environment
     class. All agents added to a GridWorld class are given a PositionComponent to denote their place in the world.
 
-    A GridWorld's dimensions are defined by a width and height properties.
+    A GridWorld's dimensions are defined by a width and height properties. See DiscreteWorld."""
+
+    __slots__ = ['width', 'height']
+
+    def __init__(self, width, height, model, id: str = 'ENVIRONMENT', backend: str = 'numpy'):
+        super().__init__((width, height), model, id=id, backend=backend)
+        self.width = width
+        self.height = height
+
+    def addAgent(self, agent: Agent, xPos: int = 0, yPos: int = 0):
+        super().addAgent(agent, xPos, yPos)
+
+    def moveAgent(self, agentID: str, xPos: int, yPos: int):
+        super().moveAgent(agentID, xPos, yPos)
+
+    def getAgentsAt(self, xPos: int, yPos: int):
+        return super().getAgentsAt(xPos, yPos)
+
+    def getCell(self, x, y):
+        return super().getCell(x, y)
+
+
+class ChunkedGridWorld(GridWorld):
+    """ ChunkedGridWorld is a GridWorld whose cells are stored in ChunkedCellLayers instead of CellLayers. Each cell
+    layer is split into chunks of chunkSize x chunkSize cells and a chunk is only allocated when it is written to
+    (or when it is first read, if the layer is generated by addCellComponent()). Untouched chunks read as the default
+    value of the layer. This makes very large landscapes possible when agents only ever use a small region of them.
+
+    The API is the same as a GridWorld's. getCell() and getNeighbours() work across chunk boundaries. Note that
+    cells[name] returns a ChunkedLayer rather than a NumPy array so whole-layer operations (like those in
+    ECAgent.Stencils) should be applied to regions of the layer instead. Summed-area tables are not supported (regions
+    is None) and layers cannot be moved into shared memory. trackDensity() allocates a dense count array for the whole
+    world."""
+
+    __slots__ = ['chunkSize']
+
+    def __init__(self, width, height, model, chunkSize: int = 256, id: str = 'ENVIRONMENT', backend: str = 'numpy'):
+        super().__init__(width, height, model, id=id, backend=backend)
+        self.chunkSize = chunkSize
+
+        self.cells = ChunkedCellLayers((width, height), chunkSize)
+        self.regions = None
+
+    def shareCellComponent(self, name: str) -> tuple:
+        raise Exception("Cannot share cell layer " + str(name) + " because the layers of a ChunkedGridWorld are "
+                        "chunked. Use a GridWorld to share layers with worker processes.")
+
+
+class CubeWorld(DiscreteWorld):
+    """ CubeWorld is a discrete environment with 3 axes (x,y,z-axes). It can be used in place of the base Environment
+    class. All agents added to a CubeWorld class are given a PositionComponent to denote their place in the world.
+
+    A CubeWorld's dimensions are defined by a width, height and depth properties. See DiscreteWorld."""
+
+    __slots__ = ['width', 'height', 'depth']
+
+    def __init__(self, width, height, depth, model, id: str = 'ENVIRONMENT', backend: str = 'numpy'):
+        super().__init__((width, height, depth), model, id=id, backend=backend)
+        self.width = width
+        self.height = height
+        self.depth = depth
+
+    def addAgent(self, agent: Agent, xPos: int = 0, yPos: int = 0, zPos: int = 0):
+        super().addAgent(agent, xPos, yPos, zPos)
+
+    def moveAgent(self, agentID: str, xPos: int, yPos: int, zPos: int):
+        super().moveAgent(agentID, xPos, yPos, zPos)
 
-    GridWorld.addCellComponent(comp) adds component comp to each of the cells in the environment."""
+    def getAgentsAt(self, xPos: int, yPos: int, zPos: int):
+        return super().getAgentsAt(xPos, yPos, zPos)
+
+    def getCell(self, x, y, z):
+        return super().getCell(x, y, z)
+
+
+class SpatialHash:
+    """ SpatialHash is a uniform grid index over a set of points in a continuous 1-3D space. The space, defined by
+    its bounds, is divided into buckets of size cellSize and every point is stored in the bucket that contains it.
+    Radius and nearest neighbour queries then only need to check the points in the buckets that overlap the query.
+
+    Points are identified by a key (usually an agent's id). Moving a point only updates the buckets if the point
+    moves into a different bucket, so the index is maintained incrementally rather than rebuilt.
+    If wrap is True, the space is treated as a torus and distances are measured across the bounds."""
+
+    __slots__ = ['bounds', 'cellSize', 'wrap', 'shape', 'bucketSizes', 'keys', 'rows', 'positions', 'bucketIDs',
+                 'buckets']
+
+    def __init__(self, bounds: tuple, cellSize: float = 1.0, wrap: bool = False):
+
+        if cellSize <= 0:
+            raise Exception("Cannot create a SpatialHash with a cellSize <= 0.")
+
+        self.bounds = numpy.array(bounds, dtype=float)
+        self.cellSize = float(cellSize)
+        self.wrap = wrap
+        self.shape = tuple(max(1, int(numpy.ceil(bound / self.cellSize))) for bound in bounds)
+        # Buckets are shrunk so that they tile the bounds exactly. This keeps wrapped bucket coordinates consistent.
+        self.bucketSizes = self.bounds / numpy.array(self.shape)
+
+        self.keys = []  # Key of the point stored in each row
+        self.rows = {}  # Maps a key to its row
+        self.positions = numpy.zeros((16, len(self.shape)))
+        self.bucketIDs = numpy.zeros(16, dtype=numpy.int64)
+        self.buckets = {}  # Maps a bucketID to the set of rows it contains
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def getBucketIDs(self, positions):
+        """Returns the bucketID of each position"""
+        coords = numpy.floor(numpy.asarray(positions) / self.bucketSizes).astype(numpy.int64)
+        coords = numpy.clip(coords, 0, numpy.array(self.shape) - 1)
+        return numpy.ravel_multi_index(tuple(coords.T), self.shape)
+
+    def getPosition(self, key):
+        return self.positions[self.rows[key]]
+
+    def insert(self, key, pos):
+        """Adds point 'key' at position pos to the index"""
+        if key in self.rows:
+            raise Exception("Key " + str(key) + " has already been added to the SpatialHash.")
+
+        row = len(self.keys)
+        if row == len(self.positions):  # Double capacity
+            self.positions = numpy.concatenate([self.positions, numpy.zeros_like(self.positions)])
+            self.bucketIDs = numpy.concatenate([self.bucketIDs, numpy.zeros_like(self.bucketIDs)])
+
+        self.positions[row] = pos
+        self.bucketIDs[row] = self.getBucketIDs(self.positions[row])
+        self.buckets.setdefault(int(self.bucketIDs[row]), set()).add(row)
+
+        self.keys.append(key)
+        self.rows[key] = row
+
+    def remove(self, key):
+        """Removes point 'key' from the index. The last row is moved into the removed row to keep the rows dense."""
+        if key not in self.rows:
+            raise Exception("Cannot remove key " + str(key) + " because it is not in the SpatialHash.")
+
+        row = self.rows.pop(key)
+        last = len(self.keys) - 1
+        self._removeFromBucket(row, int(self.bucketIDs[row]))
+
+        if row != last:
+            bucket = int(self.bucketIDs[last])
+            self._removeFromBucket(last, bucket)
+            self.buckets.setdefault(bucket, set()).add(row)
+
+            self.keys[row] = self.keys[last]
+            self.rows[self.keys[row]] = row
+            self.positions[row] = self.positions[last]
+            self.bucketIDs[row] = bucket
+
+        self.keys.pop()
+
+    def move(self, key, pos):
+        """Moves point 'key' to position pos"""
+        self.moveMany([key], [pos])
+
+    def moveMany(self, keys: list, positions):
+        """Moves each point in keys to its corresponding position. Buckets are only updated for points that moved
+        into a different bucket."""
+        if len(keys) == 0:
+            return
+
+        rows = numpy.array([self.rows[key] for key in keys], dtype=numpy.int64)
+        self.positions[rows] = positions
+
+        newBuckets = self.getBucketIDs(self.positions[rows])
+        changed = numpy.nonzero(newBuckets != self.bucketIDs[rows])[0]
+
+        for i in changed:
+            row = int(rows[i])
+            self._removeFromBucket(row, int(self.bucketIDs[row]))
+            self.buckets.setdefault(int(newBuckets[i]), set()).add(row)
+            self.bucketIDs[row] = newBuckets[i]
+
+    def queryRadius(self, pos, radius: float) -> list:
+        """Returns the keys of all points within radius of pos, sorted by distance"""
+        rows, distances = self._query(numpy.asarray(pos, dtype=float), radius)
+        return [self.keys[row] for row in rows[numpy.argsort(distances, kind='stable')]]
+
+    def queryNearest(self, pos, k: int) -> list:
+        """Returns the keys of the k points closest to pos, sorted by distance. The search radius starts at
+        cellSize and doubles until at least k points are found."""
+        k = min(k, len(self.keys))
+        if k <= 0:
+            return []
+
+        pos = numpy.asarray(pos, dtype=float)
+        radius = self.cellSize
+        while True:
+            rows, distances = self._query(pos, radius)
+            if len(rows) >= k:
+                return [self.keys[row] for row in rows[numpy.argsort(distances, kind='stable')[:k]]]
+            radius *= 2
+
+    def queryAllNeighbours(self, radius: float) -> dict:
+        """Returns a dict that maps the key of every point to the keys of the other points within radius of it,
+        sorted by distance. The distances are computed one bucket at a time so each point is only compared to
+        points in the surrounding buckets."""
+        result = {}
+        reach = numpy.ceil(radius / self.bucketSizes).astype(numpy.int64)
+
+        for bucket, members in self.buckets.items():
+            members = numpy.fromiter(members, dtype=numpy.int64, count=len(members))
+            coords = numpy.array(numpy.unravel_index(bucket, self.shape))
+            candidates = self._candidates(self._bucketsBetween(coords - reach, coords + reach))
+
+            distances = self._distances(self.positions[members][:, None, :], self.positions[candidates][None, :, :])
+
+            for i in range(len(members)):
+                mask = (distances[i] <= radius) & (candidates != members[i])
+                order = numpy.argsort(distances[i][mask], kind='stable')
+                result[self.keys[members[i]]] = [self.keys[row] for row in candidates[mask][order]]
+
+        return result
+
+    def _removeFromBucket(self, row: int, bucket: int):
+        self.buckets[bucket].discard(row)
+        if len(self.buckets[bucket]) == 0:
+            del self.buckets[bucket]
+
+    def _distances(self, a, b):
+        delta = numpy.abs(a - b)
+        if self.wrap:
+            delta = numpy.minimum(delta, self.bounds - delta)
+        return numpy.sqrt(numpy.sum(delta * delta, axis=-1))
+
+    def _bucketsBetween(self, lower, upper):
+        """Returns the IDs of all buckets whose coordinates lie in [lower, upper] (inclusive)"""
+        ranges = []
+        for d in range(len(self.shape)):
+            n = self.shape[d]
+            if self.wrap:
+                if upper[d] - lower[d] + 1 >= n:
+                    ranges.append(numpy.arange(n))
+                else:
+                    ranges.append(numpy.arange(lower[d], upper[d] + 1) % n)
+            else:
+                ranges.append(numpy.arange(max(lower[d], 0), min(upper[d], n - 1) + 1))
+
+        grids = numpy.meshgrid(*ranges, indexing='ij')
+        return numpy.ravel_multi_index(tuple(grid.ravel() for grid in grids), self.shape)
+
+    def _candidates(self, bucketIDs):
+        rows = [row for bucket in bucketIDs if bucket in self.buckets for row in self.buckets[bucket]]
+        return numpy.array(rows, dtype=numpy.int64)
+
+    def _query(self, pos, radius: float):
+        """Returns the rows and distances of all points within radius of pos"""
+        if radius >= numpy.linalg.norm(self.bounds) + numpy.linalg.norm(pos):  # The query covers every point
+            rows = numpy.arange(len(self.keys))
+        else:
+            lower = numpy.floor((pos - radius) / self.bucketSizes).astype(numpy.int64)
+            upper = numpy.floor((pos + radius) / self.bucketSizes).astype(numpy.int64)
+            rows = self._candidates(self._bucketsBetween(lower, upper))
+
+        distances = self._distances(self.positions[rows], pos)
+        mask = distances <= radius
+        return rows[mask], distances[mask]
+
+
+class ContinuousWorld(Environment):
+    """ ContinuousWorld is a continuous environment with 2 (x,y) or 3 (x,y,z) axes. It can be used in place of the base
+    Environment class. All agents added to a ContinuousWorld are given a PositionComponent to denote their place in
+    the world. A ContinuousWorld is 3D if it is given a depth > 0.
+
+    Positions must lie in [0, width), [0, height) and [0, depth). If wrap is True, the world is toroidal: positions
+    outside of the bounds are wrapped around and distances are measured across the edges of the world.
+
+    Agent positions are stored in a SpatialHash with buckets of size cellSize. For the best performance, cellSize
+    should be close to the radius of your most common query. Agents should be moved with moveAgent() so that the
+    index is kept up to date. If you change PositionComponents directly, call updateIndex() before querying."""
 
-    __slots__ = ['width', 'height', 'cells']
+    __slots__ = ['width', 'height', 'depth', 'wrap', 'index']
 
-    def __init__(self, width, height, model, id: str = 'ENVIRONMENT'):
+    def __init__(self, width: float, height: float, model, depth: float = 0.0, wrap: bool = False,
+                 cellSize: float = 1.0, id: str = 'ENVIRONMENT'):
 
-        if width < 1 or height < 1:
-            raise Exception("Cannot create a GridWorld with a negative width or height.")
+        if width <= 0 or height <= 0 or depth < 0:
+            raise Exception("Cannot create a ContinuousWorld with a negative width, height or depth.")
 
         super().__init__(model, id=id)
         self.width = width
         self.height = height
+        self.depth = depth
+        self.wrap = wrap
 
-        # Create cells
-        self.cells = pandas.DataFrame({'pos': [(x, y) for y in range(height) for x in range(width)]})
+        self.index = SpatialHash(self.getDimensions(), cellSize, wrap)
 
-    def addAgent(self, agent: Agent, xPos: int = 0, yPos: int = 0):
+    def _toWorldPosition(self, xPos: float, yPos: float, zPos: float):
+        """Wraps or validates the supplied position and returns it as an array"""
+        pos = numpy.array([xPos, yPos, zPos][:len(self.index.shape)], dtype=float)
+
+        if self.wrap:
+            pos = pos % self.index.bounds
+        elif (pos < 0).any() or (pos >= self.index.bounds).any():
+            raise Exception("Cannot place the Agent at a position not on the map.")
+
+        return pos
+
+    def addAgent(self, agent: Agent, xPos: float = 0.0, yPos: float = 0.0, zPos: float = 0.0):
         """Adds an agent to the environment. Overrides the base class function.
         This function will also add a PositionComponent to the agent object.
-        If the xPos or yPos is greater than the width of the world, an error will be thrown."""
+        If the position is not on the map and the world does not wrap, an error will be thrown."""
 
-        if xPos >= self.width or xPos < 0 or yPos >= self.height or yPos < 0:
-            raise Exception("Cannot add the Agent to position not on the map.")
+        pos = self._toWorldPosition(xPos, yPos, zPos)
 
-        agent.addComponent(PositionComponent(agent, agent.model, x=xPos, y=yPos))
+        agent.addComponent(PositionComponent(agent, agent.model, *pos))
         super().addAgent(agent)
-
-    def addCellComponent(self, name: str, generator):
-        """ Adds the component supplied by the generator functor to each of the cells.
-        The functor is supplied with the cell as input"""
-
-        self.cells[name] = [generator(pos, self.cells) for pos in self.cells['pos']]
+        self.index.insert(agent.id, pos)
 
     def removeAgent(self, agentID: str):
         """ Removes the agent from the environment. Will also remove the PositionComponent from the agent"""
         if agentID in self.agents:
             self.agents[agentID].removeComponent(PositionComponent)
+            self.index.remove(agentID)
 
         super().removeAgent(agentID)
 
     def setModel(self, model: Model):
         super().setModel(model)
 
-    def getAgentsAt(self, xPos: int, yPos: int):
-        """Returns a list of agents at position xPos. Will return [] empty if no agents are in that cell"""
-        return [self.agents[agentKey] for agentKey in self.agents
-                if self.agents[agentKey][PositionComponent].x == xPos and self.agents[agentKey][PositionComponent].y == yPos]
+    def moveAgent(self, agentID: str, xPos: float, yPos: float, zPos: float = 0.0):
+        """Moves an agent to a new position and updates the spatial index."""
+        pos = self._toWorldPosition(xPos, yPos, zPos)
+
+        component = self.agents[agentID][PositionComponent]
+        component.x, component.y = pos[0], pos[1]
+        if len(pos) > 2:
+            component.z = pos[2]
+
+        self.index.move(agentID, pos)
+
+    def updateIndex(self):
+        """Synchronizes the spatial index with the PositionComponents of all agents. Only agents that have moved into a
+        different bucket will update the index's buckets."""
+        keys = list(self.index.keys)
+        if len(keys) == 0:
+            return
+
+        positions = numpy.array([self.agents[key][PositionComponent].getPosition() for key in keys], dtype=float)
+        positions = positions[:, :len(self.index.shape)]
+        if self.wrap:
+            positions = positions % self.index.bounds
+
+        self.index.moveMany(keys, positions)
 
     def getDimensions(self):
+        if self.depth > 0:
+            return self.width, self.height, self.depth
         return self.width, self.height
 
-    def getCell(self, x, y):
-        if x < 0 or x >= self.width or y < 0 or y >= self.height:
-            return None
-        else:
-            return self.cells.iloc[x + (y * self.width)]
-
-    def getNeighbours(self, cell_pos: (int, int), radius: int = 1, moore: bool = False) -> [int]:
-        """Returns a list of all the neighbouring cells within the specified radius. If moore = true the supplied cell
-        will also be included in that list"""
-        neighbours = []
-
-        xlower_bound = max(0, cell_pos[0] - radius)
-        xupper_bound = min(self.width, cell_pos[0] + radius + 1)  # +1 to account for range() exclusion
-
-        ylower_bound = max(0, cell_pos[1] - radius)
-        yupper_bound = min(self.height, cell_pos[1] + radius + 1)  # +1 to account for range() exclusion
-        cellID = discreteGridPosToID(cell_pos[0], cell_pos[1], self.width)
-
-        for y in range(ylower_bound, yupper_bound):
-            for x in range(xlower_bound, xupper_bound):
-                id = discreteGridPosToID(x, y, self.width)
-                if self.cells['pos'][cellID][0] == x and self.cells['pos'][cellID][1] == y:
-                    if moore:
-                        neighbours.append(id)
-                else:
-                    neighbours.append(id)
+    def getAgentsInRadius(self, pos: tuple, radius: float) -> [Agent]:
+        """Returns a list of all agents within radius of pos, sorted by distance"""
+        return [self.agents[key] for key in self.index.queryRadius(pos[:len(self.index.shape)], radius)]
 
-        return neighbours
+    def getNearestAgents(self, pos: tuple, k: int = 1) -> [Agent]:
+        """Returns a list of the k agents closest to pos, sorted by distance"""
+        return [self.agents[key] for key in self.index.queryNearest(pos[:len(self.index.shape)], k)]
 
+    def getAllNeighbours(self, radius: float) -> dict:
+        """Returns a dict that maps the id of every agent to a list of the other agents within radius of it. This is
+        much faster than calling getAgentsInRadius() for each agent."""
+        return {key: [self.agents[neighbour] for neighbour in neighbours]
+                for key, neighbours in self.index.queryAllNeighbours(radius).items()}
 
-class CubeWorld(Environment):
-    """ CubeWorld is a discrete environment with 3 axes (x,y,z-axes). It can be used in place of the base Environment
-    class. All agents added to a GridWorld class are given a PositionComponent to denote their place in the world.
 
-    A CubeWorld's dimensions are defined by a width, height and depth properties.
+class NodeComponent(Component):
+    """ A node component. It contains the ID of the node an Agent is on in a NetworkWorld."""
 
-    CubeWorld.addCellComponent(comp) adds component comp to each of the cells in the environment."""
+    __slots__ = ['node']
 
-    __slots__ = ['width', 'height', 'depth', 'cells']
+    def __init__(self, agent, model, node: int = 0) -> None:
+        super().__init__(agent, model)
+        self.node = node
 
-    def __init__(self, width, height, depth, model, id: str = 'ENVIRONMENT'):
 
-        if width < 1 or height < 1 or depth < 1:
-            raise Exception("Cannot create a CubeWorld with a negative width or height.")
+class NetworkWorld(Environment):
+    """ NetworkWorld is a graph environment. It can be used in place of the base Environment class. All agents added
+    to a NetworkWorld are given a NodeComponent to denote the node they are on.
 
-        super().__init__(model, id=id)
-        self.width = width
-        self.height = height
-        self.depth = depth
+    A NetworkWorld's dimensions are defined by its number of nodes (size). Edges are stored in compressed sparse row
+    (CSR) form: the neighbours of node n are indices[indptr[n]:indptr[n + 1]]. The position of an edge in indices is
+    its edge ID. Edges are loaded in bulk from arrays of source and target nodes with loadEdges().
 
-        # Create cells
-        self.cells = pandas.DataFrame({
-            'pos': [(x, y, z) for z in range(depth) for y in range(height) for x in range(width)]
-        })
+    Node data is stored in the nodes property, a CellLayers object with one cell per node. Edge data is stored in the
+    edges property, a dict of named NumPy arrays with one value per edge ID. The number of agents on each node is
+    always tracked (see getDensity())."""
+
+    __slots__ = ['size', 'indptr', 'indices', 'nodes', 'edges', 'density']
+
+    def __init__(self, size: int, model, id: str = 'ENVIRONMENT'):
 
-    def addAgent(self, agent: Agent, xPos: int = 0, yPos: int = 0, zPos: int = 0.0):
+        if size < 1:
+            raise Exception("Cannot create a NetworkWorld with less than 1 node.")
+
+        super().__init__(model, id=id)
+        self.size = size
+
+        self.indptr = numpy.zeros(size + 1, dtype=numpy.int64)
+        self.indices = numpy.zeros(0, dtype=numpy.int64)
+        self.nodes = CellLayers((size,))
+        self.edges = {}
+        self.density = AgentDensity((size,))
+
+    def loadEdges(self, sources, targets, directed: bool = False, layers: dict = None):
+        """Replaces the edges of the network with the edges sources[i] -> targets[i]. If directed is False, each edge
+        is also added in the opposite direction. layers is an optional dict of edge layers, where each layer contains
+        one value per edge in the order they were supplied. Any existing edge layers are discarded."""
+        sources = numpy.asarray(sources, dtype=numpy.int64).reshape(-1)
+        targets = numpy.asarray(targets, dtype=numpy.int64).reshape(-1)
+        layers = {} if layers is None else {name: numpy.asarray(values).reshape(-1) for name, values in layers.items()}
+
+        if len(sources) != len(targets):
+            raise Exception("Cannot load " + str(len(sources)) + " sources and " + str(len(targets)) + " targets.")
+        for name, values in layers.items():
+            if len(values) != len(sources):
+                raise Exception("Edge layer " + str(name) + " does not contain one value per edge.")
+        if len(sources) > 0:
+            lowest, highest = min(sources.min(), targets.min()), max(sources.max(), targets.max())
+            if lowest < 0 or highest >= self.size:
+                raise Exception("Cannot add an edge between nodes that are not in the network.")
+
+        if not directed:
+            sources, targets = numpy.concatenate([sources, targets]), numpy.concatenate([targets, sources])
+            layers = {name: numpy.concatenate([values, values]) for name, values in layers.items()}
+
+        order = numpy.argsort(sources, kind='stable')
+        self.indptr = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(sources, minlength=self.size))])
+        self.indices = targets[order]
+        self.edges = {name: values[order] for name, values in layers.items()}
+
+    def addEdgeLayer(self, name: str, values):
+        """Adds an edge layer called name. values can be a scalar or contain one value per edge ID."""
+        self.edges[name] = toLayerArray(values, (len(self.indices),))
+
+    def addNodeComponent(self, name: str, generator, mode: str = 'cell', lazy: bool = False):
+        """ Adds the component supplied by the generator functor to each of the nodes. See
+        CellLayers.addLayer()."""
+        self.nodes.addLayer(name, generator, mode, lazy, getNumpyRandom(self.model) if mode == 'shape' else None)
+
+    def addAgent(self, agent: Agent, node: int = 0):
         """Adds an agent to the environment. Overrides the base class function.
-        This function will also add a PositionComponent to the agent object.
-        If the xPos, yPos or zPos is greater than the width of the world, an error will be thrown."""
+        This function will also add a NodeComponent to the agent object.
+        If the node is not in the network, an error will be thrown."""
 
-        if xPos >= self.width or xPos < 0 or yPos >= self.height or yPos < 0 or zPos >= self.depth or zPos < 0:
-            raise Exception("Cannot add the Agent to position not on the map.")
+        if node >= self.size or node < 0:
+            raise Exception("Cannot add the Agent to a node not in the network.")
 
-        agent.addComponent(PositionComponent(agent, agent.model, x=xPos, y=yPos, z=zPos))
+        agent.addComponent(NodeComponent(agent, agent.model, node))
         super().addAgent(agent)
-
-    def addCellComponent(self, name: str, generator):
-        """ Adds the component supplied by the generator functor to each of the cells.
-        The functor is supplied with the cell as input"""
-        self.cells[name] = [generator(pos, self.cells) for pos in self.cells['pos']]
+        self.density.add(agent, node)
 
     def removeAgent(self, agentID: str):
-        """ Removes the agent from the environment. Will also remove the PositionComponent from the agent"""
+        """ Removes the agent from the environment. Will also remove the NodeComponent from the agent"""
         if agentID in self.agents:
-            self.agents[agentID].removeComponent(PositionComponent)
+            self.agents[agentID].removeComponent(NodeComponent)
+            self.density.remove(agentID)
 
         super().removeAgent(agentID)
 
+    def moveAgent(self, agentID: str, node: int):
+        """Moves an agent to a new node. If the node is not in the network, an error will be thrown."""
+
+        if node >= self.size or node < 0:
+            raise Exception("Cannot move the Agent to a node not in the network.")
+
+        self.agents[agentID][NodeComponent].node = node
+        self.density.move(agentID, node)
+
+    def moveAgents(self, agentIDs: list, nodes):
+        """Moves each agent in agentIDs to the corresponding node in nodes. The density counts are updated in one
+        pass."""
+        nodes = numpy.asarray(nodes, dtype=numpy.int64).reshape(-1)
+        if len(nodes) > 0 and (nodes.min() < 0 or nodes.max() >= self.size):
+            raise Exception("Cannot move the Agents to nodes not in the network.")
+
+        for agentID, node in zip(agentIDs, nodes.tolist()):
+            self.agents[agentID][NodeComponent].node = node
+
+        self.density.moveMany(agentIDs, nodes)
+
+    def trackDensity(self, *componentTypes):
+        """Keeps separate counts of the number of agents on each node for each of the component types supplied. See
+        AgentDensity."""
+        self.density = AgentDensity((self.size,), componentTypes)
+        agents = self.getAgents()
+        self.density.rebuild(agents, [agent[NodeComponent].node for agent in agents])
+
+    def getDensity(self, componentType: type = None):
+        """Returns a NumPy array containing the number of agents on each node. If componentType is supplied, only
+        agents with that component are counted."""
+        return self.density.get(componentType)
+
     def setModel(self, model: Model):
         super().setModel(model)
 
-    def getAgentsAt(self, xPos: int, yPos: int, zPos: int):
-        """Returns a list of agents at position xPos. Will return [] empty if no agents are in that cell"""
-        return [self.agents[agentKey] for agentKey in self.agents
-                if self.agents[agentKey][PositionComponent].x == xPos and self.agents[agentKey][PositionComponent].y == yPos and self.agents[agentKey][PositionComponent].z == zPos]
+    def getAgentsAt(self, node: int):
+        """Returns a list of agents on node. Will return [] empty if no agents are on that node"""
+        return [self.agents[agentKey] for agentKey in self.agents if self.agents[agentKey][NodeComponent].node == node]
 
     def getDimensions(self):
-        return self.width, self.height, self.depth
-
-    def getCell(self, x, y, z):
-        if x < 0 or x >= self.width or y < 0 or y >= self.height or z < 0 or z >= self.depth:
-            return None
-        else:
-            return self.cells['pos'][discreteGridPosToID(x, y, self.width, z, self.height)]
-
-    def getNeighbours(self, cell_pos: (int, int, int), radius: int = 1, moore: bool = False) -> [int]:
-        """Returns a list of all the neighbouring cells within the specified radius. If moore = true the supplied cell
-        will also be included in that list"""
-        neighbours = []
-        cellID = discreteGridPosToID(cell_pos[0], cell_pos[0], self.width, cell_pos[2], self.height)
-
-        xlower_bound = max(0, self.cells['pos'][cellID][0] - radius)
-        xupper_bound = min(self.width, self.cells['pos'][cellID][0] + radius + 1)
-
-        ylower_bound = max(0, self.cells['pos'][cellID][1] - radius)
-        yupper_bound = min(self.height, self.cells['pos'][cellID][1] + radius + 1)
-
-        zlower_bound = max(0, self.cells['pos'][cellID][2] - radius)
-        zupper_bound = min(self.depth, self.cells['pos'][cellID][2] + radius + 1)
-
-        for z in range(zlower_bound, zupper_bound):
-            for y in range(ylower_bound, yupper_bound):
-                for x in range(xlower_bound, xupper_bound):
-                    id = discreteGridPosToID(x, y, self.width, z, self.height)
-                    if self.cells['pos'][cellID][0] == x and self.cells['pos'][cellID][1] == y and \
-                            self.cells['pos'][cellID][2] == z:
-                        if moore:
-                            neighbours.append(id)
-                    else:
-                        neighbours.append(id)
-
-        return neighbours
+        return self.size
+
+    def getEdgeCount(self) -> int:
+        """Returns the number of (directed) edges in the network"""
+        return len(self.indices)
+
+    def getDegree(self, nodes=None):
+        """Returns the number of outgoing edges of each node in nodes, or of every node if nodes is None"""
+        degree = numpy.diff(self.indptr)
+        return degree if nodes is None else degree[nodes]
+
+    def getNeighbours(self, node: int):
+        """Returns an array of the nodes connected to node by an outgoing edge"""
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def getEdgeIDs(self, node: int):
+        """Returns an array of the IDs of node's outgoing edges"""
+        return numpy.arange(self.indptr[node], self.indptr[node + 1])
+
+    def gatherNeighbours(self, nodes):
+        """Returns the outgoing edges of every node in nodes as three arrays (rows, neighbours, edgeIDs), where rows[i]
+        is the position in nodes of the source of edge edgeIDs[i] and neighbours[i] is its target."""
+        nodes = numpy.asarray(nodes, dtype=numpy.int64).reshape(-1)
+        counts = numpy.diff(self.indptr)[nodes]
+        rows = numpy.repeat(numpy.arange(len(nodes)), counts)
+
+        offsets = numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        edgeIDs = self.indptr[nodes][rows] + offsets
+        return rows, self.indices[edgeIDs], edgeIDs
+
+    def sumNeighbours(self, values, weights=None):
+        """Returns the sum of values over the neighbours of every node, where values contains one value per node. If
+        weights is supplied (an edge layer name or one value per edge ID), each neighbour's value is multiplied by the
+        weight of the edge to it. This is the core operation of most contagion and opinion models."""
+        gathered = numpy.asarray(values)[self.indices]
+        if weights is not None:
+            gathered = gathered * (self.edges[weights] if isinstance(weights, str) else numpy.asarray(weights))
+
+        sources = numpy.repeat(numpy.arange(self.size), numpy.diff(self.indptr))
+        return numpy.bincount(sources, weights=gathered, minlength=self.size)
@@ -0,0 +1,195 @@
+import warnings
+
+import numpy
+
+from ECAgent.Stencils import diffuse, neighbourhoodKernel
+
+try:
+    import numba
+except ImportError:  # Numba is optional. The NumPy kernels are used if it isn't installed.
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def _toShape3D(shape: tuple):
+    """Pads a 1-3D (row-major) shape to (depth, height, width)"""
+    return (1,) * (3 - len(shape)) + tuple(shape)
+
+
+def _neighbourhoodOffsets(ndim: int, moore: bool):
+    """Returns the (dz, dy, dx) offsets of a cell's neighbours as an (n, 3) array"""
+    offsets = numpy.argwhere(neighbourhoodKernel(ndim, moore) > 0) - 1
+    return numpy.concatenate([numpy.zeros((len(offsets), 3 - ndim), dtype=numpy.int64), offsets], axis=1)
+
+
+class NumpyKernels:
+    """ The NumPy implementation of the hot paths of the discrete worlds. Every kernel works on the row-major arrays
+    used by CellLayers and on flat cell IDs (see discreteGridPosToID). This is the default backend and is always
+    available. See getKernels()."""
+
+    name = 'numpy'
+
+    @staticmethod
+    def neighbourIDs(cellID: int, shape: tuple, radius: int = 1, includeSelf: bool = False):
+        """Returns the IDs of all cells within radius (along every axis) of cellID in a bounded world with the
+        supplied row-major shape, sorted in ascending order. The cell itself is only included if includeSelf is
+        True."""
+        coords = numpy.unravel_index(cellID, shape)
+        ranges = [numpy.arange(max(c - radius, 0), min(c + radius + 1, n)) for c, n in zip(coords, shape)]
+        grids = numpy.meshgrid(*ranges, indexing='ij')
+        ids = numpy.ravel_multi_index(tuple(grid.ravel() for grid in grids), shape)
+
+        return ids if includeSelf else ids[ids != cellID]
+
+    @staticmethod
+    def updateOccupancy(counts, oldIDs, newIDs):
+        """Moves one count from each cell in oldIDs to the corresponding cell in newIDs. counts is updated in
+        place. Either array of IDs can be empty, in which case counts are only added or removed."""
+        flat = counts.reshape(-1)
+        numpy.subtract.at(flat, numpy.asarray(oldIDs, dtype=numpy.int64), 1)
+        numpy.add.at(flat, numpy.asarray(newIDs, dtype=numpy.int64), 1)
+
+    @staticmethod
+    def diffuse(layer, rate: float, toroidal: bool = False, moore: bool = False):
+        """Diffuses a cell layer. See ECAgent.Stencils.diffuse()."""
+        return diffuse(layer, rate, toroidal, moore)
+
+    @staticmethod
+    def movePositions(positions, deltas, dimensions: tuple, toroidal: bool = False):
+        """Moves every position (an (n, ndim) array of (x[, y[, z]]) coordinates) by its delta. Positions are
+        wrapped around the dimensions of the world if toroidal is True and clamped to the edges of the world
+        otherwise. Returns the new positions and their cell IDs."""
+        dimensions = numpy.asarray(dimensions, dtype=numpy.int64)
+        moved = numpy.asarray(positions, dtype=numpy.int64) + numpy.asarray(deltas, dtype=numpy.int64)
+
+        if toroidal:
+            moved %= dimensions
+        else:
+            moved = numpy.clip(moved, 0, dimensions - 1)
+
+        strides = numpy.concatenate([[1], numpy.cumprod(dimensions)[:-1]])
+        return moved, moved @ strides
+
+
+if NUMBA_AVAILABLE:
+
+    @numba.njit(cache=True)
+    def _numbaNeighbourIDs(cellID, depth, height, width, radius, includeSelf):
+        z, remainder = cellID // (height * width), cellID % (height * width)
+        y, x = remainder // width, remainder % width
+
+        z0, z1 = max(z - radius, 0), min(z + radius + 1, depth)
+        y0, y1 = max(y - radius, 0), min(y + radius + 1, height)
+        x0, x1 = max(x - radius, 0), min(x + radius + 1, width)
+
+        ids = numpy.empty((z1 - z0) * (y1 - y0) * (x1 - x0), dtype=numpy.int64)
+        n = 0
+        for zz in range(z0, z1):
+            for yy in range(y0, y1):
+                for xx in range(x0, x1):
+                    cell = (zz * height + yy) * width + xx
+                    if includeSelf or cell != cellID:
+                        ids[n] = cell
+                        n += 1
+        return ids[:n]
+
+    @numba.njit(cache=True)
+    def _numbaUpdateOccupancy(flat, oldIDs, newIDs):
+        for i in range(len(oldIDs)):
+            flat[oldIDs[i]] -= 1
+        for i in range(len(newIDs)):
+            flat[newIDs[i]] += 1
+
+    @numba.njit(cache=True)
+    def _numbaDiffuse(layer, rate, toroidal, offsets):
+        depth, height, width = layer.shape
+        result = layer * (1.0 - rate)
+        share = rate / len(offsets)
+
+        for z in range(depth):
+            for y in range(height):
+                for x in range(width):
+                    value = layer[z, y, x] * share
+                    for i in range(len(offsets)):
+                        nz, ny, nx = z + offsets[i, 0], y + offsets[i, 1], x + offsets[i, 2]
+                        if nz < 0 or nz >= depth or ny < 0 or ny >= height or nx < 0 or nx >= width:
+                            if not toroidal:
+                                result[z, y, x] += value  # Shares that would leave the world stay in the cell
+                                continue
+                            # Offsets are at most 1 cell so wrapping only needs to add or subtract the dimension
+                            nz = nz + depth if nz < 0 else (nz - depth if nz >= depth else nz)
+                            ny = ny + height if ny < 0 else (ny - height if ny >= height else ny)
+                            nx = nx + width if nx < 0 else (nx - width if nx >= width else nx)
+                        result[nz, ny, nx] += value
+        return result
+
+    @numba.njit(cache=True)
+    def _numbaMovePositions(positions, deltas, dimensions, toroidal):
+        moved = numpy.empty_like(positions)
+        ids = numpy.zeros(len(positions), dtype=numpy.int64)
+
+        for i in range(len(positions)):
+            stride = 1
+            for d in range(len(dimensions)):
+                p = positions[i, d] + deltas[i, d]
+                if toroidal:
+                    p = p % dimensions[d]
+                else:
+                    p = min(max(p, 0), dimensions[d] - 1)
+                moved[i, d] = p
+                ids[i] += p * stride
+                stride *= dimensions[d]
+        return moved, ids
+
+
+class NumbaKernels(NumpyKernels):
+    """ The Numba implementation of the kernels in NumpyKernels. Each kernel is compiled the first time it is called,
+    so the first call is slow. Branchy kernels (like neighbour enumeration on small neighbourhoods) benefit the most.
+    Only available if Numba is installed."""
+
+    name = 'numba'
+
+    @staticmethod
+    def neighbourIDs(cellID: int, shape: tuple, radius: int = 1, includeSelf: bool = False):
+        depth, height, width = _toShape3D(shape)
+        return _numbaNeighbourIDs(int(cellID), depth, height, width, int(radius), includeSelf)
+
+    @staticmethod
+    def updateOccupancy(counts, oldIDs, newIDs):
+        _numbaUpdateOccupancy(counts.reshape(-1), numpy.asarray(oldIDs, dtype=numpy.int64),
+                              numpy.asarray(newIDs, dtype=numpy.int64))
+
+    @staticmethod
+    def diffuse(layer, rate: float, toroidal: bool = False, moore: bool = False):
+        if rate < 0.0 or rate > 1.0:
+            raise Exception("The diffusion rate must be between 0 and 1.")
+
+        layer = numpy.asarray(layer, dtype=float)
+        offsets = _neighbourhoodOffsets(layer.ndim, moore)
+        return _numbaDiffuse(layer.reshape(_toShape3D(layer.shape)), rate, toroidal, offsets).reshape(layer.shape)
+
+    @staticmethod
+    def movePositions(positions, deltas, dimensions: tuple, toroidal: bool = False):
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        deltas = numpy.broadcast_to(numpy.asarray(deltas, dtype=numpy.int64), positions.shape)
+        return _numbaMovePositions(positions, numpy.ascontiguousarray(deltas),
+                                   numpy.asarray(dimensions, dtype=numpy.int64), toroidal)
+
+
+def getKernels(backend: str = 'numpy'):
+    """Returns the kernels for the supplied backend: 'numpy', 'numba' or 'auto' (Numba if it is installed, NumPy
+    otherwise). If 'numba' is requested but Numba is not installed, a warning is raised and the NumPy kernels are
+    returned instead."""
+    if backend == 'auto':
+        backend = 'numba' if NUMBA_AVAILABLE else 'numpy'
+
+    if backend == 'numpy':
+        return NumpyKernels
+    elif backend == 'numba':
+        if not NUMBA_AVAILABLE:
+            warnings.warn("Numba is not installed. Falling back to the NumPy kernels.")
+            return NumpyKernels
+        return NumbaKernels
+
+    raise Exception("Unknown kernel backend: " + str(backend) + ". Use 'numpy', 'numba' or 'auto'.")
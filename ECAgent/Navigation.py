@@ -0,0 +1,167 @@
+from collections import OrderedDict
+
+import numpy
+
+from ECAgent.Environments import GridWorld, discreteGridPosToID
+from ECAgent.Stencils import neighbourhoodKernel
+
+
+class FlowFields:
+    """ FlowFields is a GridWorld service that computes distance and flow fields toward sets of target cells.
+    Instead of every agent running its own search over getNeighbours(), the fields are computed once per set of
+    targets with a multi-source breadth-first search and cached. An agent's next step is then a single array lookup.
+
+    A distance field contains the number of steps from each cell to the nearest target (-1 if no target can be
+    reached). A flow field contains the ID of the neighbouring cell that each cell should step to next (targets point to
+    themselves and cells that cannot reach a target contain -1).
+
+    Movement is restricted to the cells whose value in the passable layer is non-zero. If passable is None, every cell
+    is passable. If moore is True agents can also move diagonally.
+
+    The passable layer is snapshotted when fields are computed. Whenever the layer's version changes (see
+    CellLayers.markModified()), the next query calls update() and only the cached fields affected by the changed cells
+    are invalidated. update() can also be called directly. At most cacheSize fields are kept. The least recently used
+    fields are discarded first."""
+
+    def __init__(self, world: GridWorld, passable: str = None, moore: bool = False, cacheSize: int = 16):
+        self.world = world
+        self.passable = passable
+        self.moore = moore
+        self.cacheSize = cacheSize
+
+        self.offsets = numpy.argwhere(neighbourhoodKernel(2, moore) > 0) - 1  # (dy, dx) pairs
+        self.snapshot = self._getPassable().copy()
+        self.version = self._getVersion()  # The version of the passable layer the snapshot was taken from
+        self.fields = OrderedDict()  # Maps a tuple of target IDs to a (distance, flow) tuple
+
+    def _getPassable(self):
+        if self.passable is None:
+            return numpy.ones((self.world.height, self.world.width), dtype=bool)
+        return self.world.cells[self.passable] != 0
+
+    def _getVersion(self):
+        return None if self.passable is None else self.world.cells.getVersion(self.passable)
+
+    def _toTargetIDs(self, targets) -> tuple:
+        """Converts a list of (x, y) positions into a sorted tuple of unique cell IDs"""
+        targets = numpy.asarray(targets, dtype=numpy.int64).reshape(-1, 2)
+        return tuple(numpy.unique(discreteGridPosToID(targets[:, 0], targets[:, 1], self.world.width)).tolist())
+
+    def _computeFields(self, targetIDs: tuple):
+        height, width = self.snapshot.shape
+        passable = self.snapshot.reshape(-1)
+
+        distance = numpy.full(height * width, -1, dtype=numpy.int32)
+        frontier = numpy.array([t for t in targetIDs if passable[t]], dtype=numpy.int64)
+        distance[frontier] = 0
+
+        # Multi-source breadth-first search. Each iteration expands the whole frontier at once.
+        step = 0
+        while len(frontier) > 0:
+            step += 1
+            y, x = numpy.divmod(frontier, width)
+            reached = []
+            for dy, dx in self.offsets:
+                ny, nx = y + dy, x + dx
+                valid = (ny >= 0) & (ny < height) & (nx >= 0) & (nx < width)
+                neighbours = ny[valid] * width + nx[valid]
+                neighbours = neighbours[(distance[neighbours] == -1) & passable[neighbours]]
+                distance[neighbours] = step
+                reached.append(neighbours)
+            frontier = numpy.unique(numpy.concatenate(reached))
+
+        distance = distance.reshape(height, width)
+
+        # Each cell flows to the neighbour with the smallest distance
+        unreachable = numpy.iinfo(numpy.int32).max
+        padded = numpy.pad(numpy.where(distance < 0, unreachable, distance), 1, constant_values=unreachable)
+        candidates = numpy.stack([padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width] for dy, dx in self.offsets])
+        best = numpy.argmin(candidates, axis=0)
+
+        ys, xs = numpy.indices((height, width))
+        flow = (ys + self.offsets[best, 0]) * width + (xs + self.offsets[best, 1])
+        flow[distance == 0] = (ys * width + xs)[distance == 0]
+        flow[distance < 0] = -1
+
+        return distance, flow
+
+    def _getFields(self, targets):
+        if self._getVersion() != self.version:
+            self.update()
+
+        targetIDs = self._toTargetIDs(targets)
+
+        if targetIDs in self.fields:
+            self.fields.move_to_end(targetIDs)
+        else:
+            self.fields[targetIDs] = self._computeFields(targetIDs)
+            if len(self.fields) > self.cacheSize:
+                self.fields.popitem(last=False)
+
+        return self.fields[targetIDs]
+
+    def getDistanceField(self, targets):
+        """Returns the distance field for the list of (x, y) target positions as a (height, width) array"""
+        return self._getFields(targets)[0]
+
+    def getFlowField(self, targets):
+        """Returns the flow field for the list of (x, y) target positions as a (height, width) array of cell IDs"""
+        return self._getFields(targets)[1]
+
+    def getNextStep(self, targets, xPos: int, yPos: int):
+        """Returns the (x, y) position an agent at (xPos, yPos) should move to next to reach the nearest target.
+        Returns None if no target can be reached."""
+        nextID = int(self.getFlowField(targets)[yPos, xPos])
+        if nextID < 0:
+            return None
+        return nextID % self.world.width, nextID // self.world.width
+
+    def getNextSteps(self, targets, positions):
+        """Returns the next (x, y) position for each position in the (n, 2) array positions. Positions that cannot
+        reach a target stay where they are."""
+        positions = numpy.asarray(positions, dtype=numpy.int64).reshape(-1, 2)
+        nextIDs = self.getFlowField(targets)[positions[:, 1], positions[:, 0]]
+
+        steps = numpy.stack([nextIDs % self.world.width, nextIDs // self.world.width], axis=1)
+        steps[nextIDs < 0] = positions[nextIDs < 0]
+        return steps
+
+    def setPassable(self, xPos: int, yPos: int, passable: bool):
+        """Sets whether cell (xPos, yPos) is passable and invalidates the cached fields that it affects"""
+        if self.passable is None:
+            raise Exception("Cannot change the passability of a FlowFields object that has no passable layer.")
+
+        self.world.cells.markModified(self.passable)
+        self.world.cells[self.passable][yPos, xPos] = passable
+        self.update()
+
+    def update(self):
+        """Compares the passable layer with the snapshot used to compute the cached fields and invalidates the fields
+        affected by the cells that changed. A field is affected if a cell it could reach became impassable or if a cell
+        next to a reachable cell became passable."""
+        current = self._getPassable()
+        self.version = self._getVersion()
+        changed = numpy.argwhere(current != self.snapshot)
+        if len(changed) == 0:
+            return
+
+        for targetIDs in list(self.fields.keys()):
+            distance = self.fields[targetIDs][0]
+            for y, x in changed:
+                if current[y, x]:
+                    neighbours = distance[max(y - 1, 0):y + 2, max(x - 1, 0):x + 2]
+                    affected = (neighbours >= 0).any() or discreteGridPosToID(x, y, self.world.width) in targetIDs
+                else:
+                    affected = distance[y, x] >= 0
+
+                if affected:
+                    del self.fields[targetIDs]
+                    break
+
+        self.snapshot = current.copy()
+
+    def invalidate(self):
+        """Discards all of the cached fields"""
+        self.fields.clear()
+        self.snapshot = self._getPassable().copy()
+        self.version = self._getVersion()
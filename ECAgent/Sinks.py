@@ -0,0 +1,247 @@
+import glob
+import os
+import queue
+import threading
+import time
+import weakref
+
+import numpy
+import pandas
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional. The ParquetSink is only available if it is installed.
+    pyarrow = None
+
+PARQUET_AVAILABLE = pyarrow is not None
+
+
+class Sink:
+    """ This is the Sink base class. A sink stores the records of a Collector on disk as a sequence of chunks so that
+    the collector's memory use stays bounded during long runs. Every call to write() stores a dict of equal length
+    columns as a new chunk file named <prefix>_<chunk number><extension> in the sink's directory.
+
+    Chunks are read back lazily. Iterating over a sink yields the chunks (as dicts of NumPy arrays) one at a time, in
+    the order they were written. Creating a sink for a directory that already contains chunks makes those chunks
+    readable and new chunks are numbered after them.
+
+    When writing your own sink, override the writeChunk() and readChunk() methods and set the extension property."""
+
+    extension = ''
+
+    def __init__(self, directory: str, prefix: str = 'chunk'):
+        self.directory = directory
+        self.prefix = prefix
+
+        os.makedirs(directory, exist_ok=True)
+        self.chunks = sorted(glob.glob(os.path.join(glob.escape(directory), prefix + '_*' + self.extension)))
+
+    def __len__(self):
+        """Returns the number of chunks in the sink"""
+        return len(self.chunks)
+
+    def __iter__(self):
+        for path in self.chunks:
+            yield self.readChunk(path)
+
+    def write(self, columns: dict):
+        """Writes a dict of columns to a new chunk file"""
+        path = os.path.join(self.directory, '%s_%05d%s' % (self.prefix, len(self.chunks), self.extension))
+        self.writeChunk(path, columns)
+        self.chunks.append(path)
+
+    def writeChunk(self, path: str, columns: dict):
+        """Writes a dict of columns to the file at path"""
+        raise Exception("Sinks must override the writeChunk() method.")
+
+    def readChunk(self, path: str) -> dict:
+        """Reads the chunk file at path and returns it as a dict of columns"""
+        raise Exception("Sinks must override the readChunk() method.")
+
+    def close(self):
+        """Releases the resources held by the sink. Chunk files are closed after they are written so the base class
+        does nothing."""
+        pass
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Reads every chunk and returns them as a single pandas DataFrame"""
+        if len(self.chunks) == 0:
+            return pandas.DataFrame()
+        return pandas.concat([pandas.DataFrame(chunk) for chunk in self], ignore_index=True)
+
+
+class CSVSink(Sink):
+    """A Sink that stores each chunk as a CSV file"""
+
+    extension = '.csv'
+
+    def writeChunk(self, path: str, columns: dict):
+        pandas.DataFrame(columns).to_csv(path, index=False)
+
+    def readChunk(self, path: str) -> dict:
+        df = pandas.read_csv(path)
+        return {column: df[column].values for column in df.columns}
+
+
+class NumpySink(Sink):
+    """A Sink that stores each chunk as a NumPy .npz file. Object columns (like agent ids) are stored as strings."""
+
+    extension = '.npz'
+
+    def __init__(self, directory: str, prefix: str = 'chunk', compressed: bool = False):
+        super().__init__(directory, prefix)
+        self.compressed = compressed
+
+    def writeChunk(self, path: str, columns: dict):
+        arrays = {}
+        for column, values in columns.items():
+            values = numpy.asarray(values)
+            arrays[column] = values.astype(str) if values.dtype == object else values
+
+        if self.compressed:
+            numpy.savez_compressed(path, **arrays)
+        else:
+            numpy.savez(path, **arrays)
+
+    def readChunk(self, path: str) -> dict:
+        with numpy.load(path) as data:
+            return {column: data[column] for column in data.files}
+
+
+class ParquetSink(Sink):
+    """A Sink that stores each chunk as a Parquet file. Only available if pyarrow is installed."""
+
+    extension = '.parquet'
+
+    def __init__(self, directory: str, prefix: str = 'chunk'):
+        if not PARQUET_AVAILABLE:
+            raise Exception("The ParquetSink requires pyarrow. Install it or use the CSVSink or NumpySink instead.")
+        super().__init__(directory, prefix)
+
+    def writeChunk(self, path: str, columns: dict):
+        table = pyarrow.Table.from_pandas(pandas.DataFrame(columns), preserve_index=False)
+        pyarrow.parquet.write_table(table, path)
+
+    def readChunk(self, path: str) -> dict:
+        df = pyarrow.parquet.read_table(path).to_pandas()
+        return {column: df[column].values for column in df.columns}
+
+
+def _writerLoop(sink: Sink, chunks: queue.Queue, errors: list):
+    """The loop run by the writer thread of a ThreadedSink. A None chunk stops the loop."""
+    while True:
+        chunk = chunks.get()
+        try:
+            if chunk is None:
+                return
+            if len(errors) == 0:  # Chunks are discarded after an error so that the collector can't block forever
+                sink.write(chunk)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunks.task_done()
+
+
+def _stopWriter(chunks: queue.Queue, thread: threading.Thread):
+    if thread.is_alive():
+        chunks.put(None)
+        thread.join()
+
+
+class ThreadedSink:
+    """ A ThreadedSink moves the writing of chunks off the simulation thread. It wraps another sink and write() only
+    copies the chunk and puts it in a queue of at most maxChunks chunks. A writer thread takes chunks from the queue
+    and writes them to the wrapped sink.
+
+    backpressure decides what happens if the queue is full when write() is called:
+        - 'block' waits for space in the queue. If timeout (in seconds) is not None and there is still no space after
+          timeout seconds, an Exception is raised.
+        - 'drop' discards the chunk and counts it in dropped.
+    The total and longest time write() spent waiting for the queue are measured in waitTime and maxWaitTime.
+
+    close() waits for the queued chunks to be written and stops the writer thread. It is also called when the
+    ThreadedSink is garbage collected or the interpreter exits and can be used as a context manager. If the wrapped
+    sink raises an Exception while writing, the remaining chunks are discarded and the Exception is raised by the next
+    call to write() or close().
+
+    Reading (iterating over the sink or calling to_dataframe()) waits for the queued chunks to be written first."""
+
+    def __init__(self, sink: Sink, maxChunks: int = 4, backpressure: str = 'block', timeout: float = None):
+        if backpressure not in ('block', 'drop'):
+            raise Exception("Unknown backpressure strategy: " + str(backpressure) + ". Use 'block' or 'drop'.")
+
+        self.sink = sink
+        self.backpressure = backpressure
+        self.timeout = timeout
+
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.dropped = 0
+
+        self.chunks = queue.Queue(maxChunks)
+        self.errors = []
+        self.thread = threading.Thread(target=_writerLoop, args=(sink, self.chunks, self.errors), daemon=True)
+        self.thread.start()
+        self.finalizer = weakref.finalize(self, _stopWriter, self.chunks, self.thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __len__(self):
+        """Returns the number of chunks that have been written to the wrapped sink"""
+        return len(self.sink)
+
+    def __iter__(self):
+        self.join()
+        return iter(self.sink)
+
+    def _raiseErrors(self):
+        if len(self.errors) > 0:
+            raise Exception("The writer thread failed to write a chunk: " + repr(self.errors[0]))
+
+    def write(self, columns: dict):
+        """Copies a dict of columns and queues it to be written to the wrapped sink"""
+        self._raiseErrors()
+        if not self.thread.is_alive():
+            raise Exception("Cannot write to a ThreadedSink that has been closed.")
+
+        # The collector reuses its buffers after a chunk is written, so the queued chunk must be a copy
+        chunk = {column: numpy.array(values, copy=True) for column, values in columns.items()}
+
+        try:
+            self.chunks.put_nowait(chunk)
+            return
+        except queue.Full:
+            if self.backpressure == 'drop':
+                self.dropped += 1
+                return
+
+        start = time.perf_counter()
+        try:
+            self.chunks.put(chunk, timeout=self.timeout)
+        except queue.Full:
+            raise Exception("Timed out waiting for the writer thread after " + str(self.timeout) + " seconds.")
+        finally:
+            wait = time.perf_counter() - start
+            self.waitTime += wait
+            self.maxWaitTime = max(self.maxWaitTime, wait)
+
+    def join(self):
+        """Waits for the queued chunks to be written"""
+        self.chunks.join()
+        self._raiseErrors()
+
+    def close(self):
+        """Writes the queued chunks, stops the writer thread and closes the wrapped sink"""
+        self.finalizer()
+        self.sink.close()
+        self._raiseErrors()
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """Waits for the queued chunks to be written and returns every chunk as a single pandas DataFrame"""
+        self.join()
+        return self.sink.to_dataframe()
@@ -0,0 +1,186 @@
+import math
+
+import numpy
+
+
+def gini(values) -> float:
+    """Returns the Gini coefficient of an array of non-negative values. Returns 0 if the values sum to 0."""
+    values = numpy.sort(numpy.asarray(values, dtype=float).reshape(-1))
+    n = len(values)
+    total = values.sum()
+    if n == 0 or total == 0:
+        return 0.0
+
+    ranks = numpy.arange(1, n + 1)
+    return float(2.0 * (ranks * values).sum() / (n * total) - (n + 1.0) / n)
+
+
+class RunningStatistics:
+    """ RunningStatistics keeps the count, mean, variance, minimum and maximum of a stream of values without storing
+    them. Values are added in batches with update() and two RunningStatistics objects can be combined with merge(), so
+    statistics computed by different workers can be merged into statistics over all of their values."""
+
+    __slots__ = ['count', 'mean', 'm2', 'min', 'max']
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # The sum of the squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _combine(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        # Chan et al.'s parallel algorithm for combining the moments of two sets of values
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def update(self, values):
+        """Adds an array of values to the statistics. NaN values are ignored."""
+        values = numpy.asarray(values, dtype=float).reshape(-1)
+        values = values[~numpy.isnan(values)]
+        if len(values) == 0:
+            return
+
+        mean = values.mean()
+        self._combine(len(values), float(mean), float(((values - mean) ** 2).sum()), float(values.min()),
+                      float(values.max()))
+
+    def merge(self, other):
+        """Adds the values summarised by another RunningStatistics object to this one"""
+        if other.count > 0:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def getMean(self) -> float:
+        """Returns the mean of the values or NaN if there are none"""
+        return self.mean if self.count > 0 else math.nan
+
+    def getVariance(self, ddof: int = 0) -> float:
+        """Returns the variance of the values (with ddof delta degrees of freedom) or NaN if there are too few"""
+        return self.m2 / (self.count - ddof) if self.count > ddof else math.nan
+
+    def getStd(self, ddof: int = 0) -> float:
+        """Returns the standard deviation of the values"""
+        return math.sqrt(self.getVariance(ddof))
+
+
+class Histogram:
+    """ A Histogram counts values in a number of equally spaced bins between lower and upper. Values below lower or
+    above upper are counted in underflow and overflow respectively. Histograms with the same bins can be merged."""
+
+    __slots__ = ['lower', 'upper', 'bins', 'counts', 'underflow', 'overflow']
+
+    def __init__(self, lower: float, upper: float, bins: int = 10):
+        if upper <= lower:
+            raise Exception("The upper bound of a Histogram must be greater than its lower bound.")
+
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.bins = bins
+        self.counts = numpy.zeros(bins, dtype=numpy.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def getEdges(self):
+        """Returns the bins + 1 edges of the bins"""
+        return numpy.linspace(self.lower, self.upper, self.bins + 1)
+
+    def update(self, values):
+        """Adds an array of values to the histogram. NaN values are ignored."""
+        values = numpy.asarray(values, dtype=float).reshape(-1)
+        values = values[~numpy.isnan(values)]
+
+        below, above = values < self.lower, values > self.upper
+        self.underflow += int(below.sum())
+        self.overflow += int(above.sum())
+
+        inside = values[~(below | above)]
+        indices = ((inside - self.lower) * (self.bins / (self.upper - self.lower))).astype(numpy.int64)
+        self.counts += numpy.bincount(numpy.minimum(indices, self.bins - 1), minlength=self.bins)
+
+    def merge(self, other):
+        """Adds the counts of another Histogram with the same bins to this one"""
+        if (self.lower, self.upper, self.bins) != (other.lower, other.upper, other.bins):
+            raise Exception("Cannot merge Histograms with different bins.")
+
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class QuantileSketch:
+    """ A QuantileSketch estimates the quantiles of a stream of values without storing them. Values are counted in
+    logarithmically sized buckets so that every estimated quantile is within relativeAccuracy (relative error) of a
+    value that has the requested rank. Memory grows with the logarithm of the range of the values, not with their
+    number. Sketches with the same relativeAccuracy can be merged."""
+
+    __slots__ = ['relativeAccuracy', 'gamma', 'logGamma', 'positive', 'negative', 'zeros', 'count']
+
+    def __init__(self, relativeAccuracy: float = 0.01):
+        if relativeAccuracy <= 0.0 or relativeAccuracy >= 1.0:
+            raise Exception("The relative accuracy of a QuantileSketch must be between 0 and 1.")
+
+        self.relativeAccuracy = relativeAccuracy
+        self.gamma = (1.0 + relativeAccuracy) / (1.0 - relativeAccuracy)
+        self.logGamma = math.log(self.gamma)
+        self.positive = {}  # Maps bucket keys to counts
+        self.negative = {}  # Buckets of the absolute values of negative values
+        self.zeros = 0
+        self.count = 0
+
+    def _addToBuckets(self, buckets: dict, values):
+        keys, counts = numpy.unique(numpy.ceil(numpy.log(values) / self.logGamma).astype(numpy.int64),
+                                    return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def update(self, values):
+        """Adds an array of values to the sketch. NaN values are ignored."""
+        values = numpy.asarray(values, dtype=float).reshape(-1)
+        values = values[~numpy.isnan(values)]
+
+        self._addToBuckets(self.positive, values[values > 0])
+        self._addToBuckets(self.negative, -values[values < 0])
+        self.zeros += int((values == 0).sum())
+        self.count += len(values)
+
+    def merge(self, other):
+        """Adds the counts of another QuantileSketch with the same relativeAccuracy to this one"""
+        if self.relativeAccuracy != other.relativeAccuracy:
+            raise Exception("Cannot merge QuantileSketches with different relative accuracies.")
+
+        for buckets, otherBuckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in otherBuckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _getBucketValue(self, key: int) -> float:
+        return 2.0 * self.gamma ** key / (self.gamma + 1.0)
+
+    def getQuantiles(self, quantiles) -> numpy.ndarray:
+        """Returns the estimated values of an array of quantiles (between 0 and 1). Returns NaNs if the sketch is
+        empty."""
+        quantiles = numpy.asarray(quantiles, dtype=float).reshape(-1)
+        if self.count == 0:
+            return numpy.full(len(quantiles), math.nan)
+
+        # Buckets ordered from the smallest to the largest value they represent
+        keys = sorted(self.negative.keys(), reverse=True)
+        values = [-self._getBucketValue(key) for key in keys] + [0.0]
+        counts = [self.negative[key] for key in keys] + [self.zeros]
+        keys = sorted(self.positive.keys())
+        values += [self._getBucketValue(key) for key in keys]
+        counts += [self.positive[key] for key in keys]
+
+        ranks = numpy.clip(quantiles, 0.0, 1.0) * (self.count - 1)
+        indices = numpy.searchsorted(numpy.cumsum(counts), ranks, side='right')
+        return numpy.asarray(values)[numpy.minimum(indices, len(values) - 1)]
+
+    def getQuantile(self, quantile: float) -> float:
+        """Returns the estimated value of a quantile (between 0 and 1)"""
+        return float(self.getQuantiles([quantile])[0])
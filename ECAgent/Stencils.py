@@ -0,0 +1,191 @@
+from sys import maxsize
+
+import numpy
+
+from ECAgent.Core import System, Model
+
+
+def neighbourhoodKernel(ndim: int, moore: bool = False, radius: int = 1):
+    """Returns a kernel of ones that covers the neighbourhood of a cell in an ndim world. The centre of the kernel is
+    0. If moore is True, the kernel covers the Moore neighbourhood (diagonals included) otherwise it covers the von
+    Neumann neighbourhood."""
+    size = 2 * radius + 1
+    if moore:
+        kernel = numpy.ones((size,) * ndim)
+    else:
+        offsets = numpy.indices((size,) * ndim) - radius
+        kernel = (numpy.abs(offsets).sum(axis=0) <= radius).astype(float)
+
+    kernel[(radius,) * ndim] = 0.0
+    return kernel
+
+
+def convolve(layer, kernel, toroidal: bool = False, fill: float = 0.0, out=None):
+    """Convolves a cell layer with the kernel. The kernel must have the same number of dimensions as the layer and an
+    odd size along each axis. If toroidal is True, the edges of the layer wrap around. Otherwise, cells outside of the
+    layer are treated as having the value fill.
+
+    The convolution is computed as one whole-array pass per non-zero kernel entry. If out is supplied, the result is
+    written into it."""
+    layer = numpy.asarray(layer)
+    kernel = numpy.asarray(kernel, dtype=float)
+
+    if kernel.ndim != layer.ndim or any(size % 2 == 0 for size in kernel.shape):
+        raise Exception("The kernel must have an odd size along each of the layer's " + str(layer.ndim) + " axes.")
+
+    radii = [size // 2 for size in kernel.shape]
+    if toroidal:
+        padded = numpy.pad(layer, list(zip(radii, radii)), mode='wrap')
+    else:
+        padded = numpy.pad(layer, list(zip(radii, radii)), mode='constant', constant_values=fill)
+
+    result = numpy.zeros(layer.shape, dtype=numpy.result_type(layer, kernel))
+    flipped = numpy.flip(kernel)
+    for offset in numpy.ndindex(flipped.shape):
+        weight = flipped[offset]
+        if weight != 0.0:
+            result += weight * padded[tuple(slice(o, o + n) for o, n in zip(offset, layer.shape))]
+
+    if out is None:
+        return result
+
+    out[...] = result
+    return out
+
+
+def diffuse(layer, rate: float, toroidal: bool = False, moore: bool = False, out=None):
+    """Diffuses a cell layer. Every cell keeps (1 - rate) of its value and shares the rest equally with its
+    neighbours (von Neumann or Moore if moore is True). If the world is not toroidal, the shares that would leave the
+    world stay in the cell so the total of the layer is conserved."""
+    if rate < 0.0 or rate > 1.0:
+        raise Exception("The diffusion rate must be between 0 and 1.")
+
+    layer = numpy.asarray(layer)
+    kernel = neighbourhoodKernel(layer.ndim, moore)
+    share = layer * (rate / kernel.sum())
+
+    result = layer * (1.0 - rate) + convolve(share, kernel, toroidal)
+
+    if not toroidal:
+        missing = kernel.sum() - convolve(numpy.ones(layer.shape), kernel)
+        result += share * missing
+
+    if out is None:
+        return result
+
+    out[...] = result
+    return out
+
+
+def decay(layer, rate: float, out=None):
+    """Multiplies every cell of the layer by (1 - rate)"""
+    if rate < 0.0 or rate > 1.0:
+        raise Exception("The decay rate must be between 0 and 1.")
+
+    return numpy.multiply(layer, 1.0 - rate, out=out)
+
+
+def regrow(layer, rate: float, capacity, mode: str = 'linear', out=None):
+    """Regrows every cell of the layer toward its capacity. capacity can be a scalar or an array with the same shape as
+    the layer. The mode determines the rate of growth:
+        'linear': value + rate, capped at capacity.
+        'proportional': value + rate * (capacity - value).
+        'logistic': value + rate * value * (1 - value / capacity), capped at capacity."""
+    layer = numpy.asarray(layer)
+
+    if mode == 'linear':
+        result = numpy.minimum(layer + rate, capacity)
+    elif mode == 'proportional':
+        result = layer + rate * (capacity - layer)
+    elif mode == 'logistic':
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            growth = numpy.nan_to_num(rate * layer * (1.0 - layer / capacity))
+        result = numpy.minimum(layer + growth, capacity)
+    else:
+        raise Exception("Unknown regrowth mode: " + str(mode))
+
+    if out is None:
+        return result
+
+    out[...] = result
+    return out
+
+
+class CellLayerSystem(System):
+    """ This is the base class for Systems that update a cell layer of the model's environment every time they are
+    executed. The environment must be a discrete world with a cells property (LineWorld, GridWorld or CubeWorld).
+    When writing your own CellLayerSystem, override the apply() method. It is supplied with the current values of the
+    layer and returns the new values, which are written back into the layer in place. Layers updated by these systems
+    should have a float dtype."""
+
+    def __init__(self, id: str, model: Model, layer: str, priority=0, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, priority, frequency, start, end)
+        self.layer = layer
+
+    def execute(self):
+        cells = self.model.environment.cells
+        cells.markModified(self.layer)
+        values = cells[self.layer]
+        values[...] = self.apply(values)
+
+    def apply(self, values):
+        return values
+
+
+class DiffusionSystem(CellLayerSystem):
+    """Diffuses a cell layer every time it is executed. See diffuse(). If the environment has kernels (see
+    ECAgent.Kernels), its diffuse kernel is used instead."""
+
+    def __init__(self, id: str, model: Model, layer: str, rate: float, toroidal: bool = False, moore: bool = False,
+                 priority=0, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, layer, priority, frequency, start, end)
+        self.rate = rate
+        self.toroidal = toroidal
+        self.moore = moore
+
+    def apply(self, values):
+        kernels = getattr(self.model.environment, 'kernels', None)
+        if kernels is not None:
+            return kernels.diffuse(values, self.rate, self.toroidal, self.moore)
+        return diffuse(values, self.rate, self.toroidal, self.moore)
+
+
+class DecaySystem(CellLayerSystem):
+    """Decays a cell layer every time it is executed. See decay()."""
+
+    def __init__(self, id: str, model: Model, layer: str, rate: float, priority=0, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, layer, priority, frequency, start, end)
+        self.rate = rate
+
+    def apply(self, values):
+        return decay(values, self.rate)
+
+
+class RegrowthSystem(CellLayerSystem):
+    """Regrows a cell layer toward its capacity every time it is executed. The capacity can be a scalar, an array or
+    the name of another cell layer. See regrow()."""
+
+    def __init__(self, id: str, model: Model, layer: str, rate: float, capacity, mode: str = 'linear',
+                 priority=0, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, layer, priority, frequency, start, end)
+        self.rate = rate
+        self.capacity = capacity
+        self.mode = mode
+
+    def apply(self, values):
+        capacity = self.model.environment.cells[self.capacity] if isinstance(self.capacity, str) else self.capacity
+        return regrow(values, self.rate, capacity, self.mode)
+
+
+class ConvolutionSystem(CellLayerSystem):
+    """Convolves a cell layer with a kernel every time it is executed. See convolve()."""
+
+    def __init__(self, id: str, model: Model, layer: str, kernel, toroidal: bool = False, fill: float = 0.0,
+                 priority=0, frequency=1, start=0, end=maxsize):
+        super().__init__(id, model, layer, priority, frequency, start, end)
+        self.kernel = numpy.asarray(kernel, dtype=float)
+        self.toroidal = toroidal
+        self.fill = fill
+
+    def apply(self, values):
+        return convolve(values, self.kernel, self.toroidal, self.fill)
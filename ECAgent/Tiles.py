@@ -0,0 +1,334 @@
+import multiprocessing
+
+import numpy
+
+from ECAgent.Environments import GridWorld, PositionComponent
+
+
+class TileAgent:
+    """ A lightweight copy of an agent that lives in a Tile. It contains the agent's id, its (x, y) position in world
+    coordinates and a dict of data that the tile function can use to store per-agent state. TileAgents are sent between
+    processes so data should only contain picklable values."""
+
+    __slots__ = ['id', 'x', 'y', 'data']
+
+    def __init__(self, id: str, x: int, y: int, data: dict = None):
+        self.id = id
+        self.x = x
+        self.y = y
+        self.data = {} if data is None else data
+
+
+class Tile:
+    """ A Tile is the rectangular part of a TiledGridWorld owned by one worker. The tile owns the cells in
+    [lower[0], upper[0]) x [lower[1], upper[1]) (its interior). Each of its layers is padded by halo cells on every
+    side. The padding (the ghost cells) contains copies of the neighbouring tiles' cells from the start of the tick and
+    should be treated as read-only. Layers are indexed as layer[y, x] in local coordinates, see toLocal().
+
+    agents is a dict of the TileAgents in the tile. A tile function can move an agent anywhere in the world by changing
+    its x and y properties. Agents that leave the interior are migrated to the tile that owns their new position at
+    the end of the tick."""
+
+    __slots__ = ['index', 'lower', 'upper', 'halo', 'layers', 'agents']
+
+    def __init__(self, index: int, lower: tuple, upper: tuple, halo: int):
+        self.index = index
+        self.lower = lower
+        self.upper = upper
+        self.halo = halo
+        self.layers = {}
+        self.agents = {}
+
+    def getShape(self):
+        """Returns the (height, width) of the tile's interior"""
+        return self.upper[1] - self.lower[1], self.upper[0] - self.lower[0]
+
+    def interior(self, name: str):
+        """Returns a view of the interior cells of layer 'name'"""
+        height, width = self.getShape()
+        return self.layers[name][self.halo:self.halo + height, self.halo:self.halo + width]
+
+    def contains(self, x: int, y: int) -> bool:
+        """Returns True if world position (x, y) is in the tile's interior"""
+        return self.lower[0] <= x < self.upper[0] and self.lower[1] <= y < self.upper[1]
+
+    def toLocal(self, x: int, y: int):
+        """Converts world position (x, y) into the (row, column) index of the position in the tile's layers"""
+        return y - self.lower[1] + self.halo, x - self.lower[0] + self.halo
+
+    def getValue(self, name: str, x: int, y: int):
+        """Returns the value of layer 'name' at world position (x, y). The position can be in the interior or halo."""
+        return self.layers[name][self.toLocal(x, y)]
+
+    def setValue(self, name: str, x: int, y: int, value):
+        """Sets the value of layer 'name' at world position (x, y), which must be in the tile's interior"""
+        if not self.contains(x, y):
+            raise Exception("Tiles can only write to the cells in their interior.")
+        self.layers[name][self.toLocal(x, y)] = value
+
+
+class _TileWorker:
+    """Runs the commands sent to a tile by a TiledGridWorld. It is used directly when the tiles run in the main process
+    and through _workerLoop() when they run in worker processes."""
+
+    def __init__(self, tile: Tile, function, seed: int):
+        self.tile = tile
+        self.function = function
+        self.seed = seed
+
+    def handle(self, command: tuple):
+        action = command[0]
+        tile = self.tile
+
+        if action == 'step':
+            tick = command[1]
+            self.function(tile, numpy.random.default_rng([self.seed, tick, tile.index]))
+
+            emigrants = [agent for agent in tile.agents.values() if not tile.contains(agent.x, agent.y)]
+            for agent in emigrants:
+                del tile.agents[agent.id]
+
+            borders = {name: self._getBorder(name) for name in tile.layers} if tile.halo > 0 else {}
+            return borders, emigrants
+        elif action == 'exchange':
+            halos, immigrants = command[1], command[2]
+            for name, strips in halos.items():
+                self._setHalo(name, strips)
+            for agent in immigrants:
+                tile.agents[agent.id] = agent
+        elif action == 'gather':
+            return {name: tile.interior(name).copy() for name in tile.layers}, list(tile.agents.values())
+        else:
+            raise Exception("Unknown tile command: " + str(action))
+
+    def _getBorder(self, name: str):
+        """Returns the top, bottom, left and right strips of the interior that are in other tiles' halos"""
+        interior = self.tile.interior(name)
+        h = self.tile.halo
+        return interior[:h].copy(), interior[-h:].copy(), interior[:, :h].copy(), interior[:, -h:].copy()
+
+    def _setHalo(self, name: str, strips: tuple):
+        layer = self.tile.layers[name]
+        h = self.tile.halo
+        top, bottom, left, right = strips
+        layer[:h], layer[-h:], layer[h:-h, :h], layer[h:-h, -h:] = top, bottom, left, right
+
+
+def _workerLoop(connection, worker: _TileWorker):
+    """The main loop of a tile's worker process"""
+    while True:
+        command = connection.recv()
+        if command[0] == 'stop':
+            break
+        try:
+            connection.send(worker.handle(command))
+        except Exception as e:  # Errors are raised in the main process instead
+            connection.send(e)
+    connection.close()
+
+
+class TiledGridWorld:
+    """ TiledGridWorld executes a GridWorld in parallel by partitioning it into tilesX x tilesY tiles, each owned by a
+    worker process. The numeric cell layers of the world and the positions of its agents are copied into the tiles
+    when start() is called.
+
+    Every tick (step()), each worker calls function(tile, rng) on its tile. The function can update the interior of
+    the tile's layers and move its agents (see Tile). The workers then send the borders of their interiors and the
+    agents that left them back to the TiledGridWorld, which sends each tile its new halo (ghost) cells and the agents
+    that moved into it. Only the borders of the tiles are exchanged, never the whole layers.
+
+    Runs are deterministic for a fixed seed and tile layout: rng is seeded from (seed, tick, tile index) and migrating
+    agents are delivered in order of their ids. The seed is drawn from the world's model if none is supplied. Set
+    processes to False to run the tiles one after another in the main process instead (useful for debugging).
+
+    function must be picklable (a module level function) on platforms that do not fork processes. Call gather() to
+    copy the layers and agent positions back into the GridWorld and stop() to shut down the workers. A
+    TiledGridWorld can also be used as a context manager."""
+
+    def __init__(self, world: GridWorld, tiles: tuple = (2, 2), halo: int = 1, toroidal: bool = False,
+                 layers: list = None, seed: int = None, processes: bool = True):
+
+        tilesX, tilesY = tiles
+        if tilesX < 1 or tilesY < 1 or tilesX > world.width or tilesY > world.height:
+            raise Exception("Cannot split a " + str(world.width) + "x" + str(world.height) + " GridWorld "
+                            "into " + str(tilesX) + "x" + str(tilesY) + " tiles.")
+
+        self.world = world
+        self.halo = halo
+        self.toroidal = toroidal
+        self.layers = list(world.cells.keys()) if layers is None else list(layers)
+        self.seed = world.model.random.getrandbits(64) if seed is None else seed
+        self.processes = processes
+
+        self.xBounds = [i * world.width // tilesX for i in range(tilesX + 1)]
+        self.yBounds = [i * world.height // tilesY for i in range(tilesY + 1)]
+        if halo > min(numpy.diff(self.xBounds).min(), numpy.diff(self.yBounds).min()):
+            raise Exception("The halo cannot be wider than a tile.")
+
+        self.tiles = [Tile(ty * tilesX + tx, (self.xBounds[tx], self.yBounds[ty]),
+                           (self.xBounds[tx + 1], self.yBounds[ty + 1]), halo)
+                      for ty in range(tilesY) for tx in range(tilesX)]
+
+        self.tick = 0
+        self.workers = []
+        self.borders = {}  # The layers as last seen by the TiledGridWorld. Only tile borders are kept up to date.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def getTileIndex(self, x, y):
+        """Returns the index of the tile that owns world position (x, y). x and y can also be arrays."""
+        tx = numpy.searchsorted(self.xBounds, x, side='right') - 1
+        ty = numpy.searchsorted(self.yBounds, y, side='right') - 1
+        return ty * (len(self.xBounds) - 1) + tx
+
+    def start(self, function):
+        """Copies the world into the tiles and starts a worker for each tile that runs function(tile, rng) every
+        tick"""
+        if len(self.workers) > 0:
+            raise Exception("The TiledGridWorld has already been started.")
+
+        self.borders = {}
+        for name in self.layers:
+            layer = numpy.asarray(self.world.cells[name])
+            if layer.dtype == object:
+                raise Exception("Cannot tile the non-numeric cell layer " + str(name))
+            self.borders[name] = layer.copy()
+
+        agents = {tile.index: [] for tile in self.tiles}
+        for agent in sorted(self.world.getAgents(), key=lambda a: a.id):
+            x, y, _ = agent[PositionComponent].getPosition()
+            agents[int(self.getTileIndex(x, y))].append(TileAgent(agent.id, int(x), int(y)))
+
+        for tile in self.tiles:
+            for name in self.layers:
+                tile.layers[name] = self._getRegion(name, tile)
+            tile.agents = {agent.id: agent for agent in agents[tile.index]}
+
+            worker = _TileWorker(tile, function, self.seed)
+            if self.processes:
+                connection, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_workerLoop, args=(child, worker), daemon=True)
+                process.start()
+                child.close()
+                self.workers.append((connection, process))
+
+                # The worker process owns the tile now
+                tile.layers, tile.agents = {}, {}
+            else:
+                self.workers.append(worker)
+
+    def _send(self, commands: list):
+        """Sends commands[i] to the worker of tile i and returns their replies"""
+        if not self.processes:
+            return [worker.handle(command) for worker, command in zip(self.workers, commands)]
+
+        for (connection, _), command in zip(self.workers, commands):
+            connection.send(command)
+
+        replies = [connection.recv() for connection, _ in self.workers]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    def _getRegion(self, name: str, tile: Tile, lower: tuple = None, upper: tuple = None):
+        """Returns the part of a layer from lower to upper, padded by the halo on every side. Cells outside of the world
+        are wrapped if the world is toroidal and 0 otherwise."""
+        lower = tile.lower if lower is None else lower
+        upper = tile.upper if upper is None else upper
+        layer = self.borders[name]
+        height, width = layer.shape
+
+        rows = numpy.arange(lower[1] - self.halo, upper[1] + self.halo)
+        cols = numpy.arange(lower[0] - self.halo, upper[0] + self.halo)
+        if self.toroidal:
+            return layer[numpy.ix_(rows % height, cols % width)]
+
+        region = numpy.zeros((len(rows), len(cols)), dtype=layer.dtype)
+        validRows, validCols = (rows >= 0) & (rows < height), (cols >= 0) & (cols < width)
+        region[numpy.ix_(validRows, validCols)] = layer[numpy.ix_(rows[validRows], cols[validCols])]
+        return region
+
+    def _getHalo(self, name: str, tile: Tile):
+        """Returns the top, bottom, left and right halo strips of a tile"""
+        h = self.halo
+        region = self._getRegion(name, tile)
+        return region[:h], region[-h:], region[h:-h, :h], region[h:-h, -h:]
+
+    def _setBorder(self, name: str, tile: Tile, strips: tuple):
+        (x0, y0), (x1, y1), h = tile.lower, tile.upper, self.halo
+        layer = self.borders[name]
+        top, bottom, left, right = strips
+        layer[y0:y0 + h, x0:x1], layer[y1 - h:y1, x0:x1] = top, bottom
+        layer[y0:y1, x0:x0 + h], layer[y0:y1, x1 - h:x1] = left, right
+
+    def _route(self, agents: list):
+        """Wraps or validates the positions of migrating agents and groups them by the tile that owns them"""
+        routed = {tile.index: [] for tile in self.tiles}
+        for agent in sorted(agents, key=lambda a: a.id):
+            if self.toroidal:
+                agent.x, agent.y = agent.x % self.world.width, agent.y % self.world.height
+            elif not (0 <= agent.x < self.world.width and 0 <= agent.y < self.world.height):
+                raise Exception("Agent " + str(agent.id) + " moved to a position not on the map.")
+            routed[int(self.getTileIndex(agent.x, agent.y))].append(agent)
+        return routed
+
+    def step(self):
+        """Executes one tick on every tile and exchanges the halos and migrating agents"""
+        if len(self.workers) == 0:
+            raise Exception("The TiledGridWorld has not been started. Call start() first.")
+
+        replies = self._send([('step', self.tick)] * len(self.tiles))
+
+        emigrants = []
+        for tile, (borders, agents) in zip(self.tiles, replies):
+            if self.halo > 0:
+                for name, strips in borders.items():
+                    self._setBorder(name, tile, strips)
+            emigrants.extend(agents)
+
+        immigrants = self._route(emigrants)
+        halos = [{name: self._getHalo(name, tile) for name in self.layers} if self.halo > 0 else {}
+                 for tile in self.tiles]
+        self._send([('exchange', halos[tile.index], immigrants[tile.index]) for tile in self.tiles])
+
+        self.tick += 1
+
+    def run(self, steps: int):
+        """Executes steps ticks"""
+        for _ in range(steps):
+            self.step()
+
+    def gather(self) -> dict:
+        """Copies the interiors of every tile back into the world's cell layers and moves the world's agents to their
+        positions in the tiles. Returns a dict of all of the TileAgents."""
+        for name in self.layers:
+            self.world.cells.markModified(name)
+
+        agents = {}
+        for tile, (interiors, tileAgents) in zip(self.tiles, self._send([('gather',)] * len(self.tiles))):
+            (x0, y0), (x1, y1) = tile.lower, tile.upper
+            for name, interior in interiors.items():
+                self.borders[name][y0:y1, x0:x1] = interior
+                self.world.cells[name][y0:y1, x0:x1] = interior
+            for agent in tileAgents:
+                agents[agent.id] = agent
+
+        for agentID, agent in agents.items():
+            if agentID in self.world.agents:
+                self.world.moveAgent(agentID, agent.x, agent.y)
+
+        return agents
+
+    def stop(self):
+        """Shuts down the workers. The TiledGridWorld can be started again afterwards."""
+        if self.processes:
+            for connection, process in self.workers:
+                connection.send(('stop',))
+                process.join()
+                connection.close()
+        self.workers = []
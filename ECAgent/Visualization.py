@@ -1,6 +1,7 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import numpy
 import plotly.graph_objs as go
 
 from ECAgent.Core import Model
@@ -211,6 +212,34 @@ def createHeatMap(title: str, data: [[float]], heatmap_kwargs: dict = {}, layout
     ), layout=go.Layout(title=title, **layout_kwargs))
 
 
+def createAnimatedHeatMap(title: str, frames, timesteps: [int] = None, frameDuration: int = 100,
+                          heatmap_kwargs: dict = {}, layout_kwargs: dict = {}):
+    """Creates a HeatMap Figure that animates through a sequence of heatmaps using Plotly graph objects. frames must
+    be a (T, height, width) array, like the snapshots collected by a CellLayerCollector (see getSnapshots()). Each frame
+    is labelled with its timestep (or its index if timesteps is None) on the Figure's slider and frameDuration is the
+    number of milliseconds each frame is shown for when the animation is played.
+
+    The color scale is fixed to the minimum and maximum of all of the frames so that the colors of different frames
+    can be compared. Supply zmin and zmax in heatmap_kwargs to change it."""
+
+    frames = numpy.asarray(frames)
+    labels = [str(t) for t in (range(len(frames)) if timesteps is None else timesteps)]
+
+    kwargs = {'zmin': float(frames.min()), 'zmax': float(frames.max())} if frames.size > 0 else {}
+    kwargs.update(heatmap_kwargs)
+
+    play = dict(label='Play', method='animate',
+                args=[None, dict(frame=dict(duration=frameDuration, redraw=True), fromcurrent=True)])
+    steps = [dict(label=label, method='animate', args=[[label], dict(mode='immediate', frame=dict(redraw=True))])
+             for label in labels]
+
+    return go.Figure(
+        data=go.Heatmap(z=frames[0] if len(frames) > 0 else [], **kwargs),
+        frames=[go.Frame(data=go.Heatmap(z=frame, **kwargs), name=label) for frame, label in zip(frames, labels)],
+        layout=go.Layout(title=title, updatemenus=[dict(type='buttons', buttons=[play])], sliders=[dict(steps=steps)],
+                         **layout_kwargs))
+
+
 def createContourMap(title: str, data: [[float]], contour_kwargs: dict = {}, layout_kwargs: dict = {}):
 
     """Creates a Contour Figure object using Plotly graph objects. The data object determines the dimensions of the
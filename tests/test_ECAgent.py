@@ -1,5 +1,6 @@
 import pytest
 
+from ECAgent.Cells import shared_memory
 from ECAgent.Core import *
 # Unit testing for src framework
 
@@ -161,6 +162,20 @@ class TestModel:
         assert model.environment is not None
         assert model.systemManager is not None
         assert model.random.randint(25, 50) == 42
+        assert model.sharedLayers is None
+
+    @pytest.mark.skipif(shared_memory is None, reason="shared memory requires Python 3.8 or later")
+    def test_close(self):
+        model = Model()
+        model.close()  # Nothing to release
+
+        registry = model.getSharedLayers()
+        assert model.getSharedLayers() is registry
+        registry.create('value', [1, 2, 3])
+
+        model.close()
+        assert model.sharedLayers is None
+        assert len(registry) == 0
 
 
 class TestComponent:
@@ -0,0 +1,551 @@
+import multiprocessing
+
+import numpy
+import pytest
+
+from ECAgent.Cells import *
+from ECAgent.Core import Model
+from ECAgent.Environments import GridWorld
+
+
+def incrementSharedLayer(descriptor):
+    layer, block = attachSharedLayer(descriptor)
+    layer += 1
+    del layer
+    block.close()
+
+
+def test_toLayerArray():
+    # Test scalar broadcast
+    layer = toLayerArray(1.5, (2, 3))
+    assert layer.shape == (2, 3)
+    assert (layer == 1.5).all()
+
+    # Test flat list
+    layer = toLayerArray([0, 1, 2, 3, 4, 5], (2, 3))
+    assert layer.shape == (2, 3)
+    assert layer[1, 0] == 3
+
+    # Test list of non-scalar values are stored in an object array
+    layer = toLayerArray([(0, 0), (1, 0), (0, 1), (1, 1)], (2, 2))
+    assert layer.dtype == object
+    assert layer[1, 0] == (0, 1)
+
+    # Test size mismatch
+    with pytest.raises(Exception):
+        toLayerArray([1, 2, 3], (2, 2))
+
+    with pytest.raises(Exception):
+        toLayerArray(numpy.zeros(5), (2, 2))
+
+
+def test_stringLayers():
+    # Strings are stored as objects so that longer strings aren't truncated when they are written later
+    assert toLayerArray('none', (2, 2)).dtype == object
+    assert toLayerArray(['a', 'b'], (2,)).dtype == object
+    assert toLayerArray(numpy.array(['a', 'b']), (2,)).dtype == object
+
+    model = Model()
+    model.environment = GridWorld(2, 2, model)
+    model.environment.addCellComponent('owner', lambda pos, cells: 'none')
+    model.environment.cells.setValue('owner', 0, 'agent_1234')
+    assert model.environment.getCell(0, 0)['owner'] == 'agent_1234'
+
+    cells = ChunkedCellLayers((4, 4), chunkSize=2)
+    cells['owner'] = 'none'
+    cells['owner'][1, 1] = 'agent_1234'
+    assert cells['owner'][1, 1] == 'agent_1234'
+
+    cells['names'] = numpy.full((4, 4), 'a')
+    cells['names'][0, 0] = 'agent_1234'
+    assert cells['names'][0, 0] == 'agent_1234'
+
+
+class TestCellPositions:
+
+    def test__getitem__(self):
+        positions = CellPositions((3, 2))
+
+        assert len(positions) == 6
+        assert positions[0] == (0, 0)
+        assert positions[4] == (1, 1)
+        assert list(positions) == [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]
+
+        assert CellPositions((4,))[3] == 3
+        assert CellPositions((2, 2, 2))[7] == (1, 1, 1)
+
+        with pytest.raises(IndexError):
+            positions[6]
+
+
+class TestCellLayers:
+
+    def test__init__(self):
+        cells = CellLayers((4, 3))
+
+        assert cells.dimensions == (4, 3)
+        assert cells.shape == (3, 4)
+        assert len(cells) == 12
+        assert cells.keys() == []
+        assert 'pos' in cells
+
+    def test__setitem__(self):
+        cells = CellLayers((4, 3))
+
+        cells['fertility'] = numpy.arange(12)
+        assert 'fertility' in cells
+        assert cells['fertility'].shape == (3, 4)
+        assert cells['fertility'][2, 1] == 9
+
+        with pytest.raises(Exception):
+            cells['pos'] = 0
+
+        del cells['fertility']
+        assert 'fertility' not in cells
+
+        with pytest.raises(KeyError):
+            cells['fertility']
+
+    def test_addLayer(self):
+        cells = CellLayers((4, 3))
+
+        # Test per-cell generator
+        cells.addLayer('cell', lambda pos, c: pos[0] + pos[1])
+        assert cells['cell'][2, 3] == 5
+
+        # Test coordinate generator
+        cells.addLayer('coords', lambda x, y: x + y, mode='coords')
+        assert cells['coords'].shape == (3, 4)
+        assert (cells['coords'] == cells['cell']).all()
+
+        # Test broadcast of coordinate generator
+        cells.addLayer('row', lambda x, y: x, mode='coords')
+        assert cells['row'].shape == (3, 4)
+        assert cells['row'][2, 3] == 3
+
+        # Test shape generator
+        cells.addLayer('random', lambda shape, rng: rng.random(shape), mode='shape', rng=numpy.random.default_rng(1))
+        assert cells['random'].shape == (3, 4)
+
+        # Test unknown mode
+        with pytest.raises(Exception):
+            cells.addLayer('error', lambda x: x, mode='unknown')
+
+    def test_addLayer_lazy(self):
+        cells = CellLayers((4, 3))
+        calls = []
+
+        def generator(shape, rng):
+            calls.append(shape)
+            return numpy.ones(shape)
+
+        cells.addLayer('lazy', generator, mode='shape', lazy=True)
+
+        assert 'lazy' in cells
+        assert cells.isLazy('lazy')
+        assert cells.keys() == ['lazy']
+        assert len(calls) == 0
+
+        # Test first access materialises the layer exactly once
+        assert cells.getValue('lazy', 0) == 1.0
+        assert not cells.isLazy('lazy')
+        cells['lazy']
+        assert calls == [(3, 4)]
+
+        # Test assignment replaces a lazy layer
+        cells.addLayer('lazy2', generator, mode='shape', lazy=True)
+        cells['lazy2'] = 0
+        assert not cells.isLazy('lazy2')
+        assert len(calls) == 1
+
+    def test_mapLayer(self, tmp_path):
+        cells = CellLayers((4, 3))
+        cells['elevation'] = numpy.arange(12, dtype=float)
+
+        # Test .npy files
+        path = str(tmp_path / 'elevation.npy')
+        cells.saveLayer('elevation', path)
+
+        mapped = CellLayers((4, 3))
+        mapped.mapLayer('elevation', path)
+        assert mapped.isMapped('elevation')
+        assert mapped['elevation'].shape == (3, 4)
+        assert mapped.getValue('elevation', 7) == 7.0
+
+        # Test read-only mode
+        with pytest.raises(ValueError):
+            mapped.setValue('elevation', 7, 1.0)
+
+        # Test copy-on-write mode does not change the file
+        mapped.mapLayer('elevation', path, mode='c')
+        mapped.setValue('elevation', 7, -1.0)
+        assert mapped.getValue('elevation', 7) == -1.0
+        mapped.flush()
+        assert numpy.load(path)[1, 3] == 7.0
+
+        # Test read-write mode
+        mapped.mapLayer('elevation', path, mode='r+')
+        mapped.setValue('elevation', 7, -1.0)
+        mapped.flush()
+        assert numpy.load(path)[1, 3] == -1.0
+
+        # Test raw files
+        path = str(tmp_path / 'rainfall.raw')
+        numpy.arange(12, dtype=numpy.int16).tofile(path)
+        mapped.mapLayer('rainfall', path, dtype=numpy.int16)
+        assert mapped.getCell(5)['rainfall'] == 5
+        assert not mapped.isMapped('missing')
+
+        with pytest.raises(Exception):
+            mapped.mapLayer('rainfall', path)
+
+        with pytest.raises(Exception):
+            mapped.mapLayer('rainfall', path, dtype=numpy.int32)
+
+        with pytest.raises(Exception):
+            mapped.mapLayer('rainfall', path, mode='w+', dtype=numpy.int16)
+
+    def test_getValue(self):
+        cells = CellLayers((4, 3))
+        cells['fertility'] = 0.0
+
+        cells.setValue('fertility', 5, 2.0)
+        assert cells.getValue('fertility', 5) == 2.0
+        assert cells['fertility'][1, 1] == 2.0
+
+    def test_getCell(self):
+        cells = CellLayers((4, 3, 2))
+        cells['height'] = numpy.arange(24)
+
+        assert cells.getPosition(23) == (3, 2, 1)
+        assert cells.getCell(13) == {'pos': (1, 0, 1), 'height': 13}
+
+    def test_coordinates(self):
+        cells = CellLayers((4, 3))
+        x, y = cells.coordinates()
+
+        assert x.shape == (3, 4) and y.shape == (3, 4)
+        assert x[2, 1] == 1 and y[2, 1] == 2
+
+        x, y = cells.coordinates(sparse=True)
+        assert x.shape == (1, 4) and y.shape == (3, 1)
+
+    def test_to_dataframe(self):
+        cells = CellLayers((2, 2))
+        cells['value'] = [1, 2, 3, 4]
+
+        df = cells.to_dataframe()
+        assert len(df) == 4
+        assert list(df['pos']) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+        assert list(df['value']) == [1, 2, 3, 4]
+
+
+class TestSummedAreaTables:
+
+    def test_getTable(self):
+        cells = CellLayers((3, 2))
+        cells['value'] = numpy.arange(6)
+        regions = SummedAreaTables(cells)
+
+        table = regions.getTable('value')
+        assert table.tolist() == [[0, 0, 0, 0], [0, 0, 1, 3], [0, 3, 8, 15]]
+        assert regions.getTable('value') is table
+
+        # Test tables are rebuilt after their layer is modified
+        cells.setValue('value', 0, 10)
+        assert regions.getTable('value') is not table
+        assert regions.getTable('value')[2, 3] == 25
+
+        # Test layers can't be written to directly without marking them as modified first
+        table = regions.getTable('value')
+        with pytest.raises(ValueError):
+            cells['value'][1, 2] -= 1
+        assert regions.getTable('value') is table
+        cells.markModified('value')
+        cells['value'][...] = 1
+        assert regions.getTable('value')[2, 3] == 6
+
+        # Test layers that are already read-only stay read-only
+        cells['readOnly'] = numpy.arange(6)
+        cells['readOnly'].flags.writeable = False
+        regions.getTable('readOnly')
+        cells.markModified('readOnly')
+        assert not cells['readOnly'].flags.writeable
+
+        cells['value'] = 2.0
+        assert regions.getTable('value').dtype == numpy.float64
+
+        cells['objects'] = [None] * 6
+        with pytest.raises(Exception):
+            regions.getTable('objects')
+
+    def test_getSums(self):
+        cells = CellLayers((5, 4))
+        cells['value'] = numpy.arange(20)
+        regions = SummedAreaTables(cells)
+        layer = cells['value']
+
+        lower = [[0, 0], [1, 1], [3, 2], [4, 3]]
+        upper = [[5, 4], [3, 3], [9, 9], [4, 4]]
+        assert list(regions.getSums('value', lower, upper)) == [layer.sum(), layer[1:3, 1:3].sum(),
+                                                                 layer[2:, 3:].sum(), 0]
+        assert list(regions.getCounts(lower, upper)) == [20, 4, 4, 0]
+
+        means = regions.getMeans('value', lower, upper)
+        assert list(means[:3]) == [layer.mean(), layer[1:3, 1:3].mean(), layer[2:, 3:].mean()]
+        assert numpy.isnan(means[3])
+
+    def test_inRadius(self):
+        cells = CellLayers((6, 5, 4))
+        rng = numpy.random.default_rng(0)
+        cells['value'] = rng.random((4, 5, 6))
+        regions = SummedAreaTables(cells)
+        layer = cells['value']
+
+        positions = numpy.array([[0, 0, 0], [2, 3, 1], [5, 4, 3]])
+        sums = regions.getSumsInRadius('value', positions, 1)
+        for (x, y, z), total in zip(positions, sums):
+            expected = layer[max(z - 1, 0):z + 2, max(y - 1, 0):y + 2, max(x - 1, 0):x + 2].sum()
+            assert total == pytest.approx(expected)
+
+        assert list(regions.getCountsInRadius(positions, 1)) == [8, 27, 8]
+        assert regions.getMeansInRadius('value', positions, 1)[1] == pytest.approx(sums[1] / 27)
+
+        # Test 1D layers
+        cells = CellLayers((5,))
+        cells['value'] = [1, 2, 3, 4, 5]
+        assert list(SummedAreaTables(cells).getSumsInRadius('value', [0, 2, 4], 1)) == [3, 9, 9]
+
+
+@pytest.mark.skipif(shared_memory is None, reason="shared memory requires Python 3.8 or later")
+class TestSharedLayers:
+
+    def test_create(self):
+        registry = SharedLayers()
+        array = registry.create('value', numpy.arange(6).reshape(2, 3))
+
+        assert 'value' in registry and len(registry) == 1
+        assert array.tolist() == [[0, 1, 2], [3, 4, 5]]
+        assert registry.getDescriptor('value')[1:] == ((2, 3), numpy.dtype(int).str)
+
+        with pytest.raises(Exception):
+            registry.create('value', numpy.zeros(2))
+
+        with pytest.raises(Exception):
+            registry.create('objects', numpy.array([None, 1], dtype=object))
+
+        # Test attaching in the same process
+        descriptor = registry.getDescriptor('value')
+        attached, block = attachSharedLayer(descriptor)
+        attached[0, 0] = 10
+        assert array[0, 0] == 10
+        view = attached[1]
+        del attached
+        assert block.buf is not None  # Views keep the block open
+        del view
+        assert block.buf is None
+
+        registry.release('value')
+        assert len(registry) == 0
+        assert array[0, 0] == 10  # Arrays stay valid until they are garbage collected
+
+        # Released blocks are unlinked straight away
+        with pytest.raises(FileNotFoundError):
+            attachSharedLayer(descriptor)
+
+    def test_shareLayer(self):
+        cells = CellLayers((3, 2))
+        cells['value'] = numpy.arange(6)
+        registry = SharedLayers()
+
+        descriptor = cells.shareLayer('value', registry)
+        assert cells.isShared('value')
+        assert cells.getSharedDescriptors() == {'value': descriptor}
+        assert cells['value'].tolist() == [[0, 1, 2], [3, 4, 5]]
+
+        # Test writes from another process are visible without copying
+        process = multiprocessing.Process(target=incrementSharedLayer, args=(descriptor,))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        assert cells['value'].tolist() == [[1, 2, 3], [4, 5, 6]]
+
+        # Replacing a shared layer makes it private again
+        cells['value'] = 0
+        assert not cells.isShared('value')
+        assert cells.getSharedDescriptors() == {}
+
+        registry.close()
+        assert len(registry) == 0
+
+    def test_modelLifecycle(self):
+        model = Model()
+        model.environment = GridWorld(3, 2, model)
+        model.environment.cells['value'] = 1.0
+
+        descriptor = model.environment.shareCellComponent('value')
+        assert model.getSharedLayers() is model.sharedLayers
+        assert 'ENVIRONMENT.value' in model.sharedLayers
+        assert model.environment.cells.isShared('value')
+
+        model.close()
+        assert model.sharedLayers is None
+
+        # The block has been unlinked
+        with pytest.raises(FileNotFoundError):
+            attachSharedLayer(descriptor)
+
+
+class TestChunkedLayer:
+
+    def test__init__(self):
+        layer = ChunkedLayer((10, 7), (4, 4), default=1.5)
+
+        assert layer.shape == (10, 7)
+        assert layer.ndim == 2
+        assert layer.size == 70
+        assert layer.dtype == numpy.float64
+        assert layer.allocatedChunks() == 0
+
+    def test_getChunkBounds(self):
+        layer = ChunkedLayer((10, 7), (4, 4))
+
+        assert layer.getChunkBounds((0, 0)) == ((0, 0), (4, 4))
+        assert layer.getChunkBounds((2, 1)) == ((8, 4), (10, 7))
+
+    def test__getitem__(self):
+        layer = ChunkedLayer((10, 7), (4, 4), default=1.5)
+
+        # Test reads do not allocate chunks
+        assert layer[9, 6] == 1.5
+        assert layer[3:6, 2:5].shape == (3, 3)
+        assert (layer[3:6, 2:5] == 1.5).all()
+        assert layer[2].shape == (7,)
+        assert layer.allocatedChunks() == 0
+
+        with pytest.raises(IndexError):
+            layer[10, 0]
+
+        with pytest.raises(IndexError):
+            layer[::2]
+
+    def test__setitem__(self):
+        layer = ChunkedLayer((10, 7), (4, 4), default=0.0)
+
+        layer[5, 5] = 2.0
+        assert layer[5, 5] == 2.0
+        assert layer[5, 4] == 0.0
+        assert layer.allocatedChunks() == 1
+
+        # Test writes across chunk boundaries
+        layer[2:6, 3:5] = numpy.arange(8).reshape(4, 2)
+        assert layer.allocatedChunks() == 4
+        assert layer[5, 4] == 7
+        assert layer[2, 3] == 0
+        assert (layer[2:6, 3:5] == numpy.arange(8).reshape(4, 2)).all()
+
+        # Test row assignment
+        layer[9] = numpy.arange(7)
+        assert (layer[9] == numpy.arange(7)).all()
+
+    def test_initialiser(self):
+        layer = ChunkedLayer((10, 7), (4, 4), initialiser=lambda lower, upper: numpy.full(
+            [u - l for l, u in zip(lower, upper)], lower[0]))
+
+        assert layer[9, 6] == 8
+        assert layer[0, 0] == 0
+        assert layer.allocatedChunks() == 2
+
+    def test_getValues(self):
+        layer = ChunkedLayer((10, 7), (4, 4), default=-1)
+        layer[8, 6] = 3
+
+        assert list(layer.getValues([0, 8 * 7 + 6, 69])) == [-1, 3, -1]
+
+    def test_toArray(self):
+        layer = ChunkedLayer((3, 3), (2, 2), default=0)
+        layer[1, 1] = 1
+
+        assert (layer.toArray() == [[0, 0, 0], [0, 1, 0], [0, 0, 0]]).all()
+
+
+class TestChunkedCellLayers:
+
+    def test__init__(self):
+        with pytest.raises(Exception):
+            ChunkedCellLayers((10, 10), chunkSize=0)
+
+        cells = ChunkedCellLayers((100, 50), chunkSize=16)
+
+        assert cells.shape == (50, 100)
+        assert cells.chunkShape == (16, 16)
+        assert len(cells) == 5000
+        assert cells['pos'][101] == (1, 1)
+
+    def test__setitem__(self):
+        cells = ChunkedCellLayers((100, 50), chunkSize=16)
+
+        cells['food'] = 2.0
+        assert cells.getValue('food', 4999) == 2.0
+        assert cells.allocatedChunks() == 0
+
+        cells['id'] = numpy.arange(5000)
+        assert cells.getValue('id', 4999) == 4999
+        assert cells['id'].allocatedChunks() == 28
+
+        with pytest.raises(Exception):
+            cells['pos'] = 0
+
+        del cells['id']
+        assert 'id' not in cells
+
+    def test_addLayer(self):
+        cells = ChunkedCellLayers((100, 50), chunkSize=16)
+
+        cells.addLayer('sum', lambda pos, c: pos[0] + pos[1])
+        cells.addLayer('coords', lambda x, y: x * 1000 + y, mode='coords')
+        cells.addLayer('noise', lambda shape, rng: rng.random(shape), mode='shape', rng=numpy.random.default_rng(3))
+
+        assert cells.isLazy('sum')
+        assert cells.allocatedChunks() == 0
+        assert cells.getValue('sum', 4999) == 99 + 49
+        assert cells.getValue('coords', 4999) == 99049
+        assert cells.allocatedChunks() == 2
+
+        # Test shape mode does not depend on the order chunks are accessed in
+        other = ChunkedCellLayers((100, 50), chunkSize=16)
+        other.addLayer('noise', lambda shape, rng: rng.random(shape), mode='shape', rng=numpy.random.default_rng(3))
+        first = cells.getValue('noise', 4999)
+        cells.getValue('noise', 0)
+        other.getValue('noise', 0)
+        assert other.getValue('noise', 4999) == first
+
+        with pytest.raises(Exception):
+            cells.addLayer('error', lambda x: x, mode='unknown')
+
+    def test_addLayerDType(self):
+        # Test the first read of a generated layer has the dtype of its chunks
+        cells = ChunkedCellLayers((10, 10), chunkSize=4)
+        cells.addLayer('coords', lambda x, y: x + y, mode='coords')
+        cells.addLayer('names', lambda pos, c: 'cell' + str(pos[0]), mode='cell')
+        cells.addLayer('ids', lambda x, y: x * y, mode='coords')
+
+        region = cells['coords'][2:6, 2:6]
+        assert region.dtype == numpy.int64
+        assert cells['coords'][0:8, 0:8].dtype == numpy.int64
+
+        names = cells['names'][0:2, 3:5]
+        assert names.dtype == object
+        assert names.tolist() == [['cell3', 'cell4'], ['cell3', 'cell4']]
+
+        assert cells.getValues('ids', [11, 99]).dtype == numpy.int64
+
+    def test_setValue(self):
+        cells = ChunkedCellLayers((100, 50), chunkSize=16)
+        cells['food'] = 0.0
+
+        cells.setValue('food', 1234, 5.0)
+        assert cells.getValue('food', 1234) == 5.0
+        assert list(cells.getValues('food', [1233, 1234])) == [0.0, 5.0]
+        assert cells.getCell(1234) == {'pos': (34, 12), 'food': 5.0}
+        assert cells.allocatedChunks() == 1
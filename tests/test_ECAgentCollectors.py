@@ -1,7 +1,12 @@
+import math
+
+import numpy
 import pytest
 
-from ECAgent.Core import Agent
+from ECAgent.Core import Agent, Component
 from ECAgent.Collectors import *
+from ECAgent.Sinks import CSVSink, NumpySink, ThreadedSink
+from ECAgent.Environments import GridWorld
 
 
 class TestCollector:
@@ -139,3 +144,624 @@ class TestAgentCollector:
 
         assert len(collector.records) == 1
         assert collector.records[0] == {'value': 1}
+
+
+class TestColumnBuffer:
+
+    def test_append(self):
+        buffer = ColumnBuffer({'a': int, 'b': float}, capacity=2)
+
+        assert len(buffer) == 0
+        assert buffer.getCapacity() == 2
+
+        buffer.append({'a': [1, 2, 3], 'b': 0.5})  # Scalars are repeated
+        assert len(buffer) == 3
+        assert buffer.getCapacity() == 4
+        buffer.append({'a': 4, 'b': 1.5})
+
+        columns = buffer.to_numpy()
+        assert columns['a'].tolist() == [1, 2, 3, 4]
+        assert columns['b'].tolist() == [0.5, 0.5, 0.5, 1.5]
+
+        # Views share memory with the buffer
+        assert numpy.shares_memory(columns['a'], buffer.columns['a'])
+
+        with pytest.raises(Exception):
+            buffer.append({'a': 1})
+
+        buffer.clear()
+        assert len(buffer) == 0
+        assert buffer.getCapacity() == 4
+
+    def test_to_dataframe(self):
+        buffer = ColumnBuffer({'a': int})
+        buffer.append({'a': [1, 2]})
+
+        df = buffer.to_dataframe()
+        assert df['a'].tolist() == [1, 2]
+        assert not numpy.shares_memory(df['a'].values, buffer.columns['a'])
+
+
+class TestRecordIndex:
+
+    def test_getTickRows(self):
+        buffer = ColumnBuffer({'timestep': int, 'agent': int})
+        buffer.append({'timestep': [0, 0, 2, 2, 2, 5], 'agent': [0, 1, 0, 1, 2, 1]})
+        index = RecordIndex(buffer)
+
+        assert index.getTickRows(0, 1) == slice(0, 2)
+        assert index.getTickRows(1, 3) == slice(2, 5)
+        assert index.getTickRows(3, 5) == slice(5, 5)
+        assert index.getTickRows(0, 10) == slice(0, 6)
+
+    def test_getAgentRows(self):
+        buffer = ColumnBuffer({'timestep': int, 'agent': int})
+        buffer.append({'timestep': [0, 0, 1, 1], 'agent': [1, 0, 0, 1]})
+        index = RecordIndex(buffer)
+
+        assert index.getAgentRows(0).tolist() == [1, 2]
+        assert index.getAgentRows(1).tolist() == [0, 3]
+        assert index.getAgentRows(2).tolist() == []
+        assert index.getAgentRows(-1).tolist() == []
+
+        # The index is rebuilt when the buffer changes
+        version = buffer.version
+        buffer.append({'timestep': 2, 'agent': [2, 0]})
+        assert buffer.version > version
+        assert index.getAgentRows(0).tolist() == [1, 2, 5]
+        assert index.getAgentRows(2).tolist() == [4]
+
+        buffer.clear()
+        assert index.getAgentRows(0).tolist() == []
+
+class TestColumnarAgentCollector:
+
+    def test__init__(self):
+        model = Model()
+        collector = ColumnarAgentCollector(model, lambda agent: 1.0, columns=('x', 'y'))
+
+        assert collector.id == "ColumnarAgentCollector"
+        assert collector.valueColumns == ('x', 'y')
+        assert set(collector.records.columns.keys()) == {'timestep', 'agent', 'x', 'y'}
+        assert collector.agentIDs == []
+
+    def test_collect(self):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+        model.environment.addAgent(Agent("a2", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: None if agent.id == 'a2' else 1.0)
+        collector.execute()
+        model.systemManager.timestep += 1
+        collector.agentFunc = lambda agent: 2.0
+        collector.execute()
+
+        columns = collector.to_numpy()
+        assert columns['timestep'].tolist() == [0, 1, 1]
+        assert columns['agent'].tolist() == [0, 0, 1]
+        assert columns['value'].tolist() == [1.0, 2.0, 2.0]
+        assert collector.agentIDs == ['a1', 'a2']
+
+        # New agents are given new indices
+        model.environment.addAgent(Agent("a3", model))
+        model.environment.removeAgent("a1")
+        collector.execute()
+        assert collector.to_numpy()['agent'].tolist()[3:] == [1, 2]
+
+        # Nothing is collected if every agent is skipped
+        collector.agentFunc = lambda agent: None
+        collector.execute()
+        assert len(collector.records) == 5
+
+    def test_multipleColumns(self):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+        model.environment.addAgent(Agent("a2", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: (1, 2), columns=('x', 'y'), dtype=int)
+        collector.execute()
+
+        columns = collector.to_numpy()
+        assert columns['x'].tolist() == [1, 1]
+        assert columns['y'].tolist() == [2, 2]
+        assert columns['x'].dtype == numpy.int64
+
+    def test_to_dataframe(self):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+        model.environment.addAgent(Agent("a2", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: 1.0)
+        collector.execute()
+
+        df = collector.to_dataframe()
+        assert list(df.columns) == ['timestep', 'agent', 'value']
+        assert df['agent'].tolist() == ['a1', 'a2']
+        assert df['value'].tolist() == [1.0, 1.0]
+
+
+    def test_queries(self):
+        model = Model()
+        for i in range(3):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: float(agent.id[1:]), capacity=2)
+        for t in range(4):
+            model.systemManager.timestep = t * 10
+            collector.execute()
+
+        ticks = collector.getTicks(10, 30)
+        assert ticks['timestep'].tolist() == [10, 10, 10, 20, 20, 20]
+        assert numpy.shares_memory(ticks['value'], collector.records.columns['value'])
+        assert collector.getTicks(20)['agent'].tolist() == [0, 1, 2]
+        assert len(collector.getTicks(15)['agent']) == 0
+
+        assert collector.getField('value').tolist() == [0, 1, 2] * 4
+        assert collector.getField('value', 30).tolist() == [0, 1, 2]
+        with pytest.raises(Exception):
+            collector.getField('unknown')
+
+        trajectory = collector.getTrajectory('a2')
+        assert trajectory['timestep'].tolist() == [0, 10, 20, 30]
+        assert trajectory['value'].tolist() == [2.0] * 4
+        assert 'agent' not in trajectory
+
+class TestCollectorSinks:
+
+    def test_flush(self, tmp_path):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+
+        collector = AgentCollector(model, lambda agent: 1, includeTimstep=True, sink=CSVSink(str(tmp_path)),
+                                   chunkSize=2)
+
+        for i in range(5):
+            collector.execute()
+            model.systemManager.timestep += 1
+
+        # Records are written in chunks of 2
+        assert len(collector.sink) == 2
+        assert len(collector.records) == 1
+
+        collector.flush()
+        assert len(collector.sink) == 3
+        assert len(collector.records) == 0
+
+        df = collector.sink.to_dataframe()
+        assert df['timestep'].tolist() == [0, 1, 2, 3, 4]
+        assert df['a1'].tolist() == [1] * 5
+
+        # Collectors without sinks can't be flushed
+        with pytest.raises(Exception):
+            AgentCollector(model, lambda agent: 1).flush()
+
+    def test_cleanUp(self, tmp_path):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: 1.0, sink=NumpySink(str(tmp_path)))
+        model.systemManager.addSystem(collector)
+        collector.execute()
+        collector.cleanUp()
+
+        assert len(collector.sink) == 1
+        assert "ColumnarAgentCollector" not in model.systemManager.systems
+
+    def test_columnarChunks(self, tmp_path):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+        model.environment.addAgent(Agent("a2", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: 1.0, sink=NumpySink(str(tmp_path)), chunkSize=3)
+
+        for i in range(3):
+            collector.execute()
+            model.systemManager.timestep += 1
+
+        # Memory stays bounded because the records are cleared after each chunk is written
+        assert len(collector.sink) == 1
+        assert len(collector.records) == 2
+        assert collector.records.getCapacity() == 1024
+
+        chunk = next(iter(collector.sink))
+        assert chunk['timestep'].tolist() == [0, 0, 1, 1]
+        assert chunk['agent'].tolist() == ['a1', 'a2', 'a1', 'a2']
+
+    def test_threadedSink(self, tmp_path):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+
+        collector = ColumnarAgentCollector(model, lambda agent: 1.0, sink=ThreadedSink(CSVSink(str(tmp_path))),
+                                           chunkSize=1)
+        model.systemManager.addSystem(collector)
+
+        for i in range(3):
+            collector.execute()
+            model.systemManager.timestep += 1
+
+        # cleanUp() writes the queued chunks and stops the writer thread
+        collector.cleanUp()
+        assert not collector.sink.thread.is_alive()
+        assert collector.sink.to_dataframe()['timestep'].tolist() == [0, 1, 2]
+
+
+class WealthComponent(Component):
+
+    def __init__(self, agent, model, wealth, age):
+        super().__init__(agent, model)
+        self.wealth = wealth
+        self.age = age
+
+
+class TestFieldCollector:
+
+    def test__init__(self):
+        model = Model()
+        collector = FieldCollector(model, WealthComponent, 'wealth')
+
+        assert collector.id == "FieldCollector"
+        assert collector.componentType is WealthComponent
+        assert collector.valueColumns == ('wealth',)
+
+        collector = FieldCollector(model, WealthComponent, ('wealth', 'age'), dtype={'wealth': float, 'age': int})
+        assert collector.records.dtypes['wealth'] == numpy.float64
+        assert collector.records.dtypes['age'] == numpy.int64
+
+    def test_collect(self):
+        model = Model()
+        for i in range(3):
+            agent = Agent("a" + str(i), model)
+            model.environment.addAgent(agent)
+            if i != 1:  # a1 doesn't have the component
+                agent.addComponent(WealthComponent(agent, model, i * 1.5, i))
+
+        collector = FieldCollector(model, WealthComponent, ('wealth', 'age'), dtype={'wealth': float, 'age': int})
+        collector.execute()
+        model.systemManager.timestep += 1
+        model.environment.getAgent("a2")[WealthComponent].wealth = 10.0
+        collector.execute()
+
+        columns = collector.to_numpy()
+        assert columns['timestep'].tolist() == [0, 0, 1, 1]
+        assert columns['wealth'].tolist() == [0.0, 3.0, 0.0, 10.0]
+        assert columns['age'].tolist() == [0, 2, 0, 2]
+
+        df = collector.to_dataframe()
+        assert df['agent'].tolist() == ['a0', 'a2', 'a0', 'a2']
+
+        # Nothing is collected if no agent has the component
+        model.environment.getAgent("a0").removeComponent(WealthComponent)
+        model.environment.getAgent("a2").removeComponent(WealthComponent)
+        collector.execute()
+        assert len(collector.records) == 4
+
+
+class TestAggregateCollector:
+
+    def test__init__(self):
+        model = Model()
+
+        with pytest.raises(Exception):
+            AggregateCollector(model, WealthComponent)
+
+        collector = AggregateCollector(model, WealthComponent, 'wealth', bins=(0, 10, 5))
+        assert collector.id == "AggregateCollector"
+        assert collector.histogram.bins == 5
+        assert AggregateCollector(model, agentFunc=lambda agent: 1).histogram is None
+
+    def test_collect(self):
+        model = Model()
+        for i in range(4):
+            agent = Agent("a" + str(i), model)
+            model.environment.addAgent(agent)
+            agent.addComponent(WealthComponent(agent, model, [0, 0, 0, 4][i], i))
+
+        collector = AggregateCollector(model, WealthComponent, 'wealth', quantiles=(0.5, 1.0), includeGini=True,
+                                       bins=(0, 4, 4))
+        collector.execute()
+
+        assert collector.records[0] == {'timestep': 0, 'count': 4, 'mean': 1.0, 'var': 3.0, 'min': 0.0, 'max': 4.0,
+                                        'q0.5': 0.0, 'q1.0': 4.0, 'gini': 0.75}
+        assert collector.statistics.count == 4
+        assert collector.histogram.counts.tolist() == [3, 0, 0, 1]
+
+        # agentFunc values
+        collector = AggregateCollector(model, agentFunc=lambda agent: None if agent.id == 'a0' else 2.0)
+        collector.execute()
+        assert collector.records[0]['count'] == 3
+        assert collector.records[0]['var'] == 0.0
+
+        # Empty ticks
+        collector = AggregateCollector(model, agentFunc=lambda agent: None, quantiles=(0.5,))
+        collector.execute()
+        assert collector.records[0]['count'] == 0
+        assert math.isnan(collector.records[0]['mean'])
+        assert math.isnan(collector.records[0]['q0.5'])
+
+    def test_merge(self):
+        collectors = []
+        for seed in range(2):
+            model = Model()
+            for i in range(10):
+                agent = Agent("a" + str(i), model)
+                model.environment.addAgent(agent)
+                agent.addComponent(WealthComponent(agent, model, i + seed * 10, i))
+
+            collector = AggregateCollector(model, WealthComponent, 'wealth', bins=(0, 20, 2))
+            collector.execute()
+            collectors.append(collector)
+
+        collectors[0].merge(collectors[1])
+        assert collectors[0].statistics.count == 20
+        assert collectors[0].statistics.getMean() == pytest.approx(9.5)
+        assert collectors[0].histogram.counts.tolist() == [10, 10]
+        assert collectors[0].quantileSketch.count == 20
+        assert len(collectors[0].records) == 1
+
+
+class TestTrajectoryCollector:
+
+    def test_collect(self):
+        model = Model(seed=42)
+        for i in range(10):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        collector = TrajectoryCollector(model, lambda agent: int(agent.id[1:]), 3)
+        assert collector.id == "TrajectoryCollector"
+        assert collector.tracked == []
+
+        collector.execute()
+        tracked = list(collector.tracked)
+        assert len(tracked) == 3
+        assert len(set(tracked)) == 3
+
+        # The same agents are tracked while they are alive
+        model.systemManager.timestep += 1
+        collector.execute()
+        assert collector.tracked == tracked
+        assert len(collector.records) == 6
+
+        # Dead agents are replaced
+        model.environment.removeAgent(tracked[0])
+        model.systemManager.timestep += 1
+        collector.execute()
+        assert collector.tracked[:2] == tracked[1:]
+        assert collector.tracked[2] not in tracked
+        assert len(collector.records) == 9
+
+        trajectory = collector.getTrajectory(tracked[1])
+        assert trajectory['timestep'].tolist() == [0, 1, 2]
+        assert trajectory['value'].tolist() == [int(tracked[1][1:])] * 3
+        assert collector.getTrajectory(tracked[0])['timestep'].tolist() == [0, 1]
+        assert len(collector.getTrajectory('unknown')['timestep']) == 0
+
+    def test_reproducible(self):
+        samples = []
+        for _ in range(2):
+            model = Model(seed=7)
+            for i in range(100):
+                model.environment.addAgent(Agent("a" + str(i), model))
+
+            collector = TrajectoryCollector(model, lambda agent: 1.0, 5)
+            collector.execute()
+            samples.append(collector.tracked)
+
+        assert samples[0] == samples[1]
+
+    def test_smallPopulation(self):
+        model = Model()
+        model.environment.addAgent(Agent("a1", model))
+
+        collector = TrajectoryCollector(model, lambda agent: 1.0, 5)
+        collector.execute()
+        assert collector.tracked == ['a1']
+
+        model.environment.removeAgent('a1')
+        collector.execute()
+        assert collector.tracked == []
+        assert len(collector.records) == 1
+
+
+
+class TestDeltaCollector:
+
+    def test_collect(self):
+        model = Model()
+        for i in range(3):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        ages = {'a0': 0, 'a1': 0, 'a2': 0}
+        collector = DeltaCollector(model, lambda agent: ages[agent.id], keyframeInterval=3, dtype=int)
+        assert collector.id == "DeltaCollector"
+
+        collector.execute()  # Keyframe
+        assert len(collector.records) == 3
+
+        model.systemManager.timestep += 1
+        ages['a1'] = 1
+        collector.execute()  # Only a1 changed
+        assert len(collector.records) == 4
+
+        model.systemManager.timestep += 1
+        model.environment.removeAgent('a2')
+        model.environment.addAgent(Agent("a3", model))
+        ages['a3'] = 5
+        collector.execute()  # a3 was added and a2 was removed
+        assert len(collector.records) == 5
+        assert collector.removals.to_numpy()['agent'].tolist() == [2]
+
+        model.systemManager.timestep += 1
+        collector.execute()  # Keyframe
+        assert len(collector.records) == 8
+
+        frames = collector.frames.to_numpy()
+        assert frames['timestep'].tolist() == [0, 1, 2, 3]
+        assert frames['start'].tolist() == [0, 3, 4, 5]
+        assert frames['keyframe'].tolist() == [True, False, False, True]
+
+    def test_getState(self):
+        model = Model()
+        for i in range(3):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        values = {'a0': 0.0, 'a1': 0.0, 'a2': 0.0}
+        collector = DeltaCollector(model, lambda agent: values.get(agent.id), keyframeInterval=4)
+
+        with pytest.raises(Exception):
+            collector.getState(0)
+
+        snapshots = []
+        for t in range(10):
+            model.systemManager.timestep = t * 2  # Collected every second tick
+            if values['a' + str(t % 3)] is not None:
+                values['a' + str(t % 3)] += 1.0
+            if t == 3:
+                model.environment.removeAgent('a1')
+            if t == 5:
+                model.environment.addAgent(Agent("a1", model))
+            if t == 7:
+                values['a2'] = None
+            collector.execute()
+            snapshots.append({k: v for k, v in values.items() if v is not None and k in model.environment.agents})
+
+        for t in range(10):
+            state = collector.getState(t * 2 + 1)  # Ticks that weren't collected use the previous collected tick
+            assert dict(zip(state['agent'].tolist(), state['value'].tolist())) == snapshots[t]
+
+        # Fewer rows than full snapshots
+        assert len(collector.records) < sum(len(snapshot) for snapshot in snapshots)
+
+    def test_flush(self, tmp_path):
+        model = Model()
+        model.environment.addAgent(Agent("a0", model))
+
+        collector = DeltaCollector(model, lambda agent: 1.0, keyframeInterval=10, sink=NumpySink(str(tmp_path)),
+                                   chunkSize=1)
+        for t in range(3):
+            model.systemManager.timestep = t
+            collector.execute()
+
+        # Every chunk starts with a keyframe
+        assert len(collector.sink) == 3
+        assert len(collector.frames) == 0
+        assert [chunk['timestep'].tolist() for chunk in collector.sink] == [[0], [1], [2]]
+
+    def test_getChunk(self):
+        model = Model()
+        for i in range(3):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        collector = DeltaCollector(model, lambda agent: 1.0, keyframeInterval=10)
+        collector.execute()
+        model.systemManager.timestep = 1
+        model.environment.removeAgent('a1')
+        collector.execute()
+
+        chunk = collector.getChunk()
+        assert chunk['timestep'].tolist() == [0, 0, 0, 1]
+        assert chunk['agent'].tolist() == ['a0', 'a1', 'a2', 'a1']
+        assert chunk['keyframe'].tolist() == [True, True, True, False]
+        assert chunk['removed'].tolist() == [False, False, False, True]
+
+    def test_getStateFromSink(self, tmp_path):
+        for sink in (NumpySink(str(tmp_path / 'npz')), CSVSink(str(tmp_path / 'csv'))):
+            model = Model()
+            for i in range(3):
+                model.environment.addAgent(Agent("a" + str(i), model))
+
+            values = {'a0': 0.0, 'a1': 0.0, 'a2': 0.0, 'a3': 0.0}
+            collector = DeltaCollector(model, lambda agent: values[agent.id], keyframeInterval=3, sink=sink,
+                                       chunkSize=4)
+
+            snapshots = []
+            for t in range(10):
+                model.systemManager.timestep = t
+                values['a' + str(t % 3)] += 1.0
+                if t == 2:
+                    model.environment.removeAgent('a1')
+                if t == 6:
+                    model.environment.addAgent(Agent("a3", model))
+                collector.execute()
+                snapshots.append({k: values[k] for k in model.environment.agents})
+
+            assert len(collector.sink) > 0
+            for t in range(10):
+                state = collector.getState(t)
+                assert dict(zip(state['agent'].tolist(), state['value'].tolist())) == snapshots[t]
+
+            collector.flush()
+            for t in range(10):
+                state = DeltaCollector.getStateFromSink(collector.sink, t)
+                assert dict(zip(state['agent'].tolist(), state['value'].tolist())) == snapshots[t]
+
+            with pytest.raises(Exception):
+                DeltaCollector.getStateFromSink(collector.sink, -1)
+
+    def test_flushRemovals(self, tmp_path):
+        model = Model()
+        for i in range(3):
+            model.environment.addAgent(Agent("a" + str(i), model))
+
+        collector = DeltaCollector(model, lambda agent: 1.0, sink=NumpySink(str(tmp_path)), chunkSize=3)
+        model.systemManager.timestep = 0
+        collector.execute()
+        assert len(collector.sink) == 1
+
+        # A tick that only removes agents must still be written to the sink
+        for i in range(3):
+            model.environment.removeAgent("a" + str(i))
+        model.systemManager.timestep = 1
+        collector.execute()
+        collector.flush()
+        assert len(collector.sink) == 2
+
+        assert len(collector.getState(0)['agent']) == 3
+        assert len(collector.getState(1)['agent']) == 0
+        assert len(DeltaCollector.getStateFromSink(collector.sink, 1)['agent']) == 0
+
+
+class TestCellLayerCollector:
+
+    def test_collect(self):
+        model = Model()
+        model.environment = GridWorld(4, 3, model)
+        model.environment.cells['food'] = 0.5
+
+        collector = CellLayerCollector(model, model.environment, ('food',), 3, dtype=numpy.float32)
+        assert collector.id == "CellLayerCollector"
+        assert collector.records['food'].shape == (3, 3, 4)
+        assert collector.records['food'].dtype == numpy.float32
+
+        collector.execute()
+        model.systemManager.timestep = 4
+        model.environment.cells['food'][1, 2] = 2.0
+        collector.execute()
+
+        snapshots = collector.getSnapshots('food')
+        assert snapshots.shape == (2, 3, 4)
+        assert snapshots[0, 1, 2] == 0.5
+        assert snapshots[1, 1, 2] == 2.0
+        assert collector.getTimesteps().tolist() == [0, 4]
+
+        collector.execute()
+        with pytest.raises(Exception):
+            collector.execute()
+
+    def test_memoryMapped(self, tmp_path):
+        model = Model()
+        model.environment = GridWorld(4, 3, model)
+        model.environment.cells['food'] = 1.0
+        model.environment.cells['owner'] = numpy.full((3, 4), 7)
+
+        collector = CellLayerCollector(model, model.environment, ['food', 'owner'], 2,
+                                       dtype={'owner': numpy.uint8}, directory=str(tmp_path))
+        assert collector.records['food'].dtype == numpy.float64
+        assert collector.records['owner'].dtype == numpy.uint8
+
+        model.systemManager.addSystem(collector)
+        collector.execute()
+        collector.cleanUp()
+
+        owners = numpy.load(str(tmp_path / 'CellLayerCollector.owner.npy'), mmap_mode='r')
+        assert owners.shape == (2, 3, 4)
+        assert (owners[0] == 7).all()
@@ -1,3 +1,4 @@
+import numpy
 import pytest
 
 from ECAgent.Core import *
@@ -6,6 +7,48 @@ from ECAgent.Environments import *
 
 def test_discreteGridPostoID():
     assert (4 * 3 * 5) + (2 * 3) + 1 == discreteGridPosToID(1, 2, 3, 4, 5)
+    assert list(discreteGridPosToID([1, 2], [0, 1], 3)) == [1, 5]
+    assert list(discreteGridPosToID(numpy.array([1, 2]), 1, 3, numpy.array([0, 2]), 2)) == [4, 17]
+
+
+def test_discreteGridIDToPos():
+    assert discreteGridIDToPos(4) == (4, 0, 0)
+    assert discreteGridIDToPos(7, 3) == (1, 2, 0)
+    assert discreteGridIDToPos(discreteGridPosToID(1, 2, 3, 4, 5), 3, 5) == (1, 2, 4)
+
+    xs, ys, zs = discreteGridIDToPos([4, 17], 3, 2)
+    assert list(xs) == [1, 2] and list(ys) == [1, 1] and list(zs) == [0, 2]
+
+
+def test_resolveMoves():
+    rng = numpy.random.default_rng(0)
+
+    # Test swaps and agents that stay
+    assert list(resolveMoves([0, 1, 2], [1, 0, 2], 1, rng=rng)) == [True, True, True]
+
+    # Test rejected moves block the agents behind them
+    assert list(resolveMoves([0, 1, 2], [1, 2, 2], 1, rng=rng)) == [False, False, True]
+
+    # Test priorities and capacities
+    assert list(resolveMoves([0, 3, 4], [1, 1, 1], 1, priorities=[1, 5, 2], rng=rng)) == [False, True, False]
+    assert list(resolveMoves([0, 3, 4], [1, 1, 1], 2, priorities=[1, 5, 2], rng=rng)) == [False, True, True]
+    assert list(resolveMoves([0, 3, 4], [1, 1, 1], [0, 3, 0, 0, 0], rng=rng)) == [True, True, True]
+
+    # Test an occupied cell only has space for the agents it can still hold
+    assert list(resolveMoves([0, 1, 2], [1, 1, 1], 2, priorities=[2, 0, 1], rng=rng)) == [True, True, False]
+
+    # Test random tie breaking is fair
+    wins = sum(resolveMoves([0, 2], [1, 1], 1, rng=rng)[0] for _ in range(1000))
+    assert 400 < wins < 600
+
+    # Test capacities are never exceeded
+    currentIDs = rng.choice(100, 50, replace=False)
+    targetIDs = rng.integers(0, 100, 50)
+    accepted = resolveMoves(currentIDs, targetIDs, 1, rng=rng)
+    assert numpy.bincount(numpy.where(accepted, targetIDs, currentIDs)).max() == 1
+
+    with pytest.raises(Exception):
+        resolveMoves([0], [1, 2], 1)
 
 
 class TestPositionComponent:
@@ -28,6 +71,216 @@ class TestPositionComponent:
         assert pos.getPosition() == (1, 2, 3)
 
 
+class TestDiscreteWorld:
+
+    def test__init__(self):
+        model = Model()
+        env = DiscreteWorld((4, 3, 2), model)
+
+        assert env.dimensions == (4, 3, 2)
+        assert list(env.strides) == [1, 4, 12]
+        assert env.cells.shape == (2, 3, 4)
+        assert env.getDimensions() == (4, 3, 2)
+
+        with pytest.raises(Exception):
+            DiscreteWorld((), model)
+
+        with pytest.raises(Exception):
+            DiscreteWorld((2, 2, 2, 2), model)
+
+        with pytest.raises(Exception):
+            DiscreteWorld((2, 0), model)
+
+    def test_toCellIDs(self):
+        env = DiscreteWorld((4, 3, 2), Model())
+
+        positions = numpy.array([[0, 0, 0], [1, 2, 1], [3, 2, 1]])
+        cellIDs = env.toCellIDs(positions)
+        assert list(cellIDs) == [0, 21, 23]
+        assert list(cellIDs) == list(discreteGridPosToID(positions[:, 0], positions[:, 1], 4, positions[:, 2], 3))
+        assert (env.toCoordinates(cellIDs) == positions).all()
+        assert env.toCellID((1, 2, 1)) == 21
+
+        env = DiscreteWorld((5,), Model())
+        assert list(env.toCellIDs([1, 3])) == [1, 3]
+        assert env.toCoordinates([1, 3]).tolist() == [[1], [3]]
+        assert env.toCellID(3) == 3
+
+        env = DiscreteWorld((4, 3), Model())
+        assert env.toCellID((3, 2)) == 11
+        assert env.toCoordinates([11]).tolist() == [[3, 2]]
+
+    def test_agents(self):
+        model = Model()
+        env = DiscreteWorld((4, 3), model)
+        agent = Agent('a1', model)
+
+        # Missing coordinates default to 0
+        env.addAgent(agent, 2)
+        assert agent[PositionComponent].getPosition() == (2, 0, 0)
+        assert env.getAgentsAt(2, 0) == [agent]
+
+        env.trackDensity()
+        env.moveAgent(agent.id, 3, 2)
+        assert agent[PositionComponent].getPosition() == (3, 2, 0)
+        assert env.getDensity()[2, 3] == 1
+        assert env.getAgentsAt(2, 0) == []
+
+        env.moveAgents([agent.id], [1, 1], toroidal=True)
+        assert agent[PositionComponent].getPosition() == (0, 0, 0)
+        assert env.getDensity()[0, 0] == 1
+
+        with pytest.raises(Exception):
+            env.addAgent(Agent('a2', model), 4, 0)
+
+        with pytest.raises(Exception):
+            env.moveAgent(agent.id, 0, -1)
+
+    def test_getCell(self):
+        env = DiscreteWorld((4, 3), Model())
+        env.cells['value'] = numpy.arange(12)
+
+        assert env.getCell(1, 2) == {'pos': (1, 2), 'value': 9}
+        assert env.getCell(4, 0) is None
+        assert env.getCell(1) is None
+
+    def test_sampleCells(self):
+        model = Model(seed=4)
+        env = DiscreteWorld((4, 3), model)
+        env.cells['fertile'] = [0, 1] * 6
+
+        cellIDs = env.sampleCells(12)
+        assert sorted(cellIDs.tolist()) == list(range(12))
+        assert len(env.sampleCells(20, replace=True)) == 20
+
+        # Test layer predicates
+        assert all(cellID % 2 == 1 for cellID in env.sampleCells(6, where='fertile'))
+        assert sorted(env.sampleCells(4, where=numpy.arange(12).reshape(3, 4) < 4).tolist()) == [0, 1, 2, 3]
+
+        # Test empty cells
+        env.addAgent(Agent('a1', model), 1, 0)
+        env.addAgent(Agent('a2', model), 3, 0)
+        assert env.getOccupancy().sum() == 2
+        assert set(env.sampleCells(4, empty=True, where='fertile').tolist()) == {5, 7, 9, 11}
+
+        env.trackDensity()
+        assert env.getOccupancy()[0, 1]
+
+        with pytest.raises(Exception):
+            env.sampleCells(13)
+
+        with pytest.raises(Exception):
+            env.sampleCells(5, empty=True, where='fertile')
+
+        # Test the model's RNG is used
+        assert list(DiscreteWorld((10, 10), Model(seed=1)).sampleCells(5)) == \
+            list(DiscreteWorld((10, 10), Model(seed=1)).sampleCells(5))
+
+    def test_sampleCellsChunked(self):
+        model = Model(seed=2)
+        env = ChunkedGridWorld(8, 8, model, chunkSize=4)
+        env.cells['food'] = 0.0
+        env.cells['food'][5, 2:7] = 1.0
+        env.cells['capacity'] = 1
+
+        # Layer names are read from every chunk
+        cellIDs = env.sampleCells(5, where='food')
+        assert sorted(cellIDs.tolist()) == [42, 43, 44, 45, 46]
+
+        agents = [Agent('a' + str(i), model) for i in range(2)]
+        env.addAgents(agents, [[0, 0], [1, 0]])
+        assert env.moveAgentsTo(['a0', 'a1'], [[2, 2], [2, 2]], capacity='capacity').sum() == 1
+
+    def test_addAgents(self):
+        model = Model()
+        env = DiscreteWorld((4, 3), model)
+        env.trackDensity()
+        agents = [Agent('a' + str(i), model) for i in range(3)]
+
+        env.addAgents(agents, [[0, 0], [1, 2], [1, 2]])
+        assert agents[1][PositionComponent].getPosition() == (1, 2, 0)
+        assert env.getDensity()[2, 1] == 2
+        assert len(env) == 3
+
+        with pytest.raises(Exception):
+            env.addAgents([Agent('a3', model)], [[4, 0]])
+
+        with pytest.raises(Exception):
+            env.addAgents([Agent('a3', model)], [[0, 0], [1, 1]])
+
+    def test_addAgentsRandomly(self):
+        model = Model(seed=2)
+        env = DiscreteWorld((5, 4), model)
+        env.cells['water'] = numpy.arange(20) < 5
+
+        agents = [Agent('a' + str(i), model) for i in range(15)]
+        cellIDs = env.addAgentsRandomly(agents, where=lambda cells: ~cells['water'])
+        assert len(set(cellIDs.tolist())) == 15
+        assert cellIDs.min() >= 5
+        assert env.getOccupancy().sum() == 15
+
+        # Every non-water cell is now occupied
+        with pytest.raises(Exception):
+            env.addAgentsRandomly([Agent('a15', model)], where=lambda cells: ~cells['water'])
+
+    def test_moveAgentsTo(self):
+        model = Model(seed=3)
+        env = DiscreteWorld((3, 3), model)
+        env.trackDensity()
+        env.cells['capacity'] = 1
+        env.cells.setValue('capacity', 4, 2)
+
+        agents = [Agent('a' + str(i), model) for i in range(4)]
+        env.addAgents(agents, [[0, 0], [2, 0], [0, 2], [2, 2]])
+
+        # Everyone wants the centre, which has space for 2. a3 has the highest priority.
+        accepted = env.moveAgentsTo(['a0', 'a1', 'a2', 'a3'], [[1, 1]] * 4, 'capacity', priorities=[0, 1, 0, 5])
+        assert accepted.sum() == 2 and accepted[3]
+        assert agents[3][PositionComponent].getPosition() == (1, 1, 0)
+        assert env.getDensity()[1, 1] == 2
+        assert env.getDensity().sum() == 4
+
+        # Test losers stay where they were
+        for agent, moved in zip(agents, accepted):
+            if not moved:
+                assert agent[PositionComponent].getPosition() != (1, 1, 0)
+
+        assert len(env.moveAgentsTo([], [])) == 0
+
+        with pytest.raises(Exception):
+            env.moveAgentsTo(['a0'], [[3, 0]])
+
+    def test_moveAgentsToBystanders(self):
+        for track in (False, True):
+            model = Model(seed=1)
+            env = GridWorld(3, 3, model)
+            if track:
+                env.trackDensity()
+
+            env.addAgents([Agent('a', model), Agent('b', model), Agent('c', model)], [[0, 0], [1, 1], [2, 2]])
+
+            # b isn't being moved but still occupies its cell
+            assert env.moveAgentsTo(['a'], [[1, 1]]).tolist() == [False]
+            assert env.moveAgentsTo(['c'], [[1, 1]], capacity=2).tolist() == [True]
+            assert env.moveAgentsTo(['a'], [[1, 1]], capacity=2).tolist() == [False]
+            assert env.getAgentCounts()[1, 1] == 2
+            assert env.agents['a'][PositionComponent].getPosition() == (0, 0, 0)
+
+    def test_regions(self):
+        model = Model()
+        model.environment = GridWorld(4, 3, model)
+        model.environment.cells['resource'] = 1.0
+
+        assert list(model.environment.regions.getSumsInRadius('resource', [[0, 0], [1, 1]], 1)) == [4.0, 9.0]
+        assert ChunkedGridWorld(4, 3, model).regions is None
+
+    def test_getNeighbours(self):
+        env = DiscreteWorld((4, 3), Model())
+
+        assert env.getNeighbours((0, 0)) == [1, 4, 5]
+        assert env.getNeighbours((1, 1), moore=True) == [0, 1, 2, 4, 5, 6, 8, 9, 10]
+
+
 class TestLineWorld:
 
     def test__init__(self):
@@ -89,6 +342,9 @@ class TestLineWorld:
 
         assert len(env.cells['test_comp']) == 5
 
+        env.addCellComponent('coords', lambda x: x * 2, mode='coords')
+        assert list(env.cells['coords']) == [0, 2, 4, 6, 8]
+
     def test_removeAgent(self):
         model = Model()
         model.environment = LineWorld(5, model)
@@ -233,7 +489,23 @@ class TestGridWorld:
 
         env.addCellComponent('unique_id', generator)
 
-        assert len(env.cells['unique_id']) == 25
+        assert env.cells['unique_id'].shape == (5, 5)
+        assert env.cells['unique_id'][2, 1] == discreteGridPosToID(1, 2)
+
+        # Test vectorized modes
+        env.addCellComponent('coords_id', lambda x, y: discreteGridPosToID(x, y, 5), mode='coords')
+        assert env.cells['coords_id'][2, 1] == discreteGridPosToID(1, 2, 5)
+
+        env.addCellComponent('noise', lambda shape, rng: rng.random(shape), mode='shape', lazy=True)
+        assert env.cells.isLazy('noise')
+        assert env.cells['noise'].shape == (5, 5)
+
+        # Test shape mode is reproducible for a seeded model
+        first = GridWorld(5, 5, Model(seed=7))
+        second = GridWorld(5, 5, Model(seed=7))
+        first.addCellComponent('noise', lambda shape, rng: rng.random(shape), mode='shape')
+        second.addCellComponent('noise', lambda shape, rng: rng.random(shape), mode='shape')
+        assert (first.cells['noise'] == second.cells['noise']).all()
 
     def test_removeAgent(self):
         model = Model()
@@ -285,6 +557,9 @@ class TestGridWorld:
         assert env.getCell(0, 5) is None
         assert env.getCell(0, 0) is not None
 
+        env.addCellComponent('value', lambda pos, cells: pos[0] * 10 + pos[1])
+        assert env.getCell(3, 2) == {'pos': (3, 2), 'value': 32}
+
     def test_getNeighbours(self):
         model = Model()
         gridworld = GridWorld(3, 3, model)
@@ -411,7 +686,11 @@ class TestCubeWorld:
 
         env.addCellComponent('unique_id', generator)
 
-        assert len(env.cells['unique_id']) == 125
+        assert env.cells['unique_id'].shape == (5, 5, 5)
+        assert env.cells['unique_id'][3, 2, 1] == discreteGridPosToID(1, 2, 5, 3, 5)
+
+        env.addCellComponent('coords_id', lambda x, y, z: discreteGridPosToID(x, y, 5, z, 5), mode='coords')
+        assert (env.cells['coords_id'] == env.cells['unique_id']).all()
 
     def test_removeAgent(self):
         model = Model()
@@ -499,4 +778,503 @@ class TestCubeWorld:
         assert neighbours[4] == discreteGridPosToID(0, 0, cubeworld.width, 1, cubeworld.height)
         assert neighbours[5] == discreteGridPosToID(1, 0, cubeworld.width, 1, cubeworld.height)
         assert neighbours[6] == discreteGridPosToID(0, 1, cubeworld.width, 1, cubeworld.height)
-        assert neighbours[7] == discreteGridPosToID(1, 1, cubeworld.width, 1, cubeworld.height)
\ No newline at end of file
+        assert neighbours[7] == discreteGridPosToID(1, 1, cubeworld.width, 1, cubeworld.height)
+
+class TestSpatialHash:
+
+    def test__init__(self):
+        with pytest.raises(Exception):
+            SpatialHash((10, 10), cellSize=0)
+
+        index = SpatialHash((10, 5), cellSize=2)
+        assert index.shape == (5, 3)
+        assert len(index) == 0
+
+    def test_insert(self):
+        index = SpatialHash((10, 10), cellSize=2)
+        index.insert('a', (1.0, 1.0))
+        index.insert('b', (5.5, 1.0))
+
+        assert len(index) == 2
+        assert 'a' in index
+        assert list(index.getPosition('b')) == [5.5, 1.0]
+        assert index.buckets == {0: {0}, 10: {1}}
+
+        with pytest.raises(Exception):
+            index.insert('a', (0.0, 0.0))
+
+        # Test capacity growth
+        for i in range(40):
+            index.insert(i, (i % 10, i // 10))
+        assert len(index) == 42
+
+    def test_remove(self):
+        index = SpatialHash((10, 10), cellSize=2)
+        index.insert('a', (1.0, 1.0))
+        index.insert('b', (5.5, 1.0))
+        index.insert('c', (9.0, 9.0))
+
+        index.remove('a')
+        assert 'a' not in index
+        assert index.keys == ['c', 'b']
+        assert index.rows == {'c': 0, 'b': 1}
+        assert index.buckets == {24: {0}, 10: {1}}
+
+        with pytest.raises(Exception):
+            index.remove('a')
+
+    def test_move(self):
+        index = SpatialHash((10, 10), cellSize=2)
+        index.insert('a', (1.0, 1.0))
+
+        # Test move within the same bucket
+        index.move('a', (1.5, 0.5))
+        assert index.buckets == {0: {0}}
+
+        # Test move into a different bucket
+        index.move('a', (3.0, 1.0))
+        assert index.buckets == {5: {0}}
+        assert index.queryRadius((3.0, 1.0), 0.1) == ['a']
+
+    def test_queryRadius(self):
+        index = SpatialHash((10, 10), cellSize=1)
+        index.insert('a', (1.0, 1.0))
+        index.insert('b', (2.0, 1.0))
+        index.insert('c', (5.0, 5.0))
+
+        assert index.queryRadius((1.2, 1.0), 1.0) == ['a', 'b']
+        assert index.queryRadius((5.0, 5.0), 0.5) == ['c']
+        assert index.queryRadius((8.0, 8.0), 1.0) == []
+
+        # Test wrapped distances
+        index = SpatialHash((10, 10), cellSize=1, wrap=True)
+        index.insert('a', (0.5, 0.5))
+        index.insert('b', (9.5, 9.5))
+        assert index.queryRadius((0.2, 0.2), 1.0) == ['a', 'b']
+
+    def test_queryNearest(self):
+        index = SpatialHash((100, 100), cellSize=1)
+        assert index.queryNearest((0, 0), 1) == []
+
+        index.insert('a', (1.0, 1.0))
+        index.insert('b', (50.0, 50.0))
+        index.insert('c', (99.0, 99.0))
+
+        assert index.queryNearest((60.0, 60.0), 1) == ['b']
+        assert index.queryNearest((60.0, 60.0), 2) == ['b', 'c']
+        assert index.queryNearest((60.0, 60.0), 5) == ['b', 'c', 'a']
+
+    def test_queryAllNeighbours(self):
+        rng = numpy.random.default_rng(0)
+        for wrap in [False, True]:
+            index = SpatialHash((20, 20, 20), cellSize=3, wrap=wrap)
+            positions = rng.random((200, 3)) * 20
+            for i in range(200):
+                index.insert(i, positions[i])
+
+            neighbours = index.queryAllNeighbours(4.0)
+
+            # Compare with brute force results
+            for i in range(200):
+                delta = numpy.abs(positions - positions[i])
+                if wrap:
+                    delta = numpy.minimum(delta, 20 - delta)
+                distances = numpy.sqrt((delta ** 2).sum(axis=1))
+                expected = {j for j in range(200) if j != i and distances[j] <= 4.0}
+                assert set(neighbours[i]) == expected
+                assert set(index.queryRadius(positions[i], 4.0)) == expected | {i}
+
+
+class TestContinuousWorld:
+
+    def test__init__(self):
+        with pytest.raises(Exception):
+            ContinuousWorld(0, 5, Model())
+
+        with pytest.raises(Exception):
+            ContinuousWorld(5, 5, Model(), depth=-1)
+
+        model = Model()
+        env = ContinuousWorld(10, 5, model)
+        assert env.getDimensions() == (10, 5)
+        assert env.model is model
+        assert not env.wrap
+        assert len(env.agents) == 0
+
+        env = ContinuousWorld(10, 5, model, depth=2, wrap=True)
+        assert env.getDimensions() == (10, 5, 2)
+        assert env.wrap
+
+    def test_addAgent(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model)
+        agent = Agent("a1", model)
+
+        with pytest.raises(Exception):
+            model.environment.addAgent(agent, -0.5, 0)
+
+        with pytest.raises(Exception):
+            model.environment.addAgent(agent, 0, 10)
+
+        model.environment.addAgent(agent, 2.5, 3.5)
+        assert model.environment[agent.id] is agent
+        assert agent[PositionComponent].getPosition() == (2.5, 3.5, 0.0)
+        assert agent.id in model.environment.index
+
+        with pytest.raises(Exception):
+            model.environment.addAgent(agent)
+
+        # Test wrapping
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model, wrap=True)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, -0.5, 12)
+        assert agent[PositionComponent].getPosition() == (9.5, 2.0, 0.0)
+
+    def test_removeAgent(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, 1, 1)
+        model.environment.removeAgent(agent.id)
+
+        assert len(model.environment.agents) == 0
+        assert agent[PositionComponent] is None
+        assert len(model.environment.index) == 0
+
+        with pytest.raises(Exception):
+            model.environment.removeAgent(agent.id)
+
+    def test_moveAgent(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model, depth=10)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, 1, 1, 1)
+
+        model.environment.moveAgent(agent.id, 8, 8, 8)
+        assert agent[PositionComponent].getPosition() == (8, 8, 8)
+        assert model.environment.getAgentsInRadius((8, 8, 8), 0.1) == [agent]
+        assert model.environment.getAgentsInRadius((1, 1, 1), 0.1) == []
+
+        with pytest.raises(Exception):
+            model.environment.moveAgent(agent.id, 11, 8, 8)
+
+    def test_updateIndex(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, 1, 1)
+
+        agent[PositionComponent].x = 6.0
+        model.environment.updateIndex()
+        assert model.environment.getAgentsInRadius((6, 1), 0.1) == [agent]
+
+    def test_getAgentsInRadius(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model)
+        a1, a2, a3 = Agent("a1", model), Agent("a2", model), Agent("a3", model)
+        model.environment.addAgent(a1, 1, 1)
+        model.environment.addAgent(a2, 2, 2)
+        model.environment.addAgent(a3, 9, 9)
+
+        assert model.environment.getAgentsInRadius((1.8, 1.8), 2) == [a2, a1]
+        assert model.environment.getAgentsInRadius((5, 5), 1) == []
+
+    def test_getNearestAgents(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model)
+        a1, a2, a3 = Agent("a1", model), Agent("a2", model), Agent("a3", model)
+        model.environment.addAgent(a1, 1, 1)
+        model.environment.addAgent(a2, 2, 2)
+        model.environment.addAgent(a3, 9, 9)
+
+        assert model.environment.getNearestAgents((8, 8)) == [a3]
+        assert model.environment.getNearestAgents((8, 8), 2) == [a3, a2]
+
+    def test_getAllNeighbours(self):
+        model = Model()
+        model.environment = ContinuousWorld(10, 10, model, wrap=True)
+        a1, a2, a3 = Agent("a1", model), Agent("a2", model), Agent("a3", model)
+        model.environment.addAgent(a1, 0.5, 0.5)
+        model.environment.addAgent(a2, 9.5, 0.5)
+        model.environment.addAgent(a3, 5, 5)
+
+        neighbours = model.environment.getAllNeighbours(1.5)
+        assert neighbours == {'a1': [a2], 'a2': [a1], 'a3': []}
+
+
+class TestChunkedGridWorld:
+
+    def test__init__(self):
+        model = Model()
+        env = ChunkedGridWorld(20000, 20000, model, chunkSize=128)
+
+        assert env.getDimensions() == (20000, 20000)
+        assert env.chunkSize == 128
+        assert len(env.cells) == 20000 * 20000
+        assert env.cells.allocatedChunks() == 0
+
+    def test_addCellComponent(self):
+        env = ChunkedGridWorld(20000, 20000, Model(), chunkSize=128)
+
+        env.addCellComponent('elevation', lambda x, y: x + y, mode='coords')
+        env.cells['food'] = 0.0
+        env.cells.setValue('food', discreteGridPosToID(150, 20, 20000), 1.0)
+
+        assert env.getCell(150, 20) == {'pos': (150, 20), 'elevation': 170, 'food': 1.0}
+        assert env.getCell(20000, 0) is None
+        assert env.cells['elevation'].allocatedChunks() == 1
+        assert env.cells['food'].allocatedChunks() == 1
+
+    def test_shareCellComponent(self):
+        model = Model()
+        env = ChunkedGridWorld(10, 10, model, chunkSize=4)
+        env.cells['food'] = 0.0
+
+        with pytest.raises(Exception, match='chunked'):
+            env.shareCellComponent('food')
+        assert model.sharedLayers is None
+
+    def test_getNeighbours(self):
+        env = ChunkedGridWorld(10, 10, Model(), chunkSize=4)
+        env.addCellComponent('id', lambda x, y: discreteGridPosToID(x, y, 10), mode='coords')
+
+        # Test neighbours across chunk boundaries match a GridWorld
+        neighbours = env.getNeighbours((4, 4), moore=True)
+        assert neighbours == GridWorld(10, 10, Model()).getNeighbours((4, 4), moore=True)
+        assert list(env.cells.getValues('id', neighbours)) == neighbours
+
+    def test_addAgent(self):
+        model = Model()
+        model.environment = ChunkedGridWorld(20000, 20000, model)
+        agent = Agent("a1", model)
+
+        model.environment.addAgent(agent, 19999, 19999)
+        assert model.environment.getAgentsAt(19999, 19999) == [agent]
+
+
+class TestAgentDensity:
+
+    class DummyComponent(Component):
+        pass
+
+    def test_add(self):
+        model = Model()
+        density = AgentDensity((2, 3), (TestAgentDensity.DummyComponent,))
+        a1, a2 = Agent("a1", model), Agent("a2", model)
+        a2.addComponent(TestAgentDensity.DummyComponent(a2, model))
+
+        density.add(a1, 4)
+        density.add(a2, 4)
+
+        assert density.get()[1, 1] == 2
+        assert density.get(TestAgentDensity.DummyComponent)[1, 1] == 1
+        assert density.get().sum() == 2
+
+        with pytest.raises(Exception):
+            density.get(PositionComponent)
+
+    def test_move(self):
+        model = Model()
+        density = AgentDensity((2, 3), (TestAgentDensity.DummyComponent,))
+        agent = Agent("a1", model)
+        agent.addComponent(TestAgentDensity.DummyComponent(agent, model))
+        density.add(agent, 0)
+
+        density.move(agent.id, 5)
+        assert density.get()[0, 0] == 0 and density.get()[1, 2] == 1
+        assert density.get(TestAgentDensity.DummyComponent)[1, 2] == 1
+
+        density.remove(agent.id)
+        assert density.get().sum() == 0
+        assert density.get(TestAgentDensity.DummyComponent).sum() == 0
+
+    def test_rebuild(self):
+        model = Model()
+        density = AgentDensity((2, 3), (TestAgentDensity.DummyComponent,))
+        agents = [Agent("a" + str(i), model) for i in range(3)]
+        agents[0].addComponent(TestAgentDensity.DummyComponent(agents[0], model))
+
+        density.rebuild(agents, [1, 1, 5])
+        assert density.get()[0, 1] == 2 and density.get()[1, 2] == 1
+        assert density.get(TestAgentDensity.DummyComponent)[0, 1] == 1
+        assert density.get(TestAgentDensity.DummyComponent).sum() == 1
+
+        density.move("a2", 0)
+        assert density.get()[0, 0] == 1
+
+
+class TestWorldDensity:
+
+    def test_LineWorld(self):
+        model = Model()
+        model.environment = LineWorld(5, model)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, 1)
+
+        with pytest.raises(Exception):
+            model.environment.getDensity()
+
+        model.environment.trackDensity()
+        assert list(model.environment.getDensity()) == [0, 1, 0, 0, 0]
+
+        model.environment.moveAgent(agent.id, 4)
+        assert agent[PositionComponent].x == 4
+        assert list(model.environment.getDensity()) == [0, 0, 0, 0, 1]
+
+        with pytest.raises(Exception):
+            model.environment.moveAgent(agent.id, 5)
+
+        model.environment.removeAgent(agent.id)
+        assert model.environment.getDensity().sum() == 0
+
+    def test_GridWorld(self):
+        model = Model()
+        model.environment = GridWorld(4, 3, model)
+        model.environment.trackDensity(TestAgentDensity.DummyComponent)
+
+        agents = [Agent("a" + str(i), model) for i in range(3)]
+        agents[0].addComponent(TestAgentDensity.DummyComponent(agents[0], model))
+        for agent in agents:
+            model.environment.addAgent(agent, 3, 2)
+
+        density = model.environment.getDensity()
+        assert density.shape == (3, 4)
+        assert density[2, 3] == 3
+        assert model.environment.getDensity(TestAgentDensity.DummyComponent)[2, 3] == 1
+
+        model.environment.moveAgent("a0", 0, 1)
+        assert density[2, 3] == 2 and density[1, 0] == 1
+        assert model.environment.getDensity(TestAgentDensity.DummyComponent)[1, 0] == 1
+
+        with pytest.raises(Exception):
+            model.environment.moveAgent("a0", 0, 3)
+
+        # Test updateDensity after changing PositionComponents directly
+        agents[1][PositionComponent].x = 1
+        model.environment.updateDensity()
+        assert density[2, 1] == 1 and density[2, 3] == 1
+
+    def test_CubeWorld(self):
+        model = Model()
+        model.environment = CubeWorld(2, 3, 4, model)
+        agent = Agent("a1", model)
+        model.environment.addAgent(agent, 1, 2, 3)
+        model.environment.trackDensity()
+
+        assert model.environment.getDensity().shape == (4, 3, 2)
+        assert model.environment.getDensity()[3, 2, 1] == 1
+
+        model.environment.moveAgent(agent.id, 0, 0, 1)
+        assert agent[PositionComponent].getPosition() == (0, 0, 1)
+        assert model.environment.getDensity()[1, 0, 0] == 1
+        assert model.environment.getDensity().sum() == 1
+
+        with pytest.raises(Exception):
+            model.environment.moveAgent(agent.id, 0, 0, 4)
+
+
+class TestNetworkWorld:
+
+    def test__init__(self):
+        model = Model()
+        env = NetworkWorld(5, model)
+
+        assert env.size == 5
+        assert env.getDimensions() == 5
+        assert env.getEdgeCount() == 0
+        assert list(env.indptr) == [0] * 6
+        assert len(env.nodes) == 5
+
+        with pytest.raises(Exception):
+            NetworkWorld(0, model)
+
+    def test_loadEdges(self):
+        env = NetworkWorld(4, Model())
+        env.loadEdges([2, 0, 0], [3, 1, 2], layers={'weight': [0.5, 1.0, 2.0]})
+
+        assert env.getEdgeCount() == 6
+        assert list(env.getDegree()) == [2, 1, 2, 1]
+        assert list(env.getNeighbours(0)) == [1, 2]
+        assert list(env.getNeighbours(2)) == [3, 0]
+        assert list(env.edges['weight'][env.getEdgeIDs(2)]) == [0.5, 2.0]
+
+        # Test directed edges
+        env.loadEdges([2, 0, 0], [3, 1, 2], directed=True)
+        assert env.getEdgeCount() == 3
+        assert list(env.getNeighbours(3)) == []
+        assert len(env.edges) == 0
+
+        with pytest.raises(Exception):
+            env.loadEdges([0], [4])
+
+        with pytest.raises(Exception):
+            env.loadEdges([0, 1], [2])
+
+        with pytest.raises(Exception):
+            env.loadEdges([0], [1], layers={'weight': [1.0, 2.0]})
+
+    def test_addEdgeLayer(self):
+        env = NetworkWorld(3, Model())
+        env.loadEdges([0, 1], [1, 2])
+
+        env.addEdgeLayer('weight', 1.0)
+        assert list(env.edges['weight']) == [1.0] * 4
+
+        with pytest.raises(Exception):
+            env.addEdgeLayer('weight', [1.0, 2.0])
+
+    def test_addNodeComponent(self):
+        env = NetworkWorld(3, Model())
+        env.addNodeComponent('opinion', lambda x: x * 0.5, mode='coords')
+
+        assert list(env.nodes['opinion']) == [0.0, 0.5, 1.0]
+
+    def test_gatherNeighbours(self):
+        env = NetworkWorld(4, Model())
+        env.loadEdges([0, 0, 1], [1, 2, 3])
+
+        rows, neighbours, edgeIDs = env.gatherNeighbours([1, 3])
+        assert list(rows) == [0, 0, 1]
+        assert list(neighbours) == [3, 0, 1]
+        assert list(env.indices[edgeIDs]) == list(neighbours)
+
+    def test_sumNeighbours(self):
+        env = NetworkWorld(3, Model())
+        env.loadEdges([0, 1], [1, 2], layers={'weight': [2.0, 0.5]})
+
+        values = numpy.array([1.0, 10.0, 100.0])
+        assert list(env.sumNeighbours(values)) == [10.0, 101.0, 10.0]
+        assert list(env.sumNeighbours(values, 'weight')) == [20.0, 52.0, 5.0]
+
+    def test_agents(self):
+        model = Model()
+        model.environment = NetworkWorld(3, model)
+        agents = [Agent("a" + str(i), model) for i in range(3)]
+        for agent in agents:
+            model.environment.addAgent(agent, 1)
+
+        assert agents[0][NodeComponent].node == 1
+        assert len(model.environment.getAgentsAt(1)) == 3
+        assert list(model.environment.getDensity()) == [0, 3, 0]
+
+        model.environment.moveAgent("a0", 2)
+        assert model.environment.getAgentsAt(2) == [agents[0]]
+        assert list(model.environment.getDensity()) == [0, 2, 1]
+
+        model.environment.moveAgents(["a1", "a2"], [0, 2])
+        assert agents[1][NodeComponent].node == 0
+        assert list(model.environment.getDensity()) == [1, 0, 2]
+
+        model.environment.removeAgent("a0")
+        assert not agents[0].hasComponent(NodeComponent)
+        assert list(model.environment.getDensity()) == [1, 0, 1]
+
+        with pytest.raises(Exception):
+            model.environment.addAgent(Agent("a3", model), 3)
+
+        with pytest.raises(Exception):
+            model.environment.moveAgent("a1", -1)
+
+        with pytest.raises(Exception):
+            model.environment.moveAgents(["a1"], [3])
@@ -0,0 +1,115 @@
+import numpy
+import pytest
+
+from ECAgent.Environments import *
+from ECAgent.Kernels import *
+from ECAgent.Stencils import diffuse
+
+backends = [NumpyKernels] + ([NumbaKernels] if NUMBA_AVAILABLE else [])
+
+
+def test_getKernels():
+    assert getKernels() is NumpyKernels
+    assert getKernels('numpy') is NumpyKernels
+
+    if NUMBA_AVAILABLE:
+        assert getKernels('numba') is NumbaKernels
+        assert getKernels('auto') is NumbaKernels
+    else:
+        with pytest.warns(UserWarning):
+            assert getKernels('numba') is NumpyKernels
+        assert getKernels('auto') is NumpyKernels
+
+    with pytest.raises(Exception):
+        getKernels('unknown')
+
+
+@pytest.mark.parametrize('kernels', backends)
+class TestKernels:
+
+    def test_neighbourIDs(self, kernels):
+        # Test 1D
+        assert list(kernels.neighbourIDs(2, (5,))) == [1, 3]
+        assert list(kernels.neighbourIDs(0, (5,), radius=2, includeSelf=True)) == [0, 1, 2]
+
+        # Test 2D against a brute force search
+        for cellID in range(12):
+            y, x = divmod(cellID, 4)
+            expected = [other for other in range(12)
+                        if abs(other // 4 - y) <= 2 and abs(other % 4 - x) <= 2 and other != cellID]
+            assert list(kernels.neighbourIDs(cellID, (3, 4), radius=2)) == expected
+
+        # Test 3D
+        assert len(kernels.neighbourIDs(13, (3, 3, 3))) == 26
+        assert len(kernels.neighbourIDs(0, (3, 3, 3), includeSelf=True)) == 8
+
+    def test_updateOccupancy(self, kernels):
+        counts = numpy.zeros((2, 3), dtype=numpy.int32)
+        kernels.updateOccupancy(counts, [], [0, 0, 5])
+        assert counts[0, 0] == 2 and counts[1, 2] == 1
+
+        kernels.updateOccupancy(counts, [0, 5], [4, 4])
+        assert counts[0, 0] == 1 and counts[1, 1] == 2 and counts[1, 2] == 0
+
+    def test_diffuse(self, kernels):
+        rng = numpy.random.default_rng(0)
+        for shape in [(7,), (5, 6), (3, 4, 5)]:
+            layer = rng.random(shape)
+            for toroidal in [False, True]:
+                for moore in [False, True]:
+                    result = kernels.diffuse(layer, 0.3, toroidal, moore)
+                    assert result.shape == shape
+                    assert numpy.allclose(result, diffuse(layer, 0.3, toroidal, moore))
+
+        with pytest.raises(Exception):
+            kernels.diffuse(layer, 2.0)
+
+    def test_movePositions(self, kernels):
+        positions = numpy.array([[0, 0], [3, 2], [1, 1]])
+        deltas = numpy.array([[-1, 0], [1, 1], [1, 0]])
+
+        moved, ids = kernels.movePositions(positions, deltas, (4, 3))
+        assert moved.tolist() == [[0, 0], [3, 2], [2, 1]]
+        assert ids.tolist() == [0, 11, 6]
+
+        moved, ids = kernels.movePositions(positions, deltas, (4, 3), toroidal=True)
+        assert moved.tolist() == [[3, 0], [0, 0], [2, 1]]
+        assert ids.tolist() == [3, 0, 6]
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'] if NUMBA_AVAILABLE else ['numpy'])
+class TestWorldBackends:
+
+    def test_getNeighbours(self, backend):
+        world = GridWorld(3, 3, Model(), backend=backend)
+        assert world.getNeighbours((1, 1)) == [0, 1, 2, 3, 5, 6, 7, 8]
+
+        world = CubeWorld(3, 3, 3, Model(), backend=backend)
+        assert world.getNeighbours((0, 1, 0)) == [0, 1, 4, 6, 7, 9, 10, 12, 13, 15, 16]
+
+    def test_moveAgents(self, backend):
+        model = Model()
+        model.environment = GridWorld(4, 3, model, backend=backend)
+        agents = [Agent("a" + str(i), model) for i in range(3)]
+        for agent in agents:
+            model.environment.addAgent(agent, 1, 1)
+        model.environment.trackDensity()
+
+        model.environment.moveAgents(["a0", "a1"], [[1, 0], [-5, 5]])
+        assert agents[0][PositionComponent].getPosition()[:2] == (2, 1)
+        assert agents[1][PositionComponent].getPosition()[:2] == (0, 2)
+        assert model.environment.getDensity()[1, 1] == 1
+        assert model.environment.getDensity()[1, 2] == 1
+        assert model.environment.getDensity()[2, 0] == 1
+
+        # Test a single delta for every agent on a toroidal world
+        model.environment.moveAgents(["a0", "a1", "a2"], [2, 0], toroidal=True)
+        assert agents[0][PositionComponent].x == 0
+        assert model.environment.getDensity().sum() == 3
+        assert model.environment.getDensity()[1, 0] == 1
+
+    def test_setBackend(self, backend):
+        world = LineWorld(5, Model())
+        world.setBackend(backend)
+        assert world.kernels.name == backend
+        assert world.getNeighbours(2) == [1, 3]
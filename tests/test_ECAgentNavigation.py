@@ -0,0 +1,140 @@
+import numpy
+import pytest
+
+from ECAgent.Core import Model
+from ECAgent.Environments import GridWorld
+from ECAgent.Navigation import *
+
+# 0 = wall. Each row of the list is a row (y) of a 5x4 world. Cells (2, 2) and (2, 3) are walled in.
+MAZE = [[1, 1, 1, 1, 1],
+        [1, 0, 0, 0, 1],
+        [1, 0, 1, 0, 1],
+        [1, 0, 1, 0, 1]]
+
+
+def createWorld():
+    world = GridWorld(5, 4, Model())
+    world.cells['passable'] = numpy.array(MAZE).reshape(-1)
+    return world
+
+
+class TestFlowFields:
+
+    def test__init__(self):
+        world = createWorld()
+        fields = FlowFields(world, 'passable')
+
+        assert fields.world is world
+        assert len(fields.offsets) == 4
+        assert len(FlowFields(world, moore=True).offsets) == 8
+        assert fields.snapshot.sum() == 13
+        assert len(fields.fields) == 0
+
+    def test_getDistanceField(self):
+        fields = FlowFields(createWorld(), 'passable')
+        distance = fields.getDistanceField([(0, 3)])
+
+        assert distance.shape == (4, 5)
+        assert distance[3, 0] == 0
+        assert distance[0, 0] == 3
+        assert distance[0, 4] == 7
+        assert distance[3, 4] == 10
+        assert distance[3, 2] == -1  # Walled in
+        assert distance[1, 1] == -1  # Wall
+
+        # Test multiple targets
+        distance = fields.getDistanceField([(0, 3), (4, 3)])
+        assert distance[0, 4] == 3
+        assert distance[0, 2] == 5
+
+        # Test Moore movement
+        fields = FlowFields(createWorld(), 'passable', moore=True)
+        assert fields.getDistanceField([(0, 0)])[3, 4] == 6
+        assert fields.getDistanceField([(0, 0)])[2, 2] == -1
+
+        # Test without a passable layer
+        assert FlowFields(createWorld()).getDistanceField([(0, 0)])[3, 4] == 7
+
+    def test_getFlowField(self):
+        fields = FlowFields(createWorld(), 'passable')
+        flow = fields.getFlowField([(0, 3)])
+
+        assert flow[3, 0] == discreteGridPosToID(0, 3, 5)
+        assert flow[0, 0] == discreteGridPosToID(0, 1, 5)
+        assert flow[0, 1] == discreteGridPosToID(0, 0, 5)
+        assert flow[3, 2] == -1
+
+    def test_getNextStep(self):
+        fields = FlowFields(createWorld(), 'passable')
+
+        # Test following the flow field reaches the target
+        pos = (4, 3)
+        for _ in range(10):
+            pos = fields.getNextStep([(0, 3)], *pos)
+        assert pos == (0, 3)
+
+        assert fields.getNextStep([(0, 3)], 2, 3) is None
+
+    def test_getNextSteps(self):
+        fields = FlowFields(createWorld(), 'passable')
+
+        steps = fields.getNextSteps([(0, 3)], [[0, 0], [2, 3], [0, 3]])
+        assert steps.tolist() == [[0, 1], [2, 3], [0, 3]]
+
+    def test_cache(self):
+        fields = FlowFields(createWorld(), 'passable', cacheSize=2)
+
+        first = fields.getDistanceField([(0, 3)])
+        assert fields.getDistanceField([(0, 3)]) is first
+        assert fields.getDistanceField([(0, 3), (0, 3)]) is first
+
+        # Test the least recently used field is discarded
+        fields.getDistanceField([(4, 3)])
+        fields.getDistanceField([(4, 0)])
+        assert len(fields.fields) == 2
+        assert fields.getDistanceField([(0, 3)]) is not first
+
+        fields.invalidate()
+        assert len(fields.fields) == 0
+
+    def test_update(self):
+        world = createWorld()
+        fields = FlowFields(world, 'passable')
+
+        left = fields.getDistanceField([(0, 3)])
+        right = fields.getDistanceField([(4, 3)])
+        enclosed = fields.getDistanceField([(2, 3)])
+
+        # Test blocking a cell only invalidates the fields that could reach it
+        fields.setPassable(0, 1, False)
+        assert fields.getDistanceField([(0, 3)]) is not left
+        assert fields.getDistanceField([(4, 3)]) is not right
+        assert fields.getDistanceField([(2, 3)]) is enclosed
+        assert fields.getDistanceField([(0, 3)])[0, 0] == -1
+
+        # Test opening a cell next to a reachable cell
+        world.cells['passable'][1, 2] = 1
+        fields.update()
+        assert fields.getDistanceField([(2, 3)]) is not enclosed
+        assert fields.getDistanceField([(2, 3)])[0, 2] == 3
+
+        with pytest.raises(Exception):
+            FlowFields(world).setPassable(0, 0, False)
+
+    def test_layerVersion(self):
+        world = createWorld()
+        fields = FlowFields(world, 'passable')
+
+        left = fields.getDistanceField([(0, 3)])
+        enclosed = fields.getDistanceField([(2, 3)])
+        assert left[0, 0] == 3
+
+        # Test modifying the passable layer invalidates the affected fields without calling update()
+        world.cells.setValue('passable', 5, 0)
+        assert fields.getDistanceField([(0, 3)]) is not left
+        assert fields.getDistanceField([(0, 3)])[0, 0] == -1
+        assert fields.getDistanceField([(2, 3)]) is enclosed
+
+        # Test replacing the whole layer
+        world.cells['passable'] = 1
+        assert fields.getDistanceField([(2, 3)])[0, 2] == 3
@@ -0,0 +1,167 @@
+import threading
+import time
+
+import numpy
+import pytest
+
+from ECAgent.Sinks import *
+
+
+class TestSink:
+
+    def test_abstractMethods(self, tmp_path):
+        sink = Sink(str(tmp_path))
+
+        with pytest.raises(Exception):
+            sink.write({'a': [1]})
+
+        with pytest.raises(Exception):
+            sink.readChunk('chunk_00000')
+
+    def test_emptyDataFrame(self, tmp_path):
+        assert len(CSVSink(str(tmp_path)).to_dataframe()) == 0
+
+
+class TestCSVSink:
+
+    def test_write(self, tmp_path):
+        sink = CSVSink(str(tmp_path))
+        sink.write({'a': [1, 2], 'b': ['x', 'y']})
+        sink.write({'a': [3], 'b': ['z']})
+
+        assert len(sink) == 2
+        assert (tmp_path / 'chunk_00000.csv').exists()
+        assert (tmp_path / 'chunk_00001.csv').exists()
+
+        chunks = list(sink)
+        assert chunks[0]['a'].tolist() == [1, 2]
+        assert chunks[1]['b'].tolist() == ['z']
+
+        df = sink.to_dataframe()
+        assert df['a'].tolist() == [1, 2, 3]
+
+    def test_reopen(self, tmp_path):
+        CSVSink(str(tmp_path)).write({'a': [1]})
+
+        # Existing chunks are picked up and new chunks are numbered after them
+        sink = CSVSink(str(tmp_path))
+        assert len(sink) == 1
+        sink.write({'a': [2]})
+        assert sink.to_dataframe()['a'].tolist() == [1, 2]
+
+        # Chunks with a different prefix are ignored
+        assert len(CSVSink(str(tmp_path), prefix='other')) == 0
+
+
+class TestNumpySink:
+
+    def test_write(self, tmp_path):
+        sink = NumpySink(str(tmp_path), compressed=True)
+        sink.write({'a': numpy.arange(3), 'b': numpy.array(['x', 'y', 'z'], dtype=object)})
+
+        chunk = next(iter(sink))
+        assert chunk['a'].tolist() == [0, 1, 2]
+        assert chunk['b'].tolist() == ['x', 'y', 'z']
+
+
+@pytest.mark.skipif(not PARQUET_AVAILABLE, reason="pyarrow is not installed")
+class TestParquetSink:
+
+    def test_write(self, tmp_path):
+        sink = ParquetSink(str(tmp_path))
+        sink.write({'a': numpy.arange(3), 'b': ['x', 'y', 'z']})
+
+        chunk = next(iter(sink))
+        assert chunk['a'].tolist() == [0, 1, 2]
+        assert chunk['b'].tolist() == ['x', 'y', 'z']
+
+
+@pytest.mark.skipif(PARQUET_AVAILABLE, reason="pyarrow is installed")
+def test_parquetUnavailable(tmp_path):
+    with pytest.raises(Exception):
+        ParquetSink(str(tmp_path))
+
+
+class SlowSink(Sink):
+    """A sink that keeps chunks in memory and waits for an event before writing each one"""
+
+    def __init__(self):
+        self.chunks = []
+        self.written = []
+        self.event = threading.Event()
+
+    def write(self, columns: dict):
+        self.event.wait()
+        if 'fail' in columns:
+            raise ValueError("fail")
+        self.chunks.append(len(self.chunks))
+        self.written.append(columns)
+
+    def readChunk(self, path) -> dict:
+        return self.written[path]
+
+
+class TestThreadedSink:
+
+    def test__init__(self, tmp_path):
+        with pytest.raises(Exception):
+            ThreadedSink(CSVSink(str(tmp_path)), backpressure='unknown')
+
+    def test_write(self, tmp_path):
+        values = numpy.arange(3)
+        with ThreadedSink(NumpySink(str(tmp_path))) as sink:
+            sink.write({'a': values})
+            values[:] = -1  # The queued chunk is a copy
+
+            assert sink.to_dataframe()['a'].tolist() == [0, 1, 2]
+            assert len(sink) == 1
+
+        assert not sink.thread.is_alive()
+        with pytest.raises(Exception):
+            sink.write({'a': values})
+
+    def test_block(self):
+        inner = SlowSink()
+        sink = ThreadedSink(inner, maxChunks=1, timeout=0.05)
+
+        sink.write({'a': [1]})  # Taken by the writer thread, which waits for the event
+        time.sleep(0.05)
+        sink.write({'a': [2]})  # Fills the queue
+
+        with pytest.raises(Exception):
+            sink.write({'a': [3]})
+        assert sink.waitTime >= 0.05
+        assert sink.maxWaitTime >= 0.05
+
+        inner.event.set()
+        sink.close()
+        assert len(inner.written) == 2
+
+    def test_drop(self):
+        inner = SlowSink()
+        sink = ThreadedSink(inner, maxChunks=1, backpressure='drop')
+
+        sink.write({'a': [1]})
+        time.sleep(0.05)
+        sink.write({'a': [2]})
+        sink.write({'a': [3]})
+
+        assert sink.dropped == 1
+        assert sink.waitTime == 0.0
+
+        inner.event.set()
+        sink.close()
+        assert [chunk['a'].tolist() for chunk in inner.written] == [[1], [2]]
+
+    def test_errors(self):
+        inner = SlowSink()
+        inner.event.set()
+        sink = ThreadedSink(inner)
+
+        sink.write({'fail': [1]})
+        with pytest.raises(Exception):
+            sink.join()
+        with pytest.raises(Exception):
+            sink.write({'a': [1]})
+        with pytest.raises(Exception):
+            sink.close()
@@ -0,0 +1,113 @@
+import math
+
+import numpy
+import pytest
+
+from ECAgent.Statistics import *
+
+
+def test_gini():
+    assert gini([1, 1, 1, 1]) == pytest.approx(0.0)
+    assert gini([0, 0, 0, 4]) == pytest.approx(0.75)
+    assert gini([]) == 0.0
+    assert gini([0, 0]) == 0.0
+
+
+class TestRunningStatistics:
+
+    def test_update(self):
+        values = numpy.random.default_rng(0).normal(5.0, 2.0, 1000)
+        statistics = RunningStatistics()
+
+        assert math.isnan(statistics.getMean())
+        assert math.isnan(statistics.getVariance())
+
+        for batch in numpy.array_split(values, 7):
+            statistics.update(batch)
+        statistics.update([math.nan])  # NaNs are ignored
+
+        assert statistics.count == 1000
+        assert statistics.getMean() == pytest.approx(values.mean())
+        assert statistics.getVariance() == pytest.approx(values.var())
+        assert statistics.getVariance(1) == pytest.approx(values.var(ddof=1))
+        assert statistics.getStd() == pytest.approx(values.std())
+        assert statistics.min == values.min()
+        assert statistics.max == values.max()
+
+    def test_merge(self):
+        a, b = RunningStatistics(), RunningStatistics()
+        a.update([1, 2, 3])
+        b.update([10, 20])
+        a.merge(b)
+        a.merge(RunningStatistics())  # Merging empty statistics does nothing
+
+        assert a.count == 5
+        assert a.getMean() == pytest.approx(numpy.mean([1, 2, 3, 10, 20]))
+        assert a.getVariance() == pytest.approx(numpy.var([1, 2, 3, 10, 20]))
+        assert a.min == 1
+        assert a.max == 20
+
+
+class TestHistogram:
+
+    def test__init__(self):
+        with pytest.raises(Exception):
+            Histogram(1, 1)
+
+        histogram = Histogram(0, 10, 5)
+        assert histogram.getEdges().tolist() == [0, 2, 4, 6, 8, 10]
+
+    def test_update(self):
+        histogram = Histogram(0, 10, 5)
+        histogram.update([-1, 0, 1.9, 2, 9.9, 10, 11, math.nan])
+
+        assert histogram.counts.tolist() == [2, 1, 0, 0, 2]
+        assert histogram.underflow == 1
+        assert histogram.overflow == 1
+
+    def test_merge(self):
+        a, b = Histogram(0, 10, 5), Histogram(0, 10, 5)
+        a.update([1, 3])
+        b.update([3, 20])
+        a.merge(b)
+
+        assert a.counts.tolist() == [1, 2, 0, 0, 0]
+        assert a.overflow == 1
+
+        with pytest.raises(Exception):
+            a.merge(Histogram(0, 5, 5))
+
+
+class TestQuantileSketch:
+
+    def test__init__(self):
+        with pytest.raises(Exception):
+            QuantileSketch(0.0)
+
+        assert numpy.isnan(QuantileSketch().getQuantile(0.5))
+
+    def test_getQuantiles(self):
+        values = numpy.random.default_rng(0).normal(0.0, 10.0, 10000)
+        sketch = QuantileSketch(0.01)
+        sketch.update(values)
+        sketch.update([0.0, math.nan])
+        values = numpy.append(values, 0.0)
+
+        assert sketch.count == 10001
+        quantiles = [0.0, 0.1, 0.5, 0.9, 1.0]
+        for estimate, exact in zip(sketch.getQuantiles(quantiles), numpy.quantile(values, quantiles)):
+            assert estimate == pytest.approx(exact, rel=0.02, abs=0.05)
+
+    def test_merge(self):
+        values = numpy.random.default_rng(1).exponential(3.0, 5000)
+        a, b, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        a.update(values[:2000])
+        b.update(values[2000:])
+        whole.update(values)
+        a.merge(b)
+
+        assert a.count == whole.count
+        assert a.getQuantiles([0.25, 0.5, 0.99]).tolist() == whole.getQuantiles([0.25, 0.5, 0.99]).tolist()
+
+        with pytest.raises(Exception):
+            a.merge(QuantileSketch(0.05))
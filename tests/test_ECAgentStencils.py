@@ -0,0 +1,142 @@
+import numpy
+import pytest
+
+from ECAgent.Environments import *
+from ECAgent.Stencils import *
+
+
+def test_neighbourhoodKernel():
+    assert (neighbourhoodKernel(1) == [1, 0, 1]).all()
+    assert (neighbourhoodKernel(2) == [[0, 1, 0], [1, 0, 1], [0, 1, 0]]).all()
+    assert (neighbourhoodKernel(2, moore=True) == [[1, 1, 1], [1, 0, 1], [1, 1, 1]]).all()
+    assert neighbourhoodKernel(3).sum() == 6
+    assert neighbourhoodKernel(3, moore=True).sum() == 26
+
+
+def test_convolve():
+    layer = numpy.arange(5, dtype=float)
+
+    # Test bounded edges
+    assert list(convolve(layer, [1, 0, 0])) == [1, 2, 3, 4, 0]
+    assert list(convolve(layer, [1, 0, 0], fill=-1)) == [1, 2, 3, 4, -1]
+
+    # Test toroidal edges
+    assert list(convolve(layer, [1, 0, 0], toroidal=True)) == [1, 2, 3, 4, 0]
+    assert list(convolve(layer, [0, 0, 1], toroidal=True)) == [4, 0, 1, 2, 3]
+
+    # Test 2D sum of neighbours
+    layer = numpy.zeros((3, 3))
+    layer[1, 1] = 1.0
+    result = convolve(layer, numpy.ones((3, 3)))
+    assert (result == 1.0).all()
+
+    # Test out parameter
+    out = numpy.zeros((3, 3))
+    assert convolve(layer, numpy.ones((3, 3)), out=out) is out
+    assert (out == 1.0).all()
+
+    # Test invalid kernels
+    with pytest.raises(Exception):
+        convolve(layer, numpy.ones((2, 3)))
+
+    with pytest.raises(Exception):
+        convolve(layer, numpy.ones(3))
+
+
+def test_diffuse():
+    layer = numpy.zeros((5, 5))
+    layer[2, 2] = 1.0
+
+    result = diffuse(layer, 0.5)
+    assert result[2, 2] == 0.5
+    assert result[1, 2] == result[2, 1] == result[3, 2] == result[2, 3] == 0.125
+    assert result[1, 1] == 0.0
+
+    # Test that mass is conserved at the edges of bounded worlds
+    layer = numpy.zeros((5, 5))
+    layer[0, 0] = 1.0
+    result = diffuse(layer, 0.4, moore=True)
+    assert result.sum() == pytest.approx(1.0)
+    assert result[0, 1] == pytest.approx(0.05)
+    assert result[0, 0] == pytest.approx(0.6 + 0.05 * 5)
+
+    # Test toroidal diffusion
+    result = diffuse(layer, 0.4, toroidal=True)
+    assert result[4, 0] == pytest.approx(0.1)
+    assert result[0, 4] == pytest.approx(0.1)
+    assert result.sum() == pytest.approx(1.0)
+
+    with pytest.raises(Exception):
+        diffuse(layer, 1.5)
+
+
+def test_decay():
+    assert list(decay(numpy.array([1.0, 2.0]), 0.25)) == [0.75, 1.5]
+
+    with pytest.raises(Exception):
+        decay(numpy.array([1.0]), -0.1)
+
+
+def test_regrow():
+    layer = numpy.array([0.0, 0.5, 1.0])
+
+    assert list(regrow(layer, 0.75, 1.0)) == [0.75, 1.0, 1.0]
+    assert list(regrow(layer, 0.5, 1.0, mode='proportional')) == [0.5, 0.75, 1.0]
+    assert list(regrow(layer, 0.5, 1.0, mode='logistic')) == [0.0, 0.625, 1.0]
+    assert list(regrow(layer, 0.5, numpy.array([2.0, 0.0, 2.0]))) == [0.5, 0.0, 1.5]
+
+    with pytest.raises(Exception):
+        regrow(layer, 0.5, 1.0, mode='unknown')
+
+
+class TestCellLayerSystems:
+
+    def test_DiffusionSystem(self):
+        model = Model()
+        model.environment = GridWorld(5, 5, model)
+        model.environment.addCellComponent('pheromone', lambda shape, rng: numpy.zeros(shape), mode='shape')
+        model.environment.cells.setValue('pheromone', discreteGridPosToID(2, 2, 5), 1.0)
+        layer = model.environment.cells['pheromone']
+
+        model.systemManager.addSystem(DiffusionSystem('diffusion', model, 'pheromone', 0.5))
+        model.systemManager.executeSystems()
+
+        # Test the layer is updated in place
+        assert model.environment.cells['pheromone'] is layer
+        assert layer[2, 2] == 0.5
+        assert layer[2, 3] == 0.125
+
+        # Test the layer is marked as modified so cached tables are rebuilt
+        assert model.environment.regions.getSumsInRadius('pheromone', [2, 2], 0)[0] == 0.5
+
+    def test_DecaySystem(self):
+        model = Model()
+        model.environment = LineWorld(3, model)
+        model.environment.addCellComponent('pollution', lambda x: x * 1.0, mode='coords')
+
+        model.systemManager.addSystem(DecaySystem('decay', model, 'pollution', 0.5))
+        model.systemManager.executeSystems()
+
+        assert list(model.environment.cells['pollution']) == [0.0, 0.5, 1.0]
+
+    def test_RegrowthSystem(self):
+        model = Model()
+        model.environment = GridWorld(2, 1, model)
+        model.environment.cells['resource'] = [0.0, 0.0]
+        model.environment.cells['capacity'] = [1.0, 0.25]
+
+        model.systemManager.addSystem(RegrowthSystem('regrow', model, 'resource', 0.5, 'capacity'))
+        model.systemManager.executeSystems()
+
+        assert list(model.environment.cells['resource'][0]) == [0.5, 0.25]
+
+    def test_ConvolutionSystem(self):
+        model = Model()
+        model.environment = CubeWorld(3, 3, 3, model)
+        model.environment.cells['value'] = 1.0
+
+        model.systemManager.addSystem(ConvolutionSystem('blur', model, 'value', numpy.ones((3, 3, 3)),
+                                                        toroidal=True))
+        model.systemManager.executeSystems()
+
+        assert (model.environment.cells['value'] == 27.0).all()
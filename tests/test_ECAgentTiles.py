@@ -0,0 +1,138 @@
+import numpy
+import pytest
+
+from ECAgent.Core import *
+from ECAgent.Environments import *
+from ECAgent.Stencils import convolve, neighbourhoodKernel
+from ECAgent.Tiles import *
+
+
+def sumNeighbours(tile, rng):
+    """Replaces every cell with the sum of its von Neumann neighbours"""
+    layer = tile.layers['value']
+    height, width = tile.getShape()
+    tile.interior('value')[...] = layer[0:height, 1:width + 1] + layer[2:height + 2, 1:width + 1] + \
+        layer[1:height + 1, 0:width] + layer[1:height + 1, 2:width + 2]
+
+
+def randomWalk(tile, rng):
+    """Moves every agent randomly and counts how often each cell is visited"""
+    for agent in tile.agents.values():
+        agent.x += int(rng.integers(-2, 3))
+        agent.y += int(rng.integers(-2, 3))
+        agent.data['steps'] = agent.data.get('steps', 0) + 1
+        if tile.contains(agent.x, agent.y):
+            tile.setValue('visits', agent.x, agent.y, tile.getValue('visits', agent.x, agent.y) + 1)
+
+
+def failingStep(tile, rng):
+    raise ValueError("Tile " + str(tile.index) + " failed")
+
+
+def createWorld(width=8, height=6, agents=0):
+    model = Model(seed=7)
+    model.environment = GridWorld(width, height, model)
+    model.environment.cells['value'] = numpy.arange(width * height)
+    model.environment.cells['visits'] = 0
+    for i in range(agents):
+        model.environment.addAgent(Agent('a' + str(i), model), i % width, i % height)
+    return model.environment
+
+
+class TestTile:
+
+    def test_tile(self):
+        tile = Tile(0, (2, 3), (5, 5), 1)
+        tile.layers['value'] = numpy.arange(20).reshape(4, 5)
+
+        assert tile.getShape() == (2, 3)
+        assert tile.interior('value').tolist() == [[6, 7, 8], [11, 12, 13]]
+        assert tile.contains(2, 3) and not tile.contains(5, 3)
+        assert tile.toLocal(2, 3) == (1, 1)
+        assert tile.getValue('value', 1, 2) == 0
+
+        tile.setValue('value', 4, 4, -1)
+        assert tile.layers['value'][2, 3] == -1
+
+        with pytest.raises(Exception):
+            tile.setValue('value', 1, 2, 0)
+
+
+class TestTiledGridWorld:
+
+    def test__init__(self):
+        world = createWorld()
+        tiled = TiledGridWorld(world, (2, 3), seed=1)
+
+        assert len(tiled.tiles) == 6
+        assert tiled.tiles[1].lower == (4, 0) and tiled.tiles[1].upper == (8, 2)
+        assert tiled.getTileIndex(5, 3) == 3
+        assert list(tiled.getTileIndex(numpy.array([0, 7]), numpy.array([0, 5]))) == [0, 5]
+        assert tiled.layers == ['value', 'visits']
+
+        with pytest.raises(Exception):
+            TiledGridWorld(world, (9, 1))
+
+        with pytest.raises(Exception):
+            TiledGridWorld(world, (4, 3), halo=3)
+
+    @pytest.mark.parametrize('processes', [False, True])
+    @pytest.mark.parametrize('toroidal', [False, True])
+    def test_haloExchange(self, processes, toroidal):
+        world = createWorld()
+        expected = numpy.arange(48).reshape(6, 8)
+        for _ in range(3):
+            expected = convolve(expected, neighbourhoodKernel(2), toroidal=toroidal).astype(int)
+
+        with TiledGridWorld(world, (2, 3), toroidal=toroidal, layers=['value'], processes=processes) as tiled:
+            tiled.start(sumNeighbours)
+            tiled.run(3)
+            tiled.gather()
+
+        assert tiled.tick == 3
+        assert (world.cells['value'] == expected).all()
+
+    def test_migration(self):
+        results = []
+        for processes in [False, True]:
+            world = createWorld(agents=20)
+            with TiledGridWorld(world, (2, 2), toroidal=True, seed=3, processes=processes) as tiled:
+                tiled.start(randomWalk)
+                tiled.run(10)
+                agents = tiled.gather()
+
+            assert len(agents) == 20
+            assert all(agent.data['steps'] == 10 for agent in agents.values())
+            assert world.cells['visits'].sum() <= 200
+
+            # Every agent is in the tile that owns its position
+            for agent in world.getAgents():
+                x, y, _ = agent[PositionComponent].getPosition()
+                assert (x, y) == (agents[agent.id].x, agents[agent.id].y)
+
+            results.append((world.cells['visits'].copy(), [agents[key].x for key in sorted(agents)]))
+
+        # Test runs are deterministic regardless of how the tiles are executed
+        assert (results[0][0] == results[1][0]).all()
+        assert results[0][1] == results[1][1]
+
+    def test_bounded(self):
+        world = createWorld(agents=1)
+        tiled = TiledGridWorld(world, (2, 2), processes=False)
+
+        with pytest.raises(Exception):
+            tiled.step()
+
+        tiled.start(lambda tile, rng: [setattr(agent, 'x', -1) for agent in tile.agents.values()])
+
+        with pytest.raises(Exception):
+            tiled.start(randomWalk)
+
+        with pytest.raises(Exception):
+            tiled.step()
+
+    def test_workerErrors(self):
+        with TiledGridWorld(createWorld(), (2, 1)) as tiled:
+            tiled.start(failingStep)
+            with pytest.raises(ValueError):
+                tiled.step()
@@ -1,3 +1,16 @@
+import numpy
 import pytest
 
 from ECAgent.Visualization import *
+
+
+def test_createAnimatedHeatMap():
+    frames = numpy.arange(24).reshape(2, 3, 4)
+    figure = createAnimatedHeatMap("Test", frames, timesteps=[0, 5])
+
+    assert len(figure.frames) == 2
+    assert figure.frames[1].name == '5'
+    assert numpy.array_equal(figure.data[0].z, frames[0])
+    assert figure.data[0].zmin == 0
+    assert figure.data[0].zmax == 23
+    assert len(figure.layout.sliders[0].steps) == 2